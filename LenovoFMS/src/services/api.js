@@ -16,6 +16,7 @@ export const stopSimulation = () => apiClient.post('/api/simulation/stop')
 export const clearSimulationEvents = () => apiClient.post('/api/simulation/clear')
 export const getSimulationStatus = () => apiClient.get('/api/simulation/status')
 export const resetOrdersToInitialState = () => apiClient.post('/api/simulation/reset-orders')
+export const fetchJob = (jobId) => apiClient.get(`/api/jobs/${jobId}`)
 
 export const fetchDevices = (params = {}) => apiClient.get('/api/devices', { params })
 
@@ -10,6 +10,7 @@ export const fetchHomeOverview = () => apiClient.get('/api/home/overview')
 export const fetchHomeDeployments = () => apiClient.get('/api/home/deployments')
 
 export const fetchDevices = (params = {}) => apiClient.get('/api/devices', { params })
+export const autocompleteDevices = (q, params = {}) => apiClient.get('/api/devices/autocomplete', { params: { q, ...params } })
 export const fetchDevice = (deviceId) => apiClient.get(`/api/devices/${deviceId}`)
 export const createDevice = (data) => apiClient.post('/api/devices', data)
 export const updateDevice = (deviceId, data) => apiClient.put(`/api/devices/${deviceId}`, data)
@@ -34,6 +35,9 @@ export const updateUserProfile = (userData) => apiClient.put('/api/auth/profile'
 // 应用管理 API
 export const fetchApplications = () => apiClient.get('/api/applications')
 
+// 工位 API
+export const fetchStations = (params = {}) => apiClient.get('/api/stations', { params })
+
 // 标签类型管理 API
 export const fetchLabelTypes = (params = {}) => apiClient.get('/api/laptop-label-types', { params })
 export const createLabelType = (data) => apiClient.post('/api/laptop-label-types', data)
@@ -45,6 +49,7 @@ export const fetchApplicationTopology = (applicationId) => apiClient.get(`/api/a
 export const createTopologyConnection = (applicationId, data) => apiClient.post(`/api/applications/${applicationId}/topology`, data)
 export const updateTopologyConnection = (topologyId, data) => apiClient.put(`/api/topology/${topologyId}`, data)
 export const deleteTopologyConnection = (topologyId) => apiClient.delete(`/api/topology/${topologyId}`)
+export const batchTopologyConnections = (applicationId, diff) => apiClient.post(`/api/applications/${applicationId}/topology/batch`, diff)
 
 // 添加 token 到请求头
 apiClient.interceptors.request.use((config) => {
@@ -0,0 +1,168 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import Index, func, literal_column, null
+
+from database import ProductionProduct
+
+CYCLE_TIME_BUCKETS = ("hour", "day", "shift")
+# Three 8-hour shifts starting at 08:00
+SHIFT_START_HOUR = 8
+SHIFT_LENGTH_HOURS = 8
+PERCENTILES = (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+
+# Range scans over completed products by completion time
+product_completion_index = Index(
+    "ix_production_products_status_produced_end",
+    ProductionProduct.status,
+    ProductionProduct.produced_end,
+)
+
+
+def ensure_analytics_indexes(bind):
+    product_completion_index.create(bind, checkfirst=True)
+
+
+def _filters(start=None, end=None, product_type_id=None, order_id=None):
+    filters = [
+        ProductionProduct.status == "completed",
+        ProductionProduct.produced_at.isnot(None),
+        ProductionProduct.produced_end.isnot(None),
+        ProductionProduct.produced_end > ProductionProduct.produced_at,
+    ]
+    if start is not None:
+        filters.append(ProductionProduct.produced_end >= start)
+    if end is not None:
+        filters.append(ProductionProduct.produced_end < end)
+    if product_type_id is not None:
+        filters.append(ProductionProduct.product_type_id == product_type_id)
+    if order_id is not None:
+        filters.append(ProductionProduct.order_id == order_id)
+    return filters
+
+
+def _bucket_expression(bucket):
+    produced_end = ProductionProduct.produced_end
+    if bucket in ("hour", "day"):
+        return func.date_trunc(bucket, produced_end)
+    shifted = produced_end - timedelta(hours=SHIFT_START_HOUR)
+    return (
+        func.date_trunc("day", shifted)
+        + timedelta(hours=SHIFT_START_HOUR)
+        + func.floor(func.extract("hour", shifted) / SHIFT_LENGTH_HOURS) * timedelta(hours=SHIFT_LENGTH_HOURS)
+    )
+
+
+def _bucket_start(value, bucket):
+    if bucket == "hour":
+        return value.replace(minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    shifted = value - timedelta(hours=SHIFT_START_HOUR)
+    day = shifted.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day + timedelta(hours=SHIFT_START_HOUR + shifted.hour // SHIFT_LENGTH_HOURS * SHIFT_LENGTH_HOURS)
+
+
+def _stats_row(count, total, mean, minimum, maximum, percentiles):
+    def seconds(value):
+        return round(float(value), 3) if value is not None else None
+
+    row = {
+        "count": int(count or 0),
+        "total_seconds": seconds(total) if count else 0.0,
+        "mean": seconds(mean),
+        "min": seconds(minimum),
+        "max": seconds(maximum),
+    }
+    for (name, _), value in zip(PERCENTILES, percentiles):
+        row[name] = seconds(value)
+    return row
+
+
+def _percentile(sorted_values, fraction):
+    """Linear interpolation, same definition as PostgreSQL percentile_cont."""
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * fraction
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _python_stats(values):
+    values.sort()
+    if not values:
+        return _stats_row(0, 0, None, None, None, [None] * len(PERCENTILES))
+    total = sum(values)
+    return _stats_row(
+        len(values), total, total / len(values), values[0], values[-1],
+        [_percentile(values, fraction) for _, fraction in PERCENTILES],
+    )
+
+
+def cycle_time_statistics(session, bucket=None, start=None, end=None, product_type_id=None, order_id=None, percentiles=True):
+    """Cycle time (produced_end - produced_at, seconds) statistics of completed products.
+
+    Returns the overall count / total / mean / min / max / p50 / p95 / p99 and,
+    when ``bucket`` is hour, day or shift, the same figures per bucket keyed by
+    the bucket start. On PostgreSQL everything is aggregated in the database
+    (``percentile_cont``); other dialects stream the two timestamp columns.
+    ``percentiles=False`` skips the ordered-set aggregates when only count and
+    mean are needed.
+    """
+    if bucket is not None and bucket not in CYCLE_TIME_BUCKETS:
+        raise ValueError(f"不支持的分桶方式: {bucket}")
+    filters = _filters(start, end, product_type_id, order_id)
+
+    if session.get_bind().dialect.name != "postgresql":
+        overall = []
+        buckets = defaultdict(list)
+        rows = session.query(ProductionProduct.produced_at, ProductionProduct.produced_end).filter(*filters)
+        for produced_at, produced_end in rows.yield_per(5000):
+            seconds = (produced_end - produced_at).total_seconds()
+            overall.append(seconds)
+            if bucket:
+                buckets[_bucket_start(produced_end, bucket)].append(seconds)
+        return {
+            "bucket": bucket,
+            "overall": _python_stats(overall),
+            "buckets": [
+                {"bucket_start": key.isoformat(), **_python_stats(values)}
+                for key, values in sorted(buckets.items())
+            ],
+        }
+
+    seconds = func.extract("epoch", ProductionProduct.produced_end - ProductionProduct.produced_at)
+    aggregates = [
+        func.count(),
+        func.sum(seconds),
+        func.avg(seconds),
+        func.min(seconds),
+        func.max(seconds),
+        *[
+            func.percentile_cont(fraction).within_group(seconds) if percentiles else null()
+            for _, fraction in PERCENTILES
+        ],
+    ]
+    count, total, mean, minimum, maximum, *quantiles = session.query(*aggregates).filter(*filters).one()
+    result = {
+        "bucket": bucket,
+        "overall": _stats_row(count, total, mean, minimum, maximum, quantiles),
+        "buckets": [],
+    }
+    if bucket:
+        # Group by the output column so the bound interval parameters appear only once
+        bucket_column = literal_column("bucket_start")
+        rows = (
+            session.query(_bucket_expression(bucket).label("bucket_start"), *aggregates)
+            .filter(*filters)
+            .group_by(bucket_column)
+            .order_by(bucket_column)
+            .all()
+        )
+        result["buckets"] = [
+            {"bucket_start": key.isoformat() if isinstance(key, datetime) else key, **_stats_row(*values[:5], values[5:])}
+            for key, *values in rows
+        ]
+    return result
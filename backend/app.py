@@ -1,14 +1,15 @@
 import os
+import threading
 import mimetypes
 import uuid
 import requests
 import secrets
 from datetime import datetime, timezone, date
-from flask import Flask, jsonify, request, Response, send_file
+from flask import Flask, jsonify, request, Response, send_file, stream_with_context
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit
 from werkzeug.utils import secure_filename
-from sqlalchemy import func, or_
+from sqlalchemy import func, or_, text, update
 from sqlalchemy.exc import OperationalError, DatabaseError
 from database import (
     get_db,
@@ -19,6 +20,7 @@ from database import (
     DeviceParameterValue,
     Application,
     DeviceTopology,
+    Station,
     VideoStream,
     LaptopLabelType,
     ProductType,
@@ -26,9 +28,30 @@ from database import (
     ProductionProduct,
     TK_Positions,
 )
-from sqlalchemy.orm import joinedload
-from config import MODE
+from sqlalchemy.orm import joinedload, selectinload
+from config import MODE, fms_snapshot_ttl, simulation_config, topology_graph_ttl
 from simulation import create_simulator
+from simulation_emitter import SimulationEventEmitter
+from simulation_event_store import SimulationEventStore
+from kpi_rollup import KpiRollup
+from analytics import cycle_time_statistics, ensure_analytics_indexes
+from jobs import JobManager
+from pagination import COUNT_MODES, count_rows, keyset_order, keyset_page
+from device_serializer import parse_fields, projected_query, serialize_rows
+from device_parameters import (
+    ensure_device_schema,
+    parameter_filter,
+    parse_parameter_filter,
+    set_parameter_value,
+    upsert_device_parameters,
+)
+from device_io import export_devices, import_devices
+from fms_snapshot import SnapshotCache, build_fms_snapshot
+from plm_layout import LayoutVersionConflict, ensure_layout_schema, save_layout
+from stations import default_station_id, derive_station_ids, station_device_counts
+from topology_batch import apply_topology_diff
+from topology_graph import TopologyGraph
+from device_search import autocomplete, ensure_device_search_indexes, search_devices, search_filter
 
 ALLOWED_IMAGE_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "svg", "webp"}
 
@@ -36,8 +59,80 @@ ALLOWED_IMAGE_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "svg", "webp"}
 token_store = {}
 
 
+# 按订单内 id 顺序为产品编号，超出计划量的为多余产品
+_RANKED_PRODUCTS_SQL = """
+    SELECT p.id,
+           ROW_NUMBER() OVER (PARTITION BY p.order_id ORDER BY p.id) AS rn,
+           GREATEST(COALESCE(o.quantity, 0), 0) AS quantity,
+           o.product_type_id AS order_product_type_id
+    FROM production_products p
+    JOIN production_orders o ON o.id = p.order_id
+"""
+
+NORMALIZE_RESET_SQL = text(f"""
+    WITH ranked AS ({_RANKED_PRODUCTS_SQL})
+    UPDATE production_products p
+    SET status = 'scheduled',
+        product_type_id = COALESCE(p.product_type_id, r.order_product_type_id),
+        produced_at = NULL,
+        produced_end = NULL,
+        updated_at = :now
+    FROM ranked r
+    WHERE p.id = r.id
+      AND r.rn <= r.quantity
+      AND (p.status IS DISTINCT FROM 'scheduled' OR p.produced_at IS NOT NULL OR p.produced_end IS NOT NULL)
+""")
+
+NORMALIZE_DELETE_SQL = text(f"""
+    WITH ranked AS ({_RANKED_PRODUCTS_SQL})
+    DELETE FROM production_products p
+    USING ranked r
+    WHERE p.id = r.id AND r.rn > r.quantity
+""")
+
+# 序列号格式与逐条生成时一致：{产品编号}-{订单编号}-{序号:04d}-{6位随机大写十六进制}
+NORMALIZE_INSERT_SQL = text("""
+    INSERT INTO production_products
+        (serial_number, order_id, product_type_id, status, produced_at, produced_end, description, created_at, updated_at)
+    SELECT s.serial_number, s.order_id, s.product_type_id, 'scheduled', NULL, NULL,
+           '初始化产品 ' || s.serial_number, :now, :now
+    FROM (
+        SELECT o.id AS order_id,
+               o.product_type_id,
+               COALESCE(o.product_code, 'PRD') || '-' || COALESCE(o.order_code, o.id::text) || '-'
+                   || CASE WHEN g.idx < 10000 THEN lpad(g.idx::text, 4, '0') ELSE g.idx::text END || '-'
+                   || upper(substr(md5(random()::text || o.id::text || '-' || g.idx::text), 1, 6)) AS serial_number
+        FROM production_orders o
+        LEFT JOIN (
+            SELECT order_id, COUNT(*) AS existing
+            FROM production_products
+            WHERE order_id IS NOT NULL
+            GROUP BY order_id
+        ) c ON c.order_id = o.id
+        CROSS JOIN LATERAL generate_series(COALESCE(c.existing, 0) + 1, GREATEST(COALESCE(o.quantity, 0), 0)) AS g(idx)
+    ) s
+""")
+
+
 def normalize_order_products(db):
-    """确保每个订单的产品数量与计划量一致，并全部回到 scheduled 状态"""
+    """确保每个订单的产品数量与计划量一致，并全部回到 scheduled 状态
+
+    PostgreSQL 下用三条集合语句完成：ROW_NUMBER() 标记多余产品后批量重置 / 删除，
+    generate_series 批量补齐缺少的产品，耗时只与数据库规模有关，不再逐订单往返。
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return _normalize_order_products_orm(db)
+
+    now = datetime.now(timezone.utc)
+    updated = db.execute(NORMALIZE_RESET_SQL, {"now": now}).rowcount
+    deleted = db.execute(NORMALIZE_DELETE_SQL).rowcount
+    # created_at 与模型默认值保持一致（UTC 无时区）
+    created = db.execute(NORMALIZE_INSERT_SQL, {"now": datetime.utcnow()}).rowcount
+    return {"created": created, "deleted": deleted, "updated": updated}
+
+
+def _normalize_order_products_orm(db):
+    """逐订单处理的实现（非 PostgreSQL 数据库使用）"""
     created = deleted = updated = 0
     orders = db.query(ProductionOrder).all()
     for order in orders:
@@ -86,37 +181,82 @@ def normalize_order_products(db):
     return {"created": created, "deleted": deleted, "updated": updated}
 
 
-def reset_orders_and_products(db, *, log_prefix="重置"):
-    """统一清空历史模拟数据，确保所有订单/产品回到初始状态"""
-    from datetime import datetime, timezone
+def reset_orders_and_products(db, *, log_prefix="重置", chunk_size=5000, progress=None):
+    """统一清空历史模拟数据，确保所有订单/产品回到初始状态
 
-    orders_reset = (
-        db.query(ProductionOrder)
-        .filter(ProductionOrder.status.in_(["in_progress", "completed"]))
-        .update(
-            {
-                ProductionOrder.status: "scheduled",
-                ProductionOrder.updated_at: datetime.now(timezone.utc),
-            },
-            synchronize_session=False,
-        )
-    )
+    按 chunk_size 分批更新并逐批提交，任何时候只锁定一批行，不会长时间锁住整张
+    production_products 表；progress 回调在每批之后收到当前进度。
+    """
+    from datetime import datetime, timezone
 
-    # 将所有产品都重置为 scheduled，清空历史时间戳
-    products_reset = (
-        db.query(ProductionProduct)
-        .update(
-            {
-                ProductionProduct.status: "scheduled",
-                ProductionProduct.product_type_id: ProductionProduct.product_type_id,
-                ProductionProduct.produced_at: None,
-                ProductionProduct.produced_end: None,
-                ProductionProduct.updated_at: datetime.now(timezone.utc),
-            },
-            synchronize_session=False,
+    def report(**fields):
+        if progress:
+            progress(**fields)
+
+    # 1. 订单：每次取一批非 scheduled 订单重置
+    orders_reset = 0
+    while True:
+        order_ids = [
+            order_id for (order_id,) in
+            db.query(ProductionOrder.id)
+            .filter(ProductionOrder.status.in_(["in_progress", "completed"]))
+            .order_by(ProductionOrder.id.asc())
+            .limit(chunk_size)
+            .all()
+        ]
+        if not order_ids:
+            break
+        orders_reset += (
+            db.query(ProductionOrder)
+            .filter(ProductionOrder.id.in_(order_ids))
+            .update(
+                {
+                    ProductionOrder.status: "scheduled",
+                    ProductionOrder.updated_at: datetime.now(timezone.utc),
+                },
+                synchronize_session=False,
+            )
         )
-    )
+        db.commit()
+        report(phase="orders", orders_reset=orders_reset)
+
+    # 2. 产品：按 id 区间分批，只改写尚未回到 scheduled 或仍有生产时间戳的产品
+    min_id, max_id = db.query(func.min(ProductionProduct.id), func.max(ProductionProduct.id)).one()
+    products_reset = 0
+    if min_id is not None:
+        for lower in range(min_id, max_id + 1, chunk_size):
+            products_reset += (
+                db.query(ProductionProduct)
+                .filter(
+                    ProductionProduct.id >= lower,
+                    ProductionProduct.id < lower + chunk_size,
+                    or_(
+                        ProductionProduct.status != "scheduled",
+                        ProductionProduct.status.is_(None),
+                        ProductionProduct.produced_at.isnot(None),
+                        ProductionProduct.produced_end.isnot(None),
+                    ),
+                )
+                .update(
+                    {
+                        ProductionProduct.status: "scheduled",
+                        ProductionProduct.produced_at: None,
+                        ProductionProduct.produced_end: None,
+                        ProductionProduct.updated_at: datetime.now(timezone.utc),
+                    },
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+            report(
+                phase="products",
+                products_reset=products_reset,
+                products_scanned=min(lower + chunk_size, max_id + 1) - min_id,
+                products_total=max_id - min_id + 1,
+            )
 
+    # 3. 规范化产品数量（集合语句，只锁定被删除 / 新增的行）
+    report(phase="normalize")
     normalize_stats = normalize_order_products(db)
     db.commit()
 
@@ -145,28 +285,198 @@ def reset_orders_and_products(db, *, log_prefix="重置"):
             f"警告：{log_prefix} 后仍有 {remaining_non_scheduled} 条产品不是 scheduled 状态"
         )
 
-    return {
+    stats = {
         "orders_reset": orders_reset,
         "products_reset": products_reset,
         "normalize_stats": normalize_stats,
         "remaining": remaining_non_scheduled,
     }
+    report(phase="done", normalized=normalize_stats, remaining=remaining_non_scheduled)
+    return stats
+
+
+def build_home_overview(kpi):
+    """根据 KPI 汇总快照生成首页概览数据（HTTP 接口与 kpi_update 推送共用）"""
+    device_count = kpi["device_count"]
+
+    # 1. 支持标签类型：统计表的总记录数
+    label_type_count = kpi["label_type_count"]
+
+    # 2. 支持笔记本型号：固定值 5866
+    supported_laptops = 5866
+
+    # 3. 稳定运行天数：从 2025.07.01 到当前时间计算天数
+    start_date = date(2025, 7, 1)
+    current_date = date.today()
+    stable_days = (current_date - start_date).days
+
+    # 4. 已完成订单数：稳定运行天数 * 200 + 当前完成的订单数
+    completed_orders_total = stable_days * 200 + kpi["completed_orders"]
+
+    # 5. 已完成产品数：稳定运行天数 * 200 * 4 + 当前已完成的产品数
+    completed_products_total = stable_days * 200 * 4 + kpi["completed_products"]
+
+    # 6. 贴标质检告警数：已完成产品数 * 0.035
+    label_qc_alarms = int(completed_products_total * 0.035)
+
+    # 7. 平均节拍：已完成产品的平均耗时（秒），由累计耗时 / 产品数得到
+    avg_cycle_time = kpi["avg_cycle_time"]
+
+    return {
+        "labelTypes": label_type_count,
+        "supportedLaptops": supported_laptops,
+        "stableDays": stable_days,
+        "completedOrders": completed_orders_total,
+        "completedProducts": completed_products_total,
+        "labelQcAlarms": label_qc_alarms,
+        "dailyCycleTime": avg_cycle_time,
+        "deviceCount": device_count,
+        "modalTypes": 12,
+        "securityEvents": 327,
+        "dispatchTasks": 95,
+    }
+
+
+def query_in_progress_orders(db):
+    """生产任务订单列表（scheduled + in_progress），当前正在生产的订单置顶"""
+    # 获取所有 scheduled 和 in_progress 状态的订单
+    # 使用 CASE 语句确保 in_progress 状态的订单排在前面
+    from sqlalchemy import case
+    status_order = case(
+        (ProductionOrder.status == "in_progress", 0),
+        (ProductionOrder.status == "scheduled", 1),
+        else_=2
+    )
+    all_orders = (
+        db.query(ProductionOrder)
+        .options(joinedload(ProductionOrder.product_type))
+        .filter(ProductionOrder.status.in_(["scheduled", "in_progress"]))
+        .order_by(
+            # 先按状态排序：in_progress (0) 在前，scheduled (1) 在后
+            status_order.asc(),
+            # 然后按排产日期排序
+            ProductionOrder.scheduled_date.is_(None),
+            ProductionOrder.scheduled_date.asc(),
+            # 最后按 ID 排序
+            ProductionOrder.id.asc(),
+        )
+        .all()
+    )
+
+    order_ids = [order.id for order in all_orders]
+    completed_counts = {}
+    if order_ids:
+        completed_rows = (
+            db.query(ProductionProduct.order_id, func.count(ProductionProduct.id))
+            .filter(ProductionProduct.order_id.in_(order_ids))
+            .filter(ProductionProduct.status.in_(["completed", "packaged", "shipped"]))
+            .group_by(ProductionProduct.order_id)
+            .all()
+        )
+        completed_counts = {order_id: count for order_id, count in completed_rows}
+
+    order_data = []
+    for order in all_orders:
+        quantity = order.quantity or 0
+        # 只有当前正在执行的订单才展示实时完成进度
+        if order.status == "in_progress":
+            completed = completed_counts.get(order.id, 0)
+        else:
+            completed = 0
+        pending = max(quantity - completed, 0)
+        order_data.append({
+            "order_id": order.id,
+            "order_code": order.order_code,
+            "product_code": order.product_code,
+            "product_name": order.product_type.product_name if order.product_type else order.product_code,
+            "quantity": quantity,
+            "completed": completed,
+            "pending": pending,
+            "status": order.status,  # 添加状态字段，用于前端判断是否高亮
+            "scheduled_date": order.scheduled_date.isoformat() if order.scheduled_date else None,
+            "delivery_date": order.delivery_date.isoformat() if order.delivery_date else None,
+        })
+
+    return order_data
+
+
+KPI_TOTAL_FIELDS = ("completedOrders", "completedProducts", "labelQcAlarms", "dailyCycleTime")
+
+
+def kpi_totals(overview):
+    """kpi_update 推送中携带的首页计数字段"""
+    return {field: overview[field] for field in KPI_TOTAL_FIELDS}
+
+
+def build_kpi_delta(events):
+    """从一帧模拟事件中汇总 KPI 增量（完成产品数、完成订单数、各订单进度），无相关事件时返回 None"""
+    completed_products = completed_orders = 0
+    orders = {}
+    for event in events:
+        stage = event.get("stage")
+        if stage not in ("order_in_progress", "product_completed", "order_completed") or event.get("order_id") is None:
+            continue
+        order = orders.setdefault(event["order_id"], {
+            "order_id": event["order_id"],
+            "order_code": event.get("order_code"),
+            "completed": 0,
+            "status": "in_progress",
+        })
+        if stage == "product_completed":
+            completed_products += 1
+            order["completed"] += 1
+        elif stage == "order_completed":
+            completed_orders += 1
+            order["status"] = "completed"
+    if not orders:
+        return None
+    return {
+        "type": "delta",
+        "completedProducts": completed_products,
+        "completedOrders": completed_orders,
+        "orders": list(orders.values()),
+    }
 
 
 def ensure_tk_positions_table():
-    """确保 tk_positions 表存在，如果不存在则创建"""
+    """确保 tk_positions 表、布局版本号列及 (item_type, item_id) 唯一索引存在（保存/加载布局时不再检查）"""
     try:
-        from sqlalchemy import inspect
         db = next(get_db())
-        inspector = inspect(db.bind)
-        if "tk_positions" not in inspector.get_table_names():
-            TK_Positions.__table__.create(db.bind, checkfirst=True)
-            print("✓ tk_positions 表已自动创建")
+        ensure_layout_schema(db.bind)
         db.close()
     except Exception as e:
         print(f"⚠ 检查/创建 tk_positions 表时出错: {e}")
 
 
+def ensure_analytics_index():
+    """确保生产产品 (status, produced_end) 分析索引存在"""
+    try:
+        db = next(get_db())
+        ensure_analytics_indexes(db.bind)
+        db.close()
+    except Exception as e:
+        print(f"⚠ 检查/创建分析索引时出错: {e}")
+
+
+def ensure_device_indexes():
+    """确保设备/参数值表的新增列、声明的索引及设备搜索的三元组索引存在（已有表不会被 create_all 补建）"""
+    try:
+        db = next(get_db())
+        ensure_device_schema(db.bind)
+        ensure_device_search_indexes(db.bind)
+        db.close()
+    except Exception as e:
+        print(f"⚠ 检查/创建设备索引时出错: {e}")
+
+
+def load_topology_graph(graph):
+    """启动时构建拓扑图索引，失败时在首次查询时再构建"""
+    try:
+        graph.load()
+    except Exception as e:
+        print(f"⚠ 构建拓扑图索引时出错: {e}")
+
+
 def create_app() -> Flask:
     # 配置静态文件目录
     static_folder = os.path.join(os.path.dirname(__file__), 'static')
@@ -181,20 +491,52 @@ def create_app() -> Flask:
         allowed_origins_for_socketio = [origin.strip() for origin in cors_origins_env.split(",") if origin.strip()]
     socketio = SocketIO(app, cors_allowed_origins=allowed_origins_for_socketio, async_mode='threading')
     app.socketio = socketio
+
+    # 首页 KPI 增量汇总：由模拟事件累加，批量变更后失效重算
+    app.kpi_rollup = KpiRollup()
+    # 后台任务（如订单重置），进度通过 job_progress 事件推送
+    app.job_manager = JobManager(
+        on_update=lambda job: socketio.emit('job_progress', job, namespace='/simulation')
+    )
+    # 订单重置任务与虚拟推演都会读写订单/产品状态，二者互斥执行
+    app.order_state_lock = threading.Lock()
+    # LenovoFMS 工位分组设备快照（已序列化的 JSON），设备 / 设备类型 / 拓扑写入后失效
+    app.fms_snapshots = SnapshotCache(
+        lambda session, application_id: app.json.dumps(build_fms_snapshot(session, application_id)),
+        ttl=fms_snapshot_ttl,
+    )
+    # 拓扑图索引（邻接表），拓扑写操作实时更新，设备写操作后重建
+    app.topology_graph = TopologyGraph(lambda: next(get_db()), max_age=topology_graph_ttl)
     
     try:
         app.production_simulator = create_simulator()
         # Set WebSocket callback for simulator
         if app.production_simulator:
-            def websocket_push(event):
-                # Broadcast to all connected clients immediately
+            def websocket_push_frame(events):
                 # In Flask-SocketIO, emit without room parameter broadcasts to all clients in the namespace
-                try:
-                    socketio.emit('simulation_event', event, namespace='/simulation')
-                    print(f"WebSocket event sent: {event.get('stage', 'unknown')} - {event.get('message', '')[:50]}")
-                except Exception as e:
-                    print(f"Error sending WebSocket event: {e}")
-            app.production_simulator.set_websocket_callback(websocket_push)
+                socketio.emit('simulation_events', {'events': events}, namespace='/simulation')
+                kpi_update = build_kpi_delta(events)
+                if kpi_update:
+                    kpi_update['totals'] = kpi_totals(build_home_overview(app.kpi_rollup.snapshot()))
+                    socketio.emit('kpi_update', kpi_update, namespace='/simulation')
+
+            # 事件由独立线程按帧批量推送，模拟线程只负责入队，不会被慢客户端阻塞
+            app.simulation_emitter = SimulationEventEmitter(
+                websocket_push_frame,
+                interval=simulation_config.emit_interval,
+                max_queue=simulation_config.emit_queue_size,
+            )
+            # 事件同时写入持久化事件日志（分配递增 seq，后台批量落库并按保留天数清理）
+            app.simulation_event_store = SimulationEventStore(
+                ring_size=simulation_config.event_ring_size,
+                retention_days=simulation_config.event_retention_days,
+            )
+
+            def publish_event(event):
+                app.kpi_rollup.apply_event(event)
+                # 分配 seq 与入队在同一把锁内完成，多条产线并发时帧内事件仍按 seq 有序
+                app.simulation_event_store.append(event, publish=app.simulation_emitter.push)
+            app.production_simulator.set_websocket_callback(publish_event)
     except Exception as e:
         print(f"生产模拟器启动失败: {e}")
         app.production_simulator = None
@@ -306,6 +648,10 @@ def create_app() -> Flask:
     
     # 确保 tk_positions 表存在
     ensure_tk_positions_table()
+    # 确保节拍分析所需索引存在
+    ensure_analytics_index()
+    ensure_device_indexes()
+    load_topology_graph(app.topology_graph)
 
     return app
 
@@ -317,104 +663,44 @@ def register_routes(app: Flask) -> None:
 
     @app.get("/api/home/overview")
     def home_overview():
-        db = next(get_db())
         try:
-            application = (
-                db.query(Application)
-                .filter(
-                    (Application.english_name == 'LenovoFMS') |
-                    (Application.name == 'LenovoFMS') |
-                    (Application.name.like('%LenovoFMS%'))
-                )
-                .order_by(Application.id.asc())
-                .first()
-            )
-
-            device_count = 0
-            if application:
-                device_count = (
-                    db.query(Device)
-                    .filter(Device.application_id == application.id)
-                    .count()
-                )
-
-            # 1. 支持标签类型：统计表的总记录数
-            label_type_query = db.query(LaptopLabelType)
-            if application:
-                label_type_query = label_type_query.filter(
-                    (LaptopLabelType.application_id == application.id) |
-                    (LaptopLabelType.application_id.is_(None))
-                )
-            label_type_count = label_type_query.count()
-
-            # 2. 支持笔记本型号：固定值 5866
-            supported_laptops = 5866
-
-            # 3. 稳定运行天数：从 2025.07.01 到当前时间计算天数
-            start_date = date(2025, 7, 1)
-            current_date = date.today()
-            stable_days = (current_date - start_date).days
-
-            # 4. 已完成订单数：稳定运行天数 * 200 + 当前完成的订单数
-            completed_orders_count = (
-                db.query(ProductionOrder)
-                .filter(ProductionOrder.status == "completed")
-                .count()
-            )
-            completed_orders_total = stable_days * 200 + completed_orders_count
+            # 计数器由 KPI 汇总增量维护，这里不再逐次 COUNT / 遍历已完成产品
+            overview = build_home_overview(app.kpi_rollup.snapshot())
+            return jsonify(overview)
+        except (OperationalError, DatabaseError) as e:
+            print(f"数据库连接错误: {e}")
+            return jsonify({
+                "error": "数据库连接失败",
+                "message": "无法连接到数据库服务器，请检查数据库配置和网络连接"
+            }), 503
+        except Exception as e:
+            import traceback
 
-            # 5. 已完成产品数：稳定运行天数 * 200 * 4 + 当前已完成的产品数
-            completed_products_count = (
-                db.query(ProductionProduct)
-                .filter(ProductionProduct.status == "completed")
-                .count()
-            )
-            completed_products_total = stable_days * 200 * 4 + completed_products_count
+            error_trace = traceback.format_exc()
+            print(error_trace)
+            return jsonify({"error": str(e), "traceback": error_trace}), 500
 
-            # 6. 贴标质检告警数：已完成产品数 * 0.035
-            label_qc_alarms = int(completed_products_total * 0.035)
+    @app.get("/api/analytics/cycle-time")
+    def get_cycle_time_analytics():
+        """节拍（produced_end - produced_at）统计：均值、p50/p95/p99、最小/最大值
 
-            # 7. 平均节拍：计算已完成产品的平均耗时（秒）
-            # 只计算有 produced_at 和 produced_end 的产品
-            avg_cycle_time = None
-            completed_products_with_times = (
-                db.query(ProductionProduct)
-                .filter(
-                    ProductionProduct.status == "completed",
-                    ProductionProduct.produced_at.isnot(None),
-                    ProductionProduct.produced_end.isnot(None)
-                )
-                .all()
+        参数：bucket（hour / day / shift）、from、to（ISO 时间，按完成时间过滤）、product_type_id、order_id
+        """
+        db = next(get_db())
+        try:
+            start = request.args.get("from")
+            end = request.args.get("to")
+            stats = cycle_time_statistics(
+                db,
+                bucket=request.args.get("bucket") or None,
+                start=datetime.fromisoformat(start) if start else None,
+                end=datetime.fromisoformat(end) if end else None,
+                product_type_id=request.args.get("product_type_id", type=int),
+                order_id=request.args.get("order_id", type=int),
             )
-            
-            if completed_products_with_times:
-                total_seconds = 0
-                valid_count = 0
-                for product in completed_products_with_times:
-                    if product.produced_at and product.produced_end:
-                        # 计算时间差（秒）
-                        time_diff = (product.produced_end - product.produced_at).total_seconds()
-                        if time_diff > 0:  # 确保时间差有效
-                            total_seconds += time_diff
-                            valid_count += 1
-                
-                if valid_count > 0:
-                    avg_cycle_time = round(total_seconds / valid_count, 1)
-
-            overview = {
-                "labelTypes": label_type_count,
-                "supportedLaptops": supported_laptops,
-                "stableDays": stable_days,
-                "completedOrders": completed_orders_total,
-                "completedProducts": completed_products_total,
-                "labelQcAlarms": label_qc_alarms,
-                "dailyCycleTime": avg_cycle_time,
-                "deviceCount": device_count,
-                "modalTypes": 12,
-                "securityEvents": 327,
-                "dispatchTasks": 95,
-            }
-            return jsonify(overview)
+            return jsonify(stats), 200
+        except ValueError as e:
+            return jsonify({"error": f"参数错误: {e}"}), 400
         except (OperationalError, DatabaseError) as e:
             print(f"数据库连接错误: {e}")
             return jsonify({
@@ -423,9 +709,8 @@ def register_routes(app: Flask) -> None:
             }), 503
         except Exception as e:
             import traceback
-
             error_trace = traceback.format_exc()
-            print(error_trace)
+            print(f"节拍统计失败: {error_trace}")
             return jsonify({"error": str(e), "traceback": error_trace}), 500
         finally:
             db.close()
@@ -468,49 +753,89 @@ def register_routes(app: Flask) -> None:
 
     @app.get("/api/devices")
     def get_devices():
-        """获取设备列表"""
+        """获取设备列表
+
+        分页方式：
+        - 传入 cursor 参数（首页传空字符串）时使用按 (created_at, id) 的游标分页，
+          返回 next_cursor，深页与首页代价相同
+        - 否则沿用 page/page_size 偏移分页
+        count=exact|estimated|none 控制总数的计算方式，estimated 在 PostgreSQL 上读取统计信息
+
+        按参数筛选：ip_address=<ip> 走 devices.ip_address 索引；param=key:op:value（可重复，
+        op 为 eq/ne/lt/lte/gt/gte，如 param=exposure_time:lt:8）按参数类型比较类型化列
+
+        精简模式：传入 fields（如 fields=id,name,status,ip_address）或 shape=normalized 时，
+        按列投影查询、不构造 ORM 对象，设备只包含所选字段，设备类型在 device_types 中按 id 只输出一次
+        """
+        db = next(get_db())
         try:
-            db = next(get_db())
             # 获取查询参数
-            page = request.args.get("page", 1, type=int)
-            page_size = request.args.get("page_size", 20, type=int)
+            page = max(request.args.get("page", 1, type=int), 1)
+            page_size = min(max(request.args.get("page_size", 20, type=int), 1), 500)
             status = request.args.get("status", None, type=str)
             search = request.args.get("search", None, type=str)
+            cursor = request.args.get("cursor", None, type=str)
+            count_mode = request.args.get("count", "exact", type=str)
+            if count_mode not in COUNT_MODES:
+                raise ValueError(f"count 参数必须为 {', '.join(COUNT_MODES)} 之一")
+            lean = "fields" in request.args or request.args.get("shape") == "normalized"
+            fields = parse_fields(request.args.get("fields")) if lean else None
 
-            # 构建查询，预加载关联数据
-            query = db.query(Device).options(
-                joinedload(Device.parameter_values),
-                joinedload(Device.device_type),
-                joinedload(Device.application)
-            )
+            query = db.query(Device)
 
             # 状态筛选
             if status:
                 query = query.filter(Device.status == status)
 
-            # 搜索筛选（设备名称或编码）
-            if search:
-                query = query.filter(
-                    (Device.name.ilike(f"%{search}%")) | (Device.code.ilike(f"%{search}%"))
+            # 搜索筛选（设备名称、编码、序列号或 IP 地址），PostgreSQL 上由三元组索引支持
+            if search and search.strip():
+                query = query.filter(search_filter(search))
+
+            # 按 IP 精确查找及类型化参数筛选
+            ip_address = request.args.get("ip_address", None, type=str)
+            if ip_address:
+                query = query.filter(Device.ip_address == ip_address.strip())
+            param_filters = request.args.getlist("param")
+            for expression in param_filters:
+                query = query.filter(parameter_filter(db, *parse_parameter_filter(expression)))
+            station_id = request.args.get("station_id", None, type=int)
+            if station_id is not None:
+                query = query.filter(Device.station_id == station_id)
+
+            # 总数只统计设备行，不带预加载
+            filtered = bool(status or search or ip_address or param_filters or station_id is not None)
+            total, total_estimated = count_rows(db, query, Device.id, filtered, count_mode)
+
+            if lean:
+                query = projected_query(query, fields, keyset=cursor is not None)
+            else:
+                # 集合关系用 selectinload 单独查询，LIMIT 作用于设备行而不是连接后的行
+                query = query.options(
+                    selectinload(Device.parameter_values),
+                    joinedload(Device.device_type),
+                    joinedload(Device.application)
                 )
 
-            # 获取总数（需要先克隆查询以避免影响分页）
-            total = query.count()
-
-            # 分页
-            offset = (page - 1) * page_size
-            devices = query.order_by(Device.created_at.desc()).offset(offset).limit(page_size).all()
-
-            # 转换为字典
-            devices_data = [device.to_dict() for device in devices]
+            result = {"page_size": page_size, "total": total, "total_estimated": total_estimated}
+            if cursor is not None:
+                devices, next_cursor = keyset_page(query, Device.created_at, Device.id, page_size, cursor)
+                result.update({"next_cursor": next_cursor, "has_more": next_cursor is not None})
+            else:
+                offset = (page - 1) * page_size
+                devices = query.order_by(*keyset_order(Device.created_at, Device.id)).offset(offset).limit(page_size).all()
+                result.update({
+                    "page": page,
+                    "total_pages": (total + page_size - 1) // page_size if total is not None else None,
+                })
 
-            return jsonify({
-                "devices": devices_data,
-                "total": total,
-                "page": page,
-                "page_size": page_size,
-                "total_pages": (total + page_size - 1) // page_size,
-            })
+            if lean:
+                result["devices"], result["device_types"] = serialize_rows(db, devices, fields)
+                result["fields"] = list(fields)
+            else:
+                result["devices"] = [device.to_dict() for device in devices]
+            return jsonify(result)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({"error": str(e)}), 500
         finally:
@@ -538,81 +863,9 @@ def register_routes(app: Flask) -> None:
                     "connections": []
                 }), 404
             
-            # 只查询属于 LenovoFMS 应用的设备
-            devices = db.query(Device).options(
-                joinedload(Device.parameter_values),
-                joinedload(Device.device_type).joinedload(DeviceType.parameters)
-            ).filter(Device.application_id == lenovofms_app.id).all()
-            
-            # 按工位分组
-            devices_by_station = {}
-            for device in devices:
-                # 从 description 中提取工位名称
-                station = 'unknown'
-                if device.description:
-                    if device.description.startswith('工位:'):
-                        station = device.description.replace('工位:', '').strip()
-                    elif device.description.startswith('工位：'):
-                        station = device.description.replace('工位：', '').strip()
-                
-                # 如果 description 中没有工位信息，尝试从 code 中提取
-                if station == 'unknown' and device.code:
-                    # 设备 code 格式：type-station-number，如 camera-read-1 -> read
-                    parts = device.code.split('-')
-                    if len(parts) >= 2:
-                        # 检查第二部分是否是已知的工位
-                        potential_station = parts[1]
-                        if potential_station in ['read', 'label', 'pick', 'qc', 'network']:
-                            station = potential_station
-                
-                if station not in devices_by_station:
-                    devices_by_station[station] = []
-                
-                # 转换为前端格式
-                device_dict = {
-                    'id': device.code,
-                    'name': device.name,
-                    'type': device.device_type.code if device.device_type else 'unknown',
-                    'station': station,
-                    'status': device.status or 'online',
-                    'position': {
-                        'x': device.position_x or 0,
-                        'y': device.position_y or 0
-                    },
-                    'details': {}
-                }
-                
-                # 添加参数值到 details
-                if device.parameter_values:
-                    for pv in device.parameter_values:
-                        # 将 ip_address 映射回 ip（前端使用）
-                        key = 'ip' if pv.param_key == 'ip_address' else pv.param_key
-                        device_dict['details'][key] = pv.param_value
-                
-                devices_by_station[station].append(device_dict)
-            
-            # 查询设备拓扑连接（只返回属于 LenovoFMS 应用的设备之间的连接）
-            from database import DeviceTopology
-            # 获取所有 LenovoFMS 设备的 code
-            lenovofms_device_codes = {device.code for device in devices}
-            
-            topologies = db.query(DeviceTopology).all()
-            connections = []
-            for topology in topologies:
-                # 只包含源设备和目标设备都属于 LenovoFMS 应用的连接
-                if topology.source_device_code in lenovofms_device_codes and \
-                   topology.target_device_code in lenovofms_device_codes:
-                    connections.append({
-                        'source': topology.source_device_code,
-                        'target': topology.target_device_code,
-                        'type': topology.connection_type,
-                        'description': topology.description
-                    })
-            
-            return jsonify({
-                "devices": devices_by_station,
-                "connections": connections
-            }), 200
+            # 工位分组设备与拓扑连接的快照，缓存命中时不访问设备表
+            body = app.fms_snapshots.get(db, lenovofms_app.id)
+            return Response(body, status=200, mimetype="application/json")
         except (OperationalError, DatabaseError) as e:
             print(f"数据库连接错误: {e}")
             return jsonify({
@@ -631,6 +884,147 @@ def register_routes(app: Flask) -> None:
             if 'db' in locals():
                 db.close()
 
+    @app.get("/api/stations")
+    def get_stations():
+        """获取工位列表及各工位设备数，可按 application_id 筛选"""
+        db = next(get_db())
+        try:
+            query = db.query(Station)
+            application_id = request.args.get("application_id", None, type=int)
+            if application_id is not None:
+                query = query.filter(Station.application_id == application_id)
+            stations = query.order_by(Station.application_id, Station.sort_order, Station.code).all()
+            counts = station_device_counts(db, [station.id for station in stations])
+            return jsonify({
+                "stations": [dict(station.to_dict(), device_count=counts.get(station.id, 0)) for station in stations]
+            }), 200
+        except (OperationalError, DatabaseError) as e:
+            print(f"数据库连接错误: {e}")
+            return jsonify({
+                "error": "数据库连接失败",
+                "message": "无法连接到数据库服务器，请检查数据库配置和网络连接"
+            }), 503
+        except Exception as e:
+            import traceback
+            error_trace = traceback.format_exc()
+            print(f"获取工位列表失败: {error_trace}")
+            return jsonify({"error": str(e), "traceback": error_trace}), 500
+        finally:
+            db.close()
+
+    @app.get("/api/stations/<int:station_id>/devices")
+    def get_station_devices(station_id):
+        """获取单个工位的设备（按 station_id 索引查询，游标分页）
+
+        查询参数：cursor（首页传空或不传）、page_size，fields 指定时按列投影输出（同 /api/devices 精简模式）
+        """
+        db = next(get_db())
+        try:
+            station = db.query(Station).filter(Station.id == station_id).first()
+            if not station:
+                return jsonify({"error": "工位不存在"}), 404
+            page_size = min(max(request.args.get("page_size", 100, type=int), 1), 500)
+            cursor = request.args.get("cursor", None, type=str)
+            lean = "fields" in request.args
+            fields = parse_fields(request.args.get("fields")) if lean else None
+
+            query = db.query(Device).filter(Device.station_id == station_id)
+            if lean:
+                query = projected_query(query, fields)
+            else:
+                query = query.options(selectinload(Device.parameter_values), joinedload(Device.device_type))
+            devices, next_cursor = keyset_page(query, Device.created_at, Device.id, page_size, cursor)
+
+            result = {
+                "station": station.to_dict(),
+                "page_size": page_size,
+                "next_cursor": next_cursor,
+                "has_more": next_cursor is not None,
+            }
+            if lean:
+                result["devices"], result["device_types"] = serialize_rows(db, devices, fields)
+                result["fields"] = list(fields)
+            else:
+                result["devices"] = [device.to_dict() for device in devices]
+            return jsonify(result), 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except (OperationalError, DatabaseError) as e:
+            print(f"数据库连接错误: {e}")
+            return jsonify({
+                "error": "数据库连接失败",
+                "message": "无法连接到数据库服务器，请检查数据库配置和网络连接"
+            }), 503
+        except Exception as e:
+            import traceback
+            error_trace = traceback.format_exc()
+            print(f"获取工位设备失败: {error_trace}")
+            return jsonify({"error": str(e), "traceback": error_trace}), 500
+        finally:
+            db.close()
+
+    @app.get("/api/devices/search")
+    def search_devices_ranked():
+        """按相关度排序的设备搜索（名称、编码、序列号、IP 地址）"""
+        db = next(get_db())
+        try:
+            q = (request.args.get("q") or "").strip()
+            if not q:
+                raise ValueError("缺少搜索关键词 q")
+            limit = min(max(request.args.get("limit", 20, type=int), 1), 100)
+            results = search_devices(
+                db, q, limit=limit,
+                application_id=request.args.get("application_id", None, type=int),
+                status=request.args.get("status", None, type=str),
+            )
+            return jsonify({
+                "query": q,
+                "devices": [dict(device.to_dict(), rank=round(float(rank), 4)) for device, rank in results],
+            }), 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except (OperationalError, DatabaseError) as e:
+            print(f"数据库连接错误: {e}")
+            return jsonify({
+                "error": "数据库连接失败",
+                "message": "无法连接到数据库服务器，请检查数据库配置和网络连接"
+            }), 503
+        except Exception as e:
+            import traceback
+            error_trace = traceback.format_exc()
+            print(f"搜索设备失败: {error_trace}")
+            return jsonify({"error": str(e), "traceback": error_trace}), 500
+        finally:
+            db.close()
+
+    @app.get("/api/devices/autocomplete")
+    def autocomplete_devices():
+        """设备名称/编码前缀补全"""
+        db = next(get_db())
+        try:
+            q = (request.args.get("q") or "").strip()
+            if not q:
+                return jsonify({"query": q, "suggestions": []}), 200
+            limit = min(max(request.args.get("limit", 10, type=int), 1), 50)
+            suggestions = autocomplete(
+                db, q, limit=limit,
+                application_id=request.args.get("application_id", None, type=int),
+            )
+            return jsonify({"query": q, "suggestions": suggestions}), 200
+        except (OperationalError, DatabaseError) as e:
+            print(f"数据库连接错误: {e}")
+            return jsonify({
+                "error": "数据库连接失败",
+                "message": "无法连接到数据库服务器，请检查数据库配置和网络连接"
+            }), 503
+        except Exception as e:
+            import traceback
+            error_trace = traceback.format_exc()
+            print(f"设备补全失败: {error_trace}")
+            return jsonify({"error": str(e), "traceback": error_trace}), 500
+        finally:
+            db.close()
+
     @app.get("/api/devices/<int:device_id>")
     def get_device(device_id):
         """获取单个设备详情"""
@@ -708,6 +1102,11 @@ def register_routes(app: Flask) -> None:
                 created_at=datetime.utcnow(),
                 updated_at=datetime.utcnow()
             )
+            # 工位：优先使用 station_id，否则按描述（工位:xxx）或编码约定归属
+            if data.get("station_id"):
+                device.station_id = data["station_id"]
+            else:
+                device.station_id = default_station_id(db, application_id, device.description, device.code)
             db.add(device)
             db.flush()  # 获取 device.id
             
@@ -728,31 +1127,22 @@ def register_routes(app: Flask) -> None:
                         
                         param_def = param_definitions[param_key]
                         
-                        # 转换参数值
-                        try:
-                            if param_value is None:
-                                str_value = None
-                            elif param_def.param_type == 'boolean':
-                                str_value = 'true' if param_value else 'false'
-                            elif param_def.param_type == 'date':
-                                str_value = param_value if isinstance(param_value, str) else str(param_value) if param_value is not None else None
-                            elif param_def.param_type == 'number':
-                                str_value = None if (param_value is None or param_value == '') else str(param_value)
-                            else:
-                                str_value = str(param_value) if param_value is not None else None
-                        except Exception as e:
-                            return jsonify({"error": f"参数 {param_key} 值转换失败: {str(e)}"}), 400
-                        
-                        # 创建参数值
+                        # 创建参数值（按参数类型同时写入类型化列）
                         param_value_obj = DeviceParameterValue(
                             device_id=device.id,
                             parameter_id=param_def.id,
-                            param_key=param_key,
-                            param_value=str_value
+                            param_key=param_key
                         )
+                        try:
+                            set_parameter_value(device, param_value_obj, param_def.param_type, param_value)
+                        except Exception as e:
+                            return jsonify({"error": f"参数 {param_key} 值转换失败: {str(e)}"}), 400
                         db.add(param_value_obj)
             
             db.commit()
+            app.fms_snapshots.invalidate()
+            app.topology_graph.mark_stale()
+            app.kpi_rollup.invalidate_static()
             
             # 重新查询设备以获取完整的数据
             device = db.query(Device).options(
@@ -782,10 +1172,7 @@ def register_routes(app: Flask) -> None:
             data = request.get_json()
             db = next(get_db())
             
-            device = db.query(Device).options(
-                joinedload(Device.parameter_values),
-                joinedload(Device.device_type).joinedload(DeviceType.parameters)
-            ).filter(Device.id == device_id).first()
+            device = db.query(Device).filter(Device.id == device_id).first()
             
             if not device:
                 return jsonify({"error": "设备不存在"}), 404
@@ -793,19 +1180,6 @@ def register_routes(app: Flask) -> None:
             # 更新设备基本信息
             from datetime import datetime
             
-            # 保存需要更新的字段值（在重新查询前）
-            saved_fields = {}
-            if "status" in data:
-                saved_fields["status"] = data.get("status")
-            if "health_status" in data:
-                saved_fields["health_status"] = data.get("health_status")
-            if "name" in data:
-                saved_fields["name"] = data["name"]
-            if "code" in data:
-                saved_fields["code"] = data["code"]
-            if "description" in data:
-                saved_fields["description"] = data.get("description")
-            
             # 更新基本字段
             if "name" in data:
                 device.name = data["name"]
@@ -862,143 +1236,28 @@ def register_routes(app: Flask) -> None:
                 device.health_status = data.get("health_status")
             if "description" in data:
                 device.description = data.get("description")
+            # 工位：显式 station_id 优先；描述、编码或应用变化时按约定重新归属
+            if "station_id" in data:
+                device.station_id = data.get("station_id")
+            elif device.station_id is None or any(field in data for field in ("description", "code", "application_id")):
+                device.station_id = default_station_id(db, device.application_id, device.description, device.code)
             
             # 更新 updated_at
             device.updated_at = datetime.utcnow()
             
-            # 更新参数值
-            existing_params = {}
+            # 更新参数值：一次查询解析参数定义，一条 INSERT ... ON CONFLICT 写入全部参数值
             if "parameters" in data:
-                # 如果设备类型被更新了，需要重新加载设备类型和参数定义
-                if "device_type_id" in data:
-                    db.flush()  # 刷新当前修改到数据库（不提交）
-                    device = db.query(Device).options(
-                        joinedload(Device.parameter_values),
-                        joinedload(Device.device_type).joinedload(DeviceType.parameters)
-                    ).filter(Device.id == device_id).first()
-                    
-                    # 恢复之前保存的字段值（因为重新查询会覆盖）
-                    for field, value in saved_fields.items():
-                        setattr(device, field, value)
-                    device.updated_at = datetime.utcnow()
-                
-                if not device.device_type:
-                    return jsonify({"error": "设备没有关联设备类型，无法更新参数值"}), 400
-                
-                if not device.device_type.parameters:
-                    return jsonify({"error": "设备类型没有定义参数"}), 400
-                
-                param_definitions = {p.param_key: p for p in device.device_type.parameters}
-                
-                # 查询现有的参数值
-                existing_params_query = db.query(DeviceParameterValue).filter(
-                    DeviceParameterValue.device_id == device.id
-                ).all()
-                existing_params = {pv.param_key: pv for pv in existing_params_query}
-                
-                for param_key, param_value in data["parameters"].items():
-                    # 处理设备类型定义中的参数
-                    if param_key in param_definitions:
-                        param_def = param_definitions[param_key]
-                        
-                        # 转换参数值
-                        try:
-                            if param_value is None:
-                                str_value = None
-                            elif param_def.param_type == 'boolean':
-                                str_value = 'true' if param_value else 'false'
-                            elif param_def.param_type == 'date':
-                                str_value = param_value if isinstance(param_value, str) else str(param_value) if param_value is not None else None
-                            elif param_def.param_type == 'number':
-                                str_value = None if (param_value is None or param_value == '') else str(param_value)
-                            else:
-                                str_value = str(param_value) if param_value is not None else None
-                        except Exception as e:
-                            return jsonify({"error": f"参数 {param_key} 值转换失败: {str(e)}"}), 400
-                        
-                        # 更新或创建参数值
-                        if param_key in existing_params:
-                            existing_params[param_key].param_value = str_value
-                            existing_params[param_key].updated_at = datetime.utcnow()
-                        else:
-                            param_value_obj = DeviceParameterValue(
-                                device_id=device.id,
-                                parameter_id=param_def.id,
-                                param_key=param_key,
-                                param_value=str_value
-                            )
-                            db.add(param_value_obj)
-                            existing_params[param_key] = param_value_obj
-                    else:
-                        # 处理自定义参数（如图标显示设置），这些参数不在设备类型定义中
-                        # 图标显示设置参数：icon_rotation_angle, icon_flip_horizontal, icon_flip_vertical
-                        custom_param_keys = ['icon_rotation_angle', 'icon_flip_horizontal', 'icon_flip_vertical', 
-                                           'rotation_angle', 'flip_horizontal', 'flip_vertical']
-                        
-                        if param_key in custom_param_keys:
-                            # 转换自定义参数值
-                            try:
-                                if param_value is None:
-                                    str_value = None
-                                elif param_key in ['icon_rotation_angle', 'rotation_angle']:
-                                    # 数字类型
-                                    str_value = None if (param_value is None or param_value == '') else str(param_value)
-                                elif param_key in ['icon_flip_horizontal', 'icon_flip_vertical', 'flip_horizontal', 'flip_vertical']:
-                                    # 布尔类型
-                                    str_value = 'true' if param_value else 'false'
-                                else:
-                                    str_value = str(param_value) if param_value is not None else None
-                            except Exception as e:
-                                return jsonify({"error": f"参数 {param_key} 值转换失败: {str(e)}"}), 400
-                            
-                            # 对于自定义参数，我们需要先创建或获取对应的参数定义
-                            # 查找设备类型中是否已经有这个参数定义（可能之前创建过）
-                            custom_param_def = db.query(DeviceTypeParameter).filter(
-                                DeviceTypeParameter.device_type_id == device.device_type_id,
-                                DeviceTypeParameter.param_key == param_key
-                            ).first()
-                            
-                            if not custom_param_def:
-                                # 如果不存在，创建参数定义
-                                param_type = 'number' if param_key in ['icon_rotation_angle', 'rotation_angle'] else 'boolean'
-                                param_name_map = {
-                                    'icon_rotation_angle': '图标旋转角度',
-                                    'icon_flip_horizontal': '图标水平翻转',
-                                    'icon_flip_vertical': '图标垂直翻转',
-                                    'rotation_angle': '旋转角度',
-                                    'flip_horizontal': '水平翻转',
-                                    'flip_vertical': '垂直翻转'
-                                }
-                                param_name = param_name_map.get(param_key, param_key)
-                                
-                                custom_param_def = DeviceTypeParameter(
-                                    device_type_id=device.device_type_id,
-                                    param_key=param_key,
-                                    param_name=param_name,
-                                    param_type=param_type,
-                                    required=False,
-                                    sort_order=999  # 放在最后
-                                )
-                                db.add(custom_param_def)
-                                db.flush()  # 刷新以获取新创建的参数定义ID
-                            
-                            # 更新或创建参数值
-                            if param_key in existing_params:
-                                existing_params[param_key].param_value = str_value
-                                existing_params[param_key].parameter_id = custom_param_def.id
-                                existing_params[param_key].updated_at = datetime.utcnow()
-                            else:
-                                param_value_obj = DeviceParameterValue(
-                                    device_id=device.id,
-                                    parameter_id=custom_param_def.id,
-                                    param_key=param_key,
-                                    param_value=str_value
-                                )
-                                db.add(param_value_obj)
-                                existing_params[param_key] = param_value_obj
+                db.flush()  # 设备类型可能刚被修改，先写入数据库
+                skipped = upsert_device_parameters(db, [(device.id, device.device_type_id, data["parameters"] or {})])["skipped"]
+                if skipped:
+                    db.rollback()
+                    return jsonify({"error": skipped[device.id]}), 400
             
             # 提交事务
             db.commit()
+            app.fms_snapshots.invalidate()
+            app.topology_graph.mark_stale()
+            app.kpi_rollup.invalidate_static()
             
             # 重新查询设备以获取完整的最新数据
             device = db.query(Device).options(
@@ -1021,6 +1280,178 @@ def register_routes(app: Flask) -> None:
             if 'db' in locals():
                 db.close()
 
+    @app.patch("/api/devices/bulk")
+    def bulk_update_devices():
+        """批量更新设备（批量下发配置）
+
+        请求体：
+        {
+            "device_ids": [1, 2, 3],
+            "parameters": {"exposure_time": 8, "ip_gateway": "10.0.0.1"},  // 可选
+            "status": "在线", "health_status": "良好", "description": "..."  // 可选
+        }
+        参数值对所有设备一次性写入（INSERT ... ON CONFLICT），基本字段用一条 UPDATE 更新；
+        无法写入参数的设备不做任何修改，在 skipped 中返回原因
+        """
+        db = next(get_db())
+        try:
+            data = request.get_json(silent=True) or {}
+            device_ids = data.get("device_ids")
+            if not isinstance(device_ids, list) or not device_ids:
+                raise ValueError("device_ids 必须为非空数组")
+            try:
+                device_ids = list(dict.fromkeys(int(device_id) for device_id in device_ids))
+            except (TypeError, ValueError):
+                raise ValueError("device_ids 只能包含整数")
+            parameters = data.get("parameters") or {}
+            if not isinstance(parameters, dict):
+                raise ValueError("parameters 必须为对象")
+            fields = {field: data[field] for field in ("status", "health_status", "description") if field in data}
+            if not parameters and not fields:
+                raise ValueError("没有需要更新的内容")
+
+            devices = db.query(Device.id, Device.device_type_id).filter(Device.id.in_(device_ids)).all()
+            found = {device.id for device in devices}
+            missing_ids = [device_id for device_id in device_ids if device_id not in found]
+            if not devices:
+                return jsonify({"error": "设备不存在", "missing_ids": missing_ids}), 404
+
+            stats = {"values_written": 0, "definitions_created": 0, "skipped": {}}
+            if parameters:
+                stats = upsert_device_parameters(
+                    db, [(device.id, device.device_type_id, parameters) for device in devices]
+                )
+            # 无法写入参数的设备（无设备类型、类型未定义参数、值转换失败）整体跳过，其余设备照常更新
+            skipped = stats.pop("skipped")
+            applied = found - set(skipped)
+            if not applied:
+                db.rollback()
+                return jsonify({
+                    "error": "没有可以更新的设备",
+                    "missing_ids": missing_ids,
+                    "skipped": [{"device_id": device_id, "error": error} for device_id, error in skipped.items()],
+                }), 400
+            db.query(Device).filter(Device.id.in_(applied)).update(
+                {**fields, "updated_at": datetime.utcnow()}, synchronize_session=False
+            )
+            if "description" in fields:
+                # 描述变化时按约定重新归属工位（描述中的 工位:xxx 或编码约定）
+                rows = db.query(Device.id, Device.application_id, Device.code).filter(Device.id.in_(applied)).all()
+                station_ids = derive_station_ids(
+                    db, {row.id: (row.application_id, fields["description"], row.code) for row in rows}
+                )
+                db.execute(
+                    update(Device),
+                    [{"id": device_id, "station_id": station_id} for device_id, station_id in station_ids.items()],
+                )
+            db.commit()
+            app.fms_snapshots.invalidate()
+            app.kpi_rollup.invalidate_static()
+
+            return jsonify({
+                "message": "设备批量更新成功",
+                "devices_updated": len(applied),
+                "missing_ids": missing_ids,
+                "skipped": [{"device_id": device_id, "error": error} for device_id, error in skipped.items()],
+                **stats,
+            }), 200
+        except ValueError as e:
+            db.rollback()
+            return jsonify({"error": str(e)}), 400
+        except (OperationalError, DatabaseError) as e:
+            db.rollback()
+            print(f"数据库连接错误: {e}")
+            return jsonify({
+                "error": "数据库连接失败",
+                "message": "无法连接到数据库服务器，请检查数据库配置和网络连接"
+            }), 503
+        except Exception as e:
+            db.rollback()
+            import traceback
+            error_trace = traceback.format_exc()
+            print(f"批量更新设备失败: {error_trace}")
+            return jsonify({"error": str(e), "traceback": error_trace}), 500
+        finally:
+            db.close()
+
+    @app.post("/api/devices/import")
+    def import_devices_stream():
+        """批量导入设备（NDJSON 或 CSV 流）
+
+        请求体为 NDJSON（每行一个设备对象）或 CSV（参数列以 param. 为前缀），也可作为表单文件 file 上传。
+        查询参数：
+        - format: ndjson | csv（默认按 Content-Type 判断）
+        - on_conflict: error | skip | update，设备编码已存在时的处理方式（默认 error）
+        - dry_run: true 时只校验不写入
+        按设备类型参数定义逐行校验，有效行分块批量写入，无效行在 errors 中返回行号与原因
+        """
+        db = next(get_db())
+        try:
+            upload = request.files.get("file")
+            stream = upload.stream if upload else request.stream
+            content_type = (upload.mimetype if upload else request.mimetype) or ""
+            default_format = "csv" if "csv" in content_type or (upload and upload.filename.lower().endswith(".csv")) else "ndjson"
+            summary = import_devices(
+                db,
+                stream,
+                fmt=request.args.get("format", default_format),
+                on_conflict=request.args.get("on_conflict", "error"),
+                dry_run=request.args.get("dry_run", "false").lower() == "true",
+            )
+            if summary["created"] and not summary["dry_run"]:
+                app.kpi_rollup.invalidate_static()
+            return jsonify(summary), 200
+        except ValueError as e:
+            db.rollback()
+            return jsonify({"error": str(e)}), 400
+        except (OperationalError, DatabaseError) as e:
+            db.rollback()
+            print(f"数据库连接错误: {e}")
+            return jsonify({
+                "error": "数据库连接失败",
+                "message": "无法连接到数据库服务器，请检查数据库配置和网络连接"
+            }), 503
+        except Exception as e:
+            db.rollback()
+            import traceback
+            error_trace = traceback.format_exc()
+            print(f"导入设备失败: {error_trace}")
+            return jsonify({"error": str(e), "traceback": error_trace}), 500
+        finally:
+            # 各批次单独提交，失败时也可能已有写入
+            app.fms_snapshots.invalidate()
+            app.topology_graph.mark_stale()
+            db.close()
+
+    @app.get("/api/devices/export")
+    def export_devices_stream():
+        """流式导出设备（NDJSON 或 CSV），服务端游标分批读取，不在内存中物化全部设备
+
+        查询参数：format=ndjson|csv（默认 ndjson），application_id、device_type_id、status 筛选
+        导出内容可直接用于 /api/devices/import
+        """
+        fmt = request.args.get("format", "ndjson")
+        if fmt not in ("ndjson", "csv"):
+            return jsonify({"error": "format 必须为 ndjson、csv 之一"}), 400
+        filters = []
+        application_id = request.args.get("application_id", None, type=int)
+        if application_id is not None:
+            filters.append(Device.application_id == application_id)
+        device_type_id = request.args.get("device_type_id", None, type=int)
+        if device_type_id is not None:
+            filters.append(Device.device_type_id == device_type_id)
+        status = request.args.get("status", None, type=str)
+        if status:
+            filters.append(Device.status == status)
+
+        filename = f"devices_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+        mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+        return Response(
+            stream_with_context(export_devices(lambda: next(get_db()), fmt=fmt, filters=filters)),
+            mimetype=f"{mimetype}; charset=utf-8",
+            headers={"Content-Disposition": f"attachment; filename={filename}"},
+        )
+
     @app.post("/api/devices/<int:device_id>/icon")
     def save_device_icon(device_id):
         """保存设备图标 SVG 文件"""
@@ -1775,6 +2206,8 @@ def register_routes(app: Flask) -> None:
                         db.add(param)
             
             db.commit()
+            app.fms_snapshots.invalidate()
+            app.topology_graph.mark_stale()
             db.refresh(device_type)
             
             return jsonify({
@@ -1808,6 +2241,8 @@ def register_routes(app: Flask) -> None:
             # 删除设备类型（级联删除参数）
             db.delete(device_type)
             db.commit()
+            app.fms_snapshots.invalidate()
+            app.topology_graph.mark_stale()
             
             return jsonify({
                 "message": "设备类型删除成功"
@@ -1876,6 +2311,7 @@ def register_routes(app: Flask) -> None:
             )
             db.add(label)
             db.commit()
+            app.kpi_rollup.invalidate_static()
             db.refresh(label)
             return jsonify({
                 "message": "标签类型创建成功",
@@ -1924,6 +2360,7 @@ def register_routes(app: Flask) -> None:
                 label.description = data.get("description", "")
 
             db.commit()
+            app.kpi_rollup.invalidate_static()
             db.refresh(label)
             return jsonify({
                 "message": "标签类型更新成功",
@@ -1949,6 +2386,7 @@ def register_routes(app: Flask) -> None:
 
             db.delete(label)
             db.commit()
+            app.kpi_rollup.invalidate_static()
             return jsonify({"message": "标签类型删除成功"}), 200
         except Exception as e:
             db.rollback()
@@ -2023,64 +2461,7 @@ def register_routes(app: Flask) -> None:
         """获取所有生产任务订单列表（scheduled + in_progress），将当前正在生产的订单置顶"""
         db = next(get_db())
         try:
-            # 获取所有 scheduled 和 in_progress 状态的订单
-            # 使用 CASE 语句确保 in_progress 状态的订单排在前面
-            from sqlalchemy import case
-            status_order = case(
-                (ProductionOrder.status == "in_progress", 0),
-                (ProductionOrder.status == "scheduled", 1),
-                else_=2
-            )
-            all_orders = (
-                db.query(ProductionOrder)
-                .options(joinedload(ProductionOrder.product_type))
-                .filter(ProductionOrder.status.in_(["scheduled", "in_progress"]))
-                .order_by(
-                    # 先按状态排序：in_progress (0) 在前，scheduled (1) 在后
-                    status_order.asc(),
-                    # 然后按排产日期排序
-                    ProductionOrder.scheduled_date.is_(None),
-                    ProductionOrder.scheduled_date.asc(),
-                    # 最后按 ID 排序
-                    ProductionOrder.id.asc(),
-                )
-                .all()
-            )
-
-            order_ids = [order.id for order in all_orders]
-            completed_counts = {}
-            if order_ids:
-                completed_rows = (
-                    db.query(ProductionProduct.order_id, func.count(ProductionProduct.id))
-                    .filter(ProductionProduct.order_id.in_(order_ids))
-                    .filter(ProductionProduct.status.in_(["completed", "packaged", "shipped"]))
-                    .group_by(ProductionProduct.order_id)
-                    .all()
-                )
-                completed_counts = {order_id: count for order_id, count in completed_rows}
-
-            order_data = []
-            for order in all_orders:
-                quantity = order.quantity or 0
-                # 只有当前正在执行的订单才展示实时完成进度
-                if order.status == "in_progress":
-                    completed = completed_counts.get(order.id, 0)
-                else:
-                    completed = 0
-                pending = max(quantity - completed, 0)
-                order_data.append({
-                    "order_id": order.id,
-                    "order_code": order.order_code,
-                    "product_code": order.product_code,
-                    "product_name": order.product_type.product_name if order.product_type else order.product_code,
-                    "quantity": quantity,
-                    "completed": completed,
-                    "pending": pending,
-                    "status": order.status,  # 添加状态字段，用于前端判断是否高亮
-                    "scheduled_date": order.scheduled_date.isoformat() if order.scheduled_date else None,
-                    "delivery_date": order.delivery_date.isoformat() if order.delivery_date else None,
-                })
-
+            order_data = query_in_progress_orders(db)
             return jsonify({"orders": order_data}), 200
         except (OperationalError, DatabaseError) as e:
             print(f"数据库连接错误: {e}")
@@ -2099,21 +2480,58 @@ def register_routes(app: Flask) -> None:
 
     @app.get("/api/simulation/events")
     def get_simulation_events():
-        simulator = getattr(app, "production_simulator", None)
-        if not simulator:
-            return jsonify({"events": []}), 200
+        """分页查询生产模拟事件日志
+
+        参数：since_id（返回该序号之后的事件，按时间正序）、before_id（返回该序号之前的事件，按时间倒序）、
+        until（ISO 时间上限）、order_id、stage、limit。返回 next_cursor 作为下一页游标。
+        """
         limit = request.args.get("limit", 100, type=int)
-        return jsonify({"events": simulator.get_events(limit)}), 200
+        store = getattr(app, "simulation_event_store", None)
+        if not store:
+            simulator = getattr(app, "production_simulator", None)
+            if not simulator:
+                return jsonify({"events": []}), 200
+            return jsonify({"events": simulator.get_events(limit)}), 200
+        try:
+            until = request.args.get("until")
+            if until:
+                until = datetime.fromisoformat(until)
+                if until.tzinfo is None:
+                    until = until.replace(tzinfo=timezone.utc)
+            page = store.query(
+                since_id=request.args.get("since_id", type=int),
+                before_id=request.args.get("before_id", type=int),
+                until=until or None,
+                order_id=request.args.get("order_id", type=int),
+                stage=request.args.get("stage") or None,
+                limit=limit,
+            )
+            return jsonify(page), 200
+        except ValueError as e:
+            return jsonify({"error": f"参数错误: {e}"}), 400
+        except (OperationalError, DatabaseError) as e:
+            print(f"数据库连接错误: {e}")
+            return jsonify({
+                "error": "数据库连接失败",
+                "message": "无法连接到数据库服务器，请检查数据库配置和网络连接"
+            }), 503
+        except Exception as e:
+            import traceback
+            error_trace = traceback.format_exc()
+            print(f"查询模拟事件失败: {error_trace}")
+            return jsonify({"error": str(e), "traceback": error_trace}), 500
 
     @app.get("/api/simulation/status")
     def get_simulation_status():
         simulator = getattr(app, "production_simulator", None)
         if not simulator:
             return jsonify({"running": False, "events": 0}), 200
-        return jsonify({
-            "running": simulator.running,
-            "events": len(simulator.events)
-        }), 200
+        status = simulator.get_status()
+        emitter = getattr(app, "simulation_emitter", None)
+        status["emitter"] = emitter.get_stats() if emitter else None
+        store = getattr(app, "simulation_event_store", None)
+        status["event_store"] = store.get_stats() if store else None
+        return jsonify(status), 200
 
     @app.post("/api/simulation/start")
     def start_simulation():
@@ -2123,6 +2541,9 @@ def register_routes(app: Flask) -> None:
             return jsonify({"error": "模拟器未初始化"}), 500
         if simulator.running:
             return jsonify({"message": "模拟器已在运行", "running": True}), 200
+        reset_job = app.job_manager.active("reset_orders")
+        if reset_job:
+            return jsonify({"error": "订单重置任务尚未完成，请稍后再启动", "job_id": reset_job.id}), 409
         simulator.start()
         return jsonify({"message": "模拟器已启动", "running": True}), 200
 
@@ -2135,16 +2556,6 @@ def register_routes(app: Flask) -> None:
         if not simulator.running:
             return jsonify({"message": "模拟器未运行", "running": False}), 200
         simulator.stop()
-        
-        db = next(get_db())
-        try:
-            reset_orders_and_products(db, log_prefix="停止生产")
-        except Exception as e:
-            db.rollback()
-            print(f"停止生产时重置订单和产品状态失败: {e}")
-        finally:
-            db.close()
-        
         # 3. 清空所有生产日志
         try:
             simulator.clear_events()
@@ -2156,7 +2567,80 @@ def register_routes(app: Flask) -> None:
         except Exception as e:
             print(f"停止生产时清空日志失败: {e}")
         
-        return jsonify({"message": "模拟器已停止，所有数据已重置", "running": False}), 200
+        # 4. 订单与产品重置在后台执行，进度通过 job_progress 推送或 /api/jobs/<id> 查询
+        job = submit_reset_job("停止生产")
+        return jsonify({
+            "message": "模拟器已停止，订单与产品正在后台重置",
+            "running": False,
+            "job_id": job.id,
+        }), 202
+
+    @app.post("/api/simulation/pause")
+    def pause_simulation():
+        """暂停生产模拟（保留当前订单与产品进度）"""
+        simulator = getattr(app, "production_simulator", None)
+        if not simulator:
+            return jsonify({"error": "模拟器未初始化"}), 500
+        if not simulator.running:
+            return jsonify({"message": "模拟器未运行", "running": False, "paused": False}), 200
+        simulator.pause()
+        return jsonify({"message": "模拟器已暂停", "running": True, "paused": True}), 200
+
+    @app.post("/api/simulation/resume")
+    def resume_simulation():
+        """恢复已暂停的生产模拟"""
+        simulator = getattr(app, "production_simulator", None)
+        if not simulator:
+            return jsonify({"error": "模拟器未初始化"}), 500
+        if not simulator.running:
+            return jsonify({"message": "模拟器未运行", "running": False, "paused": False}), 200
+        simulator.resume()
+        return jsonify({"message": "模拟器已恢复", "running": True, "paused": False}), 200
+
+    @app.post("/api/simulation/virtual-run")
+    def run_virtual_simulation():
+        """以虚拟时间快速推演生产（不受实时时钟限制，用于产能规划）"""
+        simulator = getattr(app, "production_simulator", None)
+        if not simulator:
+            return jsonify({"error": "模拟器未初始化"}), 500
+        if simulator.running:
+            return jsonify({"error": "实时模拟正在运行，请先停止"}), 409
+
+        if app.job_manager.active("reset_orders"):
+            return jsonify({"error": "订单重置任务正在执行，请稍后再试"}), 409
+        if not app.order_state_lock.acquire(blocking=False):
+            return jsonify({"error": "订单重置或其他虚拟推演正在执行，请稍后再试"}), 409
+
+        data = request.get_json(silent=True) or {}
+        try:
+            horizon = float(data.get("days") or 0) * 86400 + float(data.get("hours") or 0) * 3600
+            scheduled_date = date.fromisoformat(data["scheduled_date"]) if data.get("scheduled_date") else None
+            report = simulator.run_virtual(
+                order_ids=data.get("order_ids"),
+                scheduled_date=scheduled_date,
+                horizon=horizon or None,
+                repeat=bool(data.get("repeat", False)),
+                persist=bool(data.get("persist", False)),
+                max_events=int(data.get("events", 200)),
+            )
+            if report.get("persisted"):
+                app.kpi_rollup.invalidate()
+            return jsonify(report), 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except (OperationalError, DatabaseError) as e:
+            print(f"数据库连接错误: {e}")
+            return jsonify({
+                "error": "数据库连接失败",
+                "message": "无法连接到数据库服务器，请检查数据库配置和网络连接"
+            }), 503
+        except Exception as e:
+            import traceback
+            error_trace = traceback.format_exc()
+            print(f"虚拟时间推演失败: {error_trace}")
+            return jsonify({"error": str(e), "traceback": error_trace}), 500
+        finally:
+            app.order_state_lock.release()
 
     @app.post("/api/simulation/clear")
     def clear_simulation_events():
@@ -2172,40 +2656,81 @@ def register_routes(app: Flask) -> None:
             print(f"Error broadcasting clear event: {e}")
         return jsonify({"message": "日志已清空", "events": 0}), 200
 
+    def run_reset_job(job, log_prefix):
+        # 等待进行中的虚拟推演结束，期间新的虚拟推演会被拒绝
+        with app.order_state_lock:
+            db = next(get_db())
+            try:
+                stats = reset_orders_and_products(db, log_prefix=log_prefix, progress=job.report)
+                return {
+                    "orders_reset": stats["orders_reset"],
+                    "products_reset": stats["products_reset"],
+                    "normalize": stats["normalize_stats"],
+                    "remaining_abnormal": stats["remaining"],
+                }
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                db.close()
+                app.kpi_rollup.invalidate()
+
+    def submit_reset_job(log_prefix):
+        """提交订单重置后台任务；已有重置任务在执行时直接返回该任务"""
+        return app.job_manager.submit("reset_orders", run_reset_job, log_prefix)
+
     @app.post("/api/simulation/reset-orders")
     def reset_orders_to_initial_state():
-        """重置所有订单和产品状态为初始状态（scheduled）"""
+        """重置所有订单和产品状态为初始状态（scheduled），在后台分批执行"""
+        simulator = getattr(app, "production_simulator", None)
+        if simulator and simulator.running:
+            return jsonify({"error": "模拟器正在运行，请先停止"}), 409
+        job = submit_reset_job("开始生产前重置")
+        return jsonify({"message": "订单重置任务已提交", "job_id": job.id, "status": job.status}), 202
+
+    @app.get("/api/jobs/<job_id>")
+    def get_job(job_id):
+        """查询后台任务状态与进度"""
+        job = app.job_manager.get(job_id)
+        if not job:
+            return jsonify({"error": "任务不存在"}), 404
+        return jsonify(job.to_dict()), 200
+
+    # WebSocket event handlers
+    def emit_kpi_snapshot():
+        """向刚连接的客户端发送完整 KPI 快照（首页计数 + 生产任务订单），之后只推送增量"""
         db = next(get_db())
         try:
-            stats = reset_orders_and_products(db, log_prefix="开始生产前重置")
-            return jsonify({
-                "message": "订单状态已重置",
-                "orders_reset": stats["orders_reset"],
-                "products_reset": stats["products_reset"],
-                "normalize": stats["normalize_stats"],
-                "remaining_abnormal": stats["remaining"],
-            }), 200
-        except (OperationalError, DatabaseError) as e:
-            db.rollback()
-            print(f"数据库连接错误: {e}")
-            return jsonify({
-                "error": "数据库连接失败",
-                "message": "无法连接到数据库服务器，请检查数据库配置和网络连接"
-            }), 503
+            emit('kpi_update', {
+                'type': 'snapshot',
+                'overview': build_home_overview(app.kpi_rollup.snapshot()),
+                'orders': query_in_progress_orders(db),
+            })
         except Exception as e:
-            db.rollback()
-            import traceback
-            error_trace = traceback.format_exc()
-            print(f"重置订单状态失败: {error_trace}")
-            return jsonify({"error": str(e), "traceback": error_trace}), 500
+            print(f"发送 KPI 快照失败: {e}")
         finally:
             db.close()
 
-    # WebSocket event handlers
     @app.socketio.on('connect', namespace='/simulation')
-    def handle_simulation_connect():
-        """Handle WebSocket connection for simulation events."""
+    def handle_simulation_connect(auth=None):
+        """Handle WebSocket connection for simulation events.
+
+        A reconnecting client passes ``{"last_seq": n}`` as auth data and gets exactly
+        the events it missed (``simulation_events`` frame with ``replay``); missing
+        events older than the replay buffer are reported via ``simulation_gap``.
+        """
         print('Client connected to simulation namespace')
+        emit_kpi_snapshot()
+        store = getattr(app, "simulation_event_store", None)
+        last_seq = (auth or {}).get('last_seq') if isinstance(auth, dict) else None
+        if store and isinstance(last_seq, int):
+            replay = store.replay(last_seq, max_events=simulation_config.replay_limit)
+            if replay is not None:
+                if replay['gap']:
+                    emit('simulation_gap', {**replay['gap'], 'last_seq': replay['last_seq']})
+                if replay['events']:
+                    emit('simulation_events', {'events': replay['events'], 'replay': True})
+                return
         # Send initial events if available (limit to 20)
         simulator = getattr(app, "production_simulator", None)
         if simulator:
@@ -2338,6 +2863,8 @@ def register_routes(app: Flask) -> None:
             )
             db.add(topology)
             db.commit()
+            app.fms_snapshots.invalidate()
+            app.topology_graph.add_edge(topology.id, topology.source_device_code, topology.target_device_code, topology.connection_type)
             
             return jsonify({
                 "message": "拓扑连接创建成功",
@@ -2353,6 +2880,62 @@ def register_routes(app: Flask) -> None:
             if 'db' in locals():
                 db.close()
 
+    @app.post("/api/applications/<int:application_id>/topology/batch")
+    def batch_topology_connections(application_id):
+        """批量修改指定应用的网络拓扑（单个事务）
+
+        请求体：{"add": [{source_device_code, target_device_code, connection_type?, description?}],
+                 "update": [{id 或 source_device_code/target_device_code, connection_type?, description?}],
+                 "remove": [id 或 {source_device_code, target_device_code}]}
+        全部设备编码通过一次 IN 查询校验，任一变更不合法时不写入任何变更并返回全部错误；
+        add 中已存在的连接会更新其连接类型和描述
+        """
+        db = next(get_db())
+        try:
+            application = db.query(Application.id).filter(Application.id == application_id).first()
+            if not application:
+                return jsonify({"error": "应用不存在"}), 404
+
+            result = apply_topology_diff(db, application_id, request.get_json(silent=True))
+            db.commit()
+            app.fms_snapshots.invalidate()
+            for topology_id in result["removed_ids"]:
+                app.topology_graph.remove_edge(topology_id)
+            for topology in result["added"]:
+                app.topology_graph.add_edge(
+                    topology["id"], topology["source_device_code"], topology["target_device_code"], topology["connection_type"]
+                )
+            for topology in result["updated"]:
+                app.topology_graph.update_edge(topology["id"], topology["connection_type"])
+
+            return jsonify({
+                "message": "拓扑批量修改成功",
+                "added": len(result["added"]),
+                "updated": len(result["updated"]),
+                "removed": len(result["removed_ids"]),
+                "topology": result["added"] + result["updated"],
+                "removed_ids": result["removed_ids"]
+            }), 200
+        except ValueError as e:
+            db.rollback()
+            errors = e.args[0] if e.args and isinstance(e.args[0], list) else [str(e)]
+            return jsonify({"error": "拓扑变更校验失败", "errors": errors}), 400
+        except (OperationalError, DatabaseError) as e:
+            db.rollback()
+            print(f"数据库连接错误: {e}")
+            return jsonify({
+                "error": "数据库连接失败",
+                "message": "无法连接到数据库服务器，请检查数据库配置和网络连接"
+            }), 503
+        except Exception as e:
+            db.rollback()
+            import traceback
+            error_trace = traceback.format_exc()
+            print(f"批量修改拓扑失败: {error_trace}")
+            return jsonify({"error": str(e), "traceback": error_trace}), 500
+        finally:
+            db.close()
+
     @app.put("/api/topology/<int:topology_id>")
     def update_topology_connection(topology_id):
         """更新网络拓扑连接"""
@@ -2374,6 +2957,8 @@ def register_routes(app: Flask) -> None:
             topology.updated_at = datetime.utcnow()
             
             db.commit()
+            app.fms_snapshots.invalidate()
+            app.topology_graph.update_edge(topology.id, topology.connection_type)
             
             return jsonify({
                 "message": "拓扑连接更新成功",
@@ -2399,6 +2984,8 @@ def register_routes(app: Flask) -> None:
             
             db.delete(topology)
             db.commit()
+            app.fms_snapshots.invalidate()
+            app.topology_graph.remove_edge(topology_id)
             
             return jsonify({
                 "message": "拓扑连接删除成功"
@@ -2411,84 +2998,119 @@ def register_routes(app: Flask) -> None:
             if 'db' in locals():
                 db.close()
 
+    @app.get("/api/topology/devices/<string:device_code>/path")
+    def get_topology_upstream_path(device_code):
+        """设备的上行路径（沿 源设备 -> 目标设备 方向），默认到最近的根节点（如核心交换机），可用 to 指定终点"""
+        try:
+            graph = app.topology_graph
+            if not graph.has_node(device_code):
+                return jsonify({"error": "设备不在拓扑中"}), 404
+            to = request.args.get("to", None, type=str)
+            path = graph.upstream_path(device_code, to=to)
+            if path is None:
+                return jsonify({"error": f"设备 '{device_code}' 没有到 '{to}' 的上行路径"}), 404
+            return jsonify({
+                "device": graph.node(device_code),
+                "path": [graph.node(code) for code in path],
+                "hops": len(path) - 1
+            }), 200
+        except (OperationalError, DatabaseError) as e:
+            print(f"数据库连接错误: {e}")
+            return jsonify({
+                "error": "数据库连接失败",
+                "message": "无法连接到数据库服务器，请检查数据库配置和网络连接"
+            }), 503
+        except Exception as e:
+            import traceback
+            error_trace = traceback.format_exc()
+            return jsonify({"error": str(e), "traceback": error_trace}), 500
+
+    @app.get("/api/topology/devices/<string:device_code>/downstream")
+    def get_topology_downstream(device_code):
+        """设备（如交换机、PLC）下游的全部设备及其故障影响范围
+
+        isolated 为该设备故障后失去所有上行路径的设备（有冗余上行链路的设备不计入），
+        可用 type 按设备类型编码筛选，如 type=camera
+        """
+        try:
+            graph = app.topology_graph
+            if not graph.has_node(device_code):
+                return jsonify({"error": "设备不在拓扑中"}), 404
+            device_type = request.args.get("type", None, type=str)
+            downstream, isolated = graph.blast_radius(device_code)
+            devices = []
+            for code, hops in sorted(downstream.items(), key=lambda item: (item[1], item[0])):
+                node = graph.node(code)
+                if device_type and node["type"] != device_type:
+                    continue
+                devices.append(dict(node, hops=hops, isolated=code in isolated))
+            return jsonify({
+                "device": graph.node(device_code),
+                "downstream": devices,
+                "count": len(devices),
+                "isolated_count": sum(1 for device in devices if device["isolated"])
+            }), 200
+        except (OperationalError, DatabaseError) as e:
+            print(f"数据库连接错误: {e}")
+            return jsonify({
+                "error": "数据库连接失败",
+                "message": "无法连接到数据库服务器，请检查数据库配置和网络连接"
+            }), 503
+        except Exception as e:
+            import traceback
+            error_trace = traceback.format_exc()
+            return jsonify({"error": str(e), "traceback": error_trace}), 500
+
+    @app.get("/api/applications/<int:application_id>/topology/components")
+    def get_topology_components(application_id):
+        """应用内设备的拓扑连通分量（忽略连接方向），孤立设备各自成为一个分量"""
+        try:
+            components = app.topology_graph.components(application_id)
+            return jsonify({
+                "application_id": application_id,
+                "count": len(components),
+                "components": [{"size": len(codes), "devices": codes} for codes in components]
+            }), 200
+        except (OperationalError, DatabaseError) as e:
+            print(f"数据库连接错误: {e}")
+            return jsonify({
+                "error": "数据库连接失败",
+                "message": "无法连接到数据库服务器，请检查数据库配置和网络连接"
+            }), 503
+        except Exception as e:
+            import traceback
+            error_trace = traceback.format_exc()
+            return jsonify({"error": str(e), "traceback": error_trace}), 500
+
     @app.post("/api/plm/topology/save")
     def save_topology_layout():
-        """保存图块和连接线布局"""
-        db = None
+        """保存图块和连接线布局
+
+        增量保存：请求体带 base_version（加载时返回的 version）时，nodes / lines 只包含新增或修改的项，
+        removed_nodes / removed_lines 为删除的 id；布局已被他人保存（版本不一致）时返回 409 及 current_version。
+        不带 base_version 时按完整布局覆盖（兼容旧客户端）。成功后返回新的 version
+        """
+        db = next(get_db())
         try:
-            db = next(get_db())
-            data = request.get_json()
-            
+            data = request.get_json(silent=True)
             if not data:
                 return jsonify({"error": "请求数据为空"}), 400
-            
-            # 检查表是否存在，如果不存在则创建
-            from sqlalchemy import inspect
-            inspector = inspect(db.bind)
-            if "tk_positions" not in inspector.get_table_names():
-                # 表不存在，创建表
-                TK_Positions.__table__.create(db.bind, checkfirst=True)
-                print("✓ tk_positions 表已自动创建")
-            
-            # 清空原有数据
-            db.query(TK_Positions).delete()
-            
-            # 保存图块数据
-            nodes = data.get("nodes", [])
-            for node in nodes:
-                position = TK_Positions(
-                    item_type="node",
-                    item_id=node.get("id"),
-                    base_label=node.get("baseLabel"),
-                    label=node.get("label"),
-                    x=node.get("x"),
-                    y=node.get("y"),
-                    color=node.get("color"),
-                    item_type_code=node.get("type"),
-                    fixed=node.get("fixed", False),
-                )
-                db.add(position)
-            
-            # 保存连接线数据
-            lines = data.get("lines", [])
-            for line in lines:
-                position = TK_Positions(
-                    item_type="line",
-                    item_id=line.get("id"),
-                    start_x=line.get("startX"),
-                    start_y=line.get("startY"),
-                    end_x=line.get("endX"),
-                    end_y=line.get("endY"),
-                )
-                db.add(position)
-            
-            # 保存计数器数据（只保存一次，使用第一个记录存储）
-            if nodes or lines:
-                import json
-                device_counters = data.get("deviceCounters", {})
-                counters_record = TK_Positions(
-                    item_type="metadata",
-                    item_id="counters",
-                    device_counters=json.dumps(device_counters) if device_counters else None,
-                    node_id_counter=data.get("nodeIdCounter", 0),
-                    connection_line_id_counter=data.get("connectionLineIdCounter", 0),
-                )
-                db.add(counters_record)
-            
+
+            result = save_layout(db, data)
             db.commit()
-            
-            return jsonify({
-                "message": "布局保存成功",
-                "saved_nodes": len(nodes),
-                "saved_lines": len(lines)
-            }), 200
+
+            return jsonify(dict(result, message="布局保存成功")), 200
+        except LayoutVersionConflict as e:
+            db.rollback()
+            return jsonify({"error": "布局已被其他用户修改，请重新加载后再保存", "current_version": e.current_version}), 409
+        except ValueError as e:
+            db.rollback()
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
-            if 'db' in locals():
-                db.rollback()
+            db.rollback()
             return jsonify({"error": str(e)}), 500
         finally:
-            if 'db' in locals():
-                db.close()
+            db.close()
 
     @app.get("/api/plm/topology/load")
     def load_topology_layout():
@@ -2497,21 +3119,8 @@ def register_routes(app: Flask) -> None:
         try:
             db = next(get_db())
             
-            # 检查表是否存在
-            from sqlalchemy import inspect
-            inspector = inspect(db.bind)
-            if "tk_positions" not in inspector.get_table_names():
-                # 表不存在，返回空数据
-                return jsonify({
-                    "nodes": [],
-                    "lines": [],
-                    "deviceCounters": {},
-                    "nodeIdCounter": 0,
-                    "connectionLineIdCounter": 0
-                }), 200
-            
-            # 获取所有位置数据
-            positions = db.query(TK_Positions).all()
+            # 获取所有位置数据（表在启动时创建）
+            positions = db.query(TK_Positions).order_by(TK_Positions.id).all()
             
             if not positions:
                 return jsonify({
@@ -2519,7 +3128,8 @@ def register_routes(app: Flask) -> None:
                     "lines": [],
                     "deviceCounters": {},
                     "nodeIdCounter": 0,
-                    "connectionLineIdCounter": 0
+                    "connectionLineIdCounter": 0,
+                    "version": 0
                 }), 200
             
             nodes = []
@@ -2527,6 +3137,7 @@ def register_routes(app: Flask) -> None:
             device_counters = {}
             node_id_counter = 0
             connection_line_id_counter = 0
+            version = 0
             
             for pos in positions:
                 if pos.item_type == "node":
@@ -2558,13 +3169,15 @@ def register_routes(app: Flask) -> None:
                             device_counters = {}
                     node_id_counter = pos.node_id_counter or 0
                     connection_line_id_counter = pos.connection_line_id_counter or 0
+                    version = pos.version or 0
             
             return jsonify({
                 "nodes": nodes,
                 "lines": lines,
                 "deviceCounters": device_counters,
                 "nodeIdCounter": node_id_counter,
-                "connectionLineIdCounter": connection_line_id_counter
+                "connectionLineIdCounter": connection_line_id_counter,
+                "version": version
             }), 200
         except Exception as e:
             return jsonify({"error": str(e)}), 500
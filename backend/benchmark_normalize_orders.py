@@ -0,0 +1,124 @@
+"""normalize_order_products 性能基准
+
+在独立 schema（默认 normalize_benchmark）中生成订单与产品数据，模拟一次生产后的状态
+（部分产品已完成、部分订单产品多余或缺失），然后计时执行 normalize_order_products。
+不会读写业务表，结束后删除该 schema（--keep 保留）。
+
+用法：
+    python benchmark_normalize_orders.py                       # 10k 订单 / 1M 产品
+    python benchmark_normalize_orders.py --orders 1000 --products 100000 --orm
+"""
+import argparse
+import sys
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from config import db_config
+from database import Base, ProductType, ProductionOrder, ProductionProduct
+from app import normalize_order_products, _normalize_order_products_orm
+
+
+SEED_SQL = [
+    # 一个产品类型
+    """
+    INSERT INTO product_types (product_code, product_name, created_at, updated_at)
+    VALUES ('BENCH-PRD', 'Benchmark Laptop', now(), now())
+    """,
+    # 订单计划量围绕平均值上下浮动
+    """
+    INSERT INTO production_orders (order_code, product_code, product_type_id, quantity, status, created_at, updated_at)
+    SELECT 'BENCH-' || lpad(g::text, 6, '0'), 'BENCH-PRD', (SELECT id FROM product_types LIMIT 1),
+           :per_order + (g % 5) - 2, 'completed', now(), now()
+    FROM generate_series(1, :orders) AS g
+    """,
+    # 每个订单生成 per_order 条产品：计划量大于 per_order 的订单缺产品，小于的订单有多余产品
+    """
+    INSERT INTO production_products (serial_number, order_id, product_type_id, status, produced_at, produced_end, created_at, updated_at)
+    SELECT o.order_code || '-' || lpad(i::text, 4, '0'), o.id, o.product_type_id,
+           CASE WHEN i % 3 = 0 THEN 'scheduled' ELSE 'completed' END,
+           CASE WHEN i % 3 = 0 THEN NULL ELSE now() - interval '1 hour' END,
+           CASE WHEN i % 3 = 0 THEN NULL ELSE now() - interval '50 minutes' END,
+           now(), now()
+    FROM production_orders o
+    CROSS JOIN generate_series(1, :per_order) AS i
+    """,
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="normalize_order_products 性能基准")
+    parser.add_argument("--orders", type=int, default=10000, help="订单数")
+    parser.add_argument("--products", type=int, default=1000000, help="产品总数")
+    parser.add_argument("--schema", default="normalize_benchmark", help="基准数据所在 schema")
+    parser.add_argument("--orm", action="store_true", help="同时计时逐订单（ORM）实现，数据量大时非常慢")
+    parser.add_argument("--keep", action="store_true", help="结束后保留基准 schema")
+    args = parser.parse_args()
+
+    per_order = max(3, args.products // max(1, args.orders))
+    admin_engine = create_engine(db_config.sqlalchemy_url)
+    with admin_engine.begin() as conn:
+        conn.execute(text(f'DROP SCHEMA IF EXISTS "{args.schema}" CASCADE'))
+        conn.execute(text(f'CREATE SCHEMA "{args.schema}"'))
+
+    engine = create_engine(
+        db_config.sqlalchemy_url,
+        connect_args={"options": f"-csearch_path={args.schema}"},
+    )
+    Session = sessionmaker(bind=engine, autoflush=False)
+    tables = [ProductType.__table__, ProductionOrder.__table__, ProductionProduct.__table__]
+
+    def seed():
+        Base.metadata.drop_all(bind=engine, tables=tables)
+        Base.metadata.create_all(bind=engine, tables=tables)
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            for statement in SEED_SQL:
+                conn.execute(text(statement), {"orders": args.orders, "per_order": per_order})
+            conn.execute(text("ANALYZE"))
+        print(f"✓ 已生成 {args.orders} 个订单 / {args.orders * per_order} 条产品（{time.perf_counter() - started:.1f}s）")
+
+    def run(label, normalize):
+        session = Session()
+        try:
+            started = time.perf_counter()
+            stats = normalize(session)
+            session.commit()
+            elapsed = time.perf_counter() - started
+        finally:
+            session.close()
+        with engine.connect() as conn:
+            mismatched = conn.execute(text("""
+                SELECT COUNT(*) FROM production_orders o
+                LEFT JOIN (SELECT order_id, COUNT(*) AS n FROM production_products GROUP BY order_id) c
+                       ON c.order_id = o.id
+                WHERE COALESCE(c.n, 0) <> o.quantity
+            """)).scalar()
+            not_scheduled = conn.execute(text(
+                "SELECT COUNT(*) FROM production_products WHERE status IS DISTINCT FROM 'scheduled'"
+            )).scalar()
+        print(
+            f"{label}: {elapsed:.2f}s  新增 {stats['created']} / 删除 {stats['deleted']} / 重置 {stats['updated']}"
+            f"  （数量不符订单 {mismatched}，非 scheduled 产品 {not_scheduled}）"
+        )
+
+    try:
+        seed()
+        run("集合语句实现", normalize_order_products)
+        if args.orm:
+            seed()
+            run("逐订单 ORM 实现", _normalize_order_products_orm)
+    except Exception as e:
+        print(f"✗ 基准测试失败: {e}")
+        sys.exit(1)
+    finally:
+        engine.dispose()
+        if not args.keep:
+            with admin_engine.begin() as conn:
+                conn.execute(text(f'DROP SCHEMA IF EXISTS "{args.schema}" CASCADE'))
+        admin_engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import json
 from dataclasses import dataclass
 from typing import Literal
 
@@ -60,6 +61,59 @@ def get_database_config() -> DatabaseConfig:
 
 db_config = get_database_config()
 
+
+@dataclass
+class SimulationConfig:
+    """生产模拟器配置"""
+    write_mode: Literal["immediate", "batch"]
+    flush_batch_size: int
+    flush_interval: float
+    station_capacity: dict
+    worker_mode: Literal["thread", "process"]
+    lines: list
+    emit_interval: float
+    emit_queue_size: int
+    event_ring_size: int
+    event_retention_days: float
+    replay_limit: int
+
+
+def get_simulation_config() -> SimulationConfig:
+    """从环境变量读取生产模拟器配置"""
+    write_mode = os.getenv("SIM_WRITE_MODE", "immediate").lower()
+    if write_mode not in ["immediate", "batch"]:
+        write_mode = "immediate"
+    worker_mode = os.getenv("SIM_WORKER_MODE", "thread").lower()
+    if worker_mode not in ["thread", "process"]:
+        worker_mode = "thread"
+    return SimulationConfig(
+        write_mode=write_mode,
+        flush_batch_size=int(os.getenv("SIM_FLUSH_BATCH_SIZE", "200")),
+        flush_interval=float(os.getenv("SIM_FLUSH_INTERVAL", "2.0")),
+        # 工位并行能力，如 {"labeling": 2}，未配置的工位容量为 1
+        station_capacity=json.loads(os.getenv("SIM_STATION_CAPACITY", "{}")),
+        worker_mode=worker_mode,
+        # 多产线配置，如 [{"id": "A"}, {"id": "B", "station_capacity": {"labeling": 2}}]，为空时只运行一条产线
+        lines=json.loads(os.getenv("SIM_LINES", "[]")),
+        # WebSocket 事件按帧批量推送的间隔（毫秒）与待推送队列上限
+        emit_interval=float(os.getenv("SIM_EMIT_INTERVAL_MS", "200")) / 1000,
+        emit_queue_size=int(os.getenv("SIM_EMIT_QUEUE_SIZE", "2000")),
+        # 事件日志在内存中保留的最近事件数，游标查询命中时不访问数据库
+        event_ring_size=int(os.getenv("SIM_EVENT_RING_SIZE", "5000")),
+        # simulation_events 表保留的天数，后台每小时删除更早的事件；0 表示不清理
+        event_retention_days=float(os.getenv("SIM_EVENT_RETENTION_DAYS", "7")),
+        # 客户端断线重连时按 last_seq 最多补发的事件数
+        replay_limit=int(os.getenv("SIM_REPLAY_LIMIT", "500")),
+    )
+
+
+simulation_config = get_simulation_config()
+
+# LenovoFMS 设备快照（/api/lenovofms/devices）在进程内缓存的最长时间（秒），本进程内的写操作会立即使其失效
+fms_snapshot_ttl = float(os.getenv("FMS_SNAPSHOT_TTL", "60"))
+# 内存拓扑图索引的最长有效时间（秒），超时后下次查询时从数据库重建；本进程内的拓扑写操作实时更新
+topology_graph_ttl = float(os.getenv("TOPOLOGY_GRAPH_TTL", "300"))
+
 # 云侧模型访问控制配置
 class CloudModelAccessConfig:
     """云侧模型访问控制配置"""
@@ -1,6 +1,7 @@
 """创建 tk_positions 表的脚本"""
 import sys
 from database import init_db, engine, Base, TK_Positions
+from plm_layout import ensure_layout_schema
 from sqlalchemy import inspect
 
 
@@ -23,7 +24,13 @@ def main():
         print("✓ tk_positions 表已存在")
         response = input("是否要删除并重新创建表？这将删除现有数据！(y/N): ")
         if response.lower() != 'y':
-            print("已取消操作")
+            # 保留数据，仅补齐 version 列和 (item_type, item_id) 唯一索引
+            try:
+                ensure_layout_schema(engine)
+                print("✓ 已补齐 version 列和 (item_type, item_id) 唯一索引")
+            except Exception as e:
+                print(f"✗ 升级表结构失败: {e}")
+                sys.exit(1)
             return
         # 删除现有表
         TK_Positions.__table__.drop(engine, checkfirst=True)
@@ -31,8 +38,8 @@ def main():
 
     print("正在创建 tk_positions 表...")
     try:
-        # 只创建 tk_positions 表
-        TK_Positions.__table__.create(engine, checkfirst=True)
+        # 只创建 tk_positions 表（含 version 列和唯一索引）
+        ensure_layout_schema(engine)
         print("✓ tk_positions 表创建成功！")
         print("\n表结构：")
         print("  - id: 主键")
@@ -40,7 +47,7 @@ def main():
         print("  - item_id: 图块或连接线的唯一ID")
         print("  - base_label, label, x, y, color, item_type_code, fixed: 图块相关字段")
         print("  - start_x, start_y, end_x, end_y: 连接线相关字段")
-        print("  - device_counters, node_id_counter, connection_line_id_counter: 元数据字段")
+        print("  - device_counters, node_id_counter, connection_line_id_counter, version: 元数据字段")
     except Exception as e:
         print(f"✗ 创建表失败: {e}")
         import traceback
@@ -1,5 +1,5 @@
 """数据库连接和模型定义"""
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, Text, Boolean, Float, UniqueConstraint, Date
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, ForeignKey, DateTime, Text, Boolean, Float, UniqueConstraint, Date, Index, JSON
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
@@ -137,30 +137,73 @@ class DeviceTypeParameter(Base):
         }
 
 
+class Station(Base):
+    """工位表（设备所属的工位 / 区域，按应用划分）"""
+    __tablename__ = "stations"
+    __table_args__ = (
+        UniqueConstraint("application_id", "code", name="uq_station_application_code"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True, comment="工位ID")
+    application_id = Column(Integer, ForeignKey("applications.id", ondelete="CASCADE"), nullable=True, comment="所属应用程序ID")
+    code = Column(String(100), nullable=False, comment="工位编码（应用内唯一，如 read、label）")
+    name = Column(String(200), nullable=False, comment="工位名称")
+    description = Column(Text, nullable=True, comment="工位描述")
+    sort_order = Column(Integer, default=0, comment="排序顺序")
+    created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment="更新时间")
+
+    def __repr__(self):
+        return f"<Station(id={self.id}, code='{self.code}', application_id={self.application_id})>"
+
+    def to_dict(self):
+        """转换为字典格式"""
+        return {
+            "id": self.id,
+            "application_id": self.application_id,
+            "code": self.code,
+            "name": self.name,
+            "description": self.description,
+            "sort_order": self.sort_order,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
 class Device(Base):
     """设备表"""
     __tablename__ = "devices"
+    __table_args__ = (
+        # 设备列表按 (created_at, id) 游标分页（created_at DESC, id DESC 时反向扫描该索引）
+        Index("ix_devices_created_at_id", "created_at", "id"),
+        Index("ix_devices_ip_address", "ip_address"),
+        # 按工位查询设备并按 (created_at, id) 分页
+        Index("ix_devices_station_id_created_at_id", "station_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, comment="设备ID")
     name = Column(String(200), nullable=False, comment="设备名称")
     code = Column(String(100), nullable=False, unique=True, comment="设备编码（唯一）")
     device_type_id = Column(Integer, ForeignKey("device_types.id", ondelete="SET NULL"), nullable=True, comment="关联设备类型ID")
     application_id = Column(Integer, ForeignKey("applications.id", ondelete="SET NULL"), nullable=True, comment="所属应用程序ID")
+    station_id = Column(Integer, ForeignKey("stations.id", ondelete="SET NULL"), nullable=True, comment="所属工位ID")
     position_x = Column(Float, nullable=True, comment="显示X坐标")
     position_y = Column(Float, nullable=True, comment="显示Y坐标")
     serial_number = Column(String(100), nullable=True, comment="序列号")
+    ip_address = Column(String(64), nullable=True, comment="IP 地址（由 ip_address 参数值同步，便于按 IP 查询）")
     longitude = Column(Float, nullable=True, comment="经度")
     latitude = Column(Float, nullable=True, comment="纬度")
     status = Column(String(20), nullable=True, comment="设备状态")
     health_status = Column(String(20), nullable=True, comment="健康状态")
     description = Column(Text, nullable=True, comment="设备描述")
     last_heartbeat = Column(DateTime, nullable=True, comment="最后心跳时间")
-    created_at = Column(DateTime, nullable=True, comment="创建时间")
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, comment="创建时间（游标分页键，不可为空）")
     updated_at = Column(DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow, comment="更新时间")
 
     # 关联关系
     device_type = relationship("DeviceType", back_populates="devices")
     application = relationship("Application", backref="devices")
+    station = relationship("Station", backref="devices")
     parameter_values = relationship("DeviceParameterValue", back_populates="device", cascade="all, delete-orphan")
 
     def __repr__(self):
@@ -168,8 +211,8 @@ class Device(Base):
 
     def to_dict(self, include_parameters=False):
         """转换为字典格式"""
-        # 从参数值中获取 ip_address 和 port（用于列表显示）
-        ip_address = None
+        # 从参数值中获取 ip_address 和 port（用于列表显示），ip_address 以参数值为准
+        ip_address = self.ip_address
         port = None
         parameters = {}
         if self.parameter_values:
@@ -197,6 +240,7 @@ class Device(Base):
             "type": self.device_type.code if self.device_type else None,
             "device_type": self.device_type.to_dict() if self.device_type else None,
             "application_id": self.application_id,
+            "station_id": self.station_id,
             "position_x": self.position_x,
             "position_y": self.position_y,
             "ip_address": ip_address,
@@ -223,6 +267,10 @@ class DeviceParameterValue(Base):
     __tablename__ = "device_parameter_values"
     __table_args__ = (
         UniqueConstraint('device_id', 'param_key', name='uq_device_param'),
+        # 按参数键 + 类型化值的范围查询，如 exposure_time < 8
+        Index("ix_device_parameter_values_key_number", "param_key", "value_number"),
+        Index("ix_device_parameter_values_key_bool", "param_key", "value_bool"),
+        Index("ix_device_parameter_values_key_date", "param_key", "value_date"),
     )
 
     id = Column(Integer, primary_key=True, index=True, comment="参数值ID")
@@ -230,6 +278,10 @@ class DeviceParameterValue(Base):
     parameter_id = Column(Integer, ForeignKey("device_type_parameters.id", ondelete="CASCADE"), nullable=False, comment="关联参数ID")
     param_key = Column(String(50), nullable=False, comment="参数键（冗余字段，便于查询）")
     param_value = Column(Text, nullable=True, comment="参数值")
+    # 按参数类型解析后的值，仅与 param_type 对应的一列有值，便于建索引和比较
+    value_number = Column(Float, nullable=True, comment="数值型参数值")
+    value_bool = Column(Boolean, nullable=True, comment="布尔型参数值")
+    value_date = Column(Date, nullable=True, comment="日期型参数值")
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment="更新时间")
 
     # 关联关系
@@ -355,6 +407,33 @@ class ProductionProduct(Base):
         return f"<ProductionProduct(id={self.id}, serial_number='{self.serial_number}')>"
 
 
+class SimulationEvent(Base):
+    """生产模拟事件日志表（只追加，按 id 游标分页）"""
+    __tablename__ = "simulation_events"
+
+    # id 由事件存储按写入顺序分配，单调递增，可直接作为分页游标
+    id = Column(BigInteger, primary_key=True, autoincrement=False, comment="事件序号")
+    event_uid = Column(String(36), nullable=False, comment="事件UUID")
+    created_at = Column(DateTime(timezone=True), nullable=False, comment="事件时间")
+    stage = Column(String(50), nullable=False, comment="事件阶段")
+    level = Column(String(10), nullable=True, comment="日志级别")
+    source = Column(String(50), nullable=True, comment="事件来源")
+    line_id = Column(String(50), nullable=True, comment="产线编号")
+    order_id = Column(Integer, nullable=True, comment="订单ID")
+    product_id = Column(Integer, nullable=True, comment="产品ID")
+    message = Column(Text, nullable=True, comment="格式化后的日志消息")
+    payload = Column(JSON, nullable=False, comment="完整事件内容")
+
+    __table_args__ = (
+        Index("ix_simulation_events_order_id", "order_id", "id"),
+        Index("ix_simulation_events_stage", "stage", "id"),
+        Index("ix_simulation_events_created_at", "created_at"),
+    )
+
+    def __repr__(self):
+        return f"<SimulationEvent(id={self.id}, stage='{self.stage}')>"
+
+
 class User(Base):
     """用户表"""
     __tablename__ = "users"
@@ -469,6 +548,10 @@ class VideoStream(Base):
 class TK_Positions(Base):
     """图块和连接线位置表"""
     __tablename__ = "tk_positions"
+    __table_args__ = (
+        # 增量保存按 (item_type, item_id) 覆盖写入
+        Index("uq_tk_positions_item", "item_type", "item_id", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True, comment="记录ID")
     item_type = Column(String(20), nullable=False, comment="类型: node(图块) 或 line(连接线)")
@@ -487,6 +570,7 @@ class TK_Positions(Base):
     device_counters = Column(Text, nullable=True, comment="设备计数器JSON（用于图块命名）")
     node_id_counter = Column(Integer, nullable=True, default=0, comment="节点ID计数器")
     connection_line_id_counter = Column(Integer, nullable=True, default=0, comment="连接线ID计数器")
+    version = Column(Integer, nullable=True, default=0, comment="布局版本号（仅元数据记录，每次保存加 1）")
     created_at = Column(DateTime, default=datetime.utcnow, comment="创建时间")
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment="更新时间")
 
@@ -510,6 +594,7 @@ class TK_Positions(Base):
             "device_counters": self.device_counters,
             "node_id_counter": self.node_id_counter,
             "connection_line_id_counter": self.connection_line_id_counter,
+            "version": self.version,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
         }
@@ -0,0 +1,405 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from database import Application, Device, DeviceParameterValue, DeviceType, DeviceTypeParameter, Station
+from device_parameters import (
+    CUSTOM_PARAMETERS,
+    dialect_insert,
+    parse_bool,
+    parse_date,
+    parse_number,
+    upsert_device_parameters,
+)
+from stations import derive_station_ids
+
+IMPORT_FORMATS = ("ndjson", "csv")
+CONFLICT_MODES = ("error", "skip", "update")
+# Plain device columns accepted on import and written on export
+DEVICE_FIELDS = (
+    "code", "name", "serial_number", "application_id", "station_id", "status", "health_status", "description",
+    "position_x", "position_y", "longitude", "latitude",
+)
+FLOAT_FIELDS = ("position_x", "position_y", "longitude", "latitude")
+INTEGER_FIELDS = ("application_id", "station_id")
+# CSV columns prefixed with this carry parameter values, e.g. param.ip_address
+CSV_PARAM_PREFIX = "param."
+IMPORT_CHUNK_SIZE = 1000
+EXPORT_PARTITION_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+
+# ----------------- reading -----------------
+def _read_records(stream, fmt):
+    """Yield (line_number, record | None, error) from an NDJSON or CSV byte stream."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "ndjson":
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_number, None, f"JSON 解析失败: {e.msg}"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, "每行必须是 JSON 对象"
+                continue
+            yield line_number, record, None
+        return
+
+    reader = csv.DictReader(text)
+    for record in reader:
+        parameters = {}
+        device = {}
+        for key, value in record.items():
+            if key is None:
+                continue
+            value = value if value != "" else None
+            if key.startswith(CSV_PARAM_PREFIX):
+                if value is not None:
+                    parameters[key[len(CSV_PARAM_PREFIX):]] = value
+            else:
+                device[key] = value
+        device["parameters"] = parameters
+        # Header is line 1
+        yield reader.line_num, device, None
+
+
+class DeviceTypeCatalog:
+    """Device types and their parameter definitions, loaded once per import."""
+
+    def __init__(self, session):
+        self.by_code = {}
+        self.by_id = {}
+        definitions = {}
+        for definition in session.query(
+            DeviceTypeParameter.device_type_id, DeviceTypeParameter.param_key,
+            DeviceTypeParameter.param_type, DeviceTypeParameter.required,
+        ):
+            definitions.setdefault(definition.device_type_id, {})[definition.param_key] = definition
+        for device_type in session.query(DeviceType.id, DeviceType.code):
+            entry = {"id": device_type.id, "code": device_type.code, "parameters": definitions.get(device_type.id, {})}
+            self.by_code[device_type.code] = entry
+            self.by_id[device_type.id] = entry
+
+    def resolve(self, record):
+        if record.get("device_type_id") not in (None, ""):
+            try:
+                return self.by_id.get(int(record["device_type_id"]))
+            except (TypeError, ValueError):
+                return None
+        if record.get("device_type"):
+            return self.by_code.get(str(record["device_type"]))
+        return None
+
+
+def _validate(record, catalog):
+    """Normalize one record into (device_values, device_type, parameters) or raise ValueError(errors)."""
+    errors = []
+    values = {}
+    for field in DEVICE_FIELDS:
+        value = record.get(field)
+        if value is None or value == "":
+            continue
+        if field in FLOAT_FIELDS:
+            parsed = parse_number(value)
+            if parsed is None:
+                errors.append(f"{field} 必须为数字")
+            value = parsed
+        elif field in INTEGER_FIELDS:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                errors.append(f"{field} 必须为整数")
+        else:
+            value = str(value).strip()
+        values[field] = value
+    if not values.get("code"):
+        errors.append("缺少 code")
+    if not values.get("name"):
+        errors.append("缺少 name")
+
+    device_type = None
+    if record.get("device_type") or record.get("device_type_id") not in (None, ""):
+        device_type = catalog.resolve(record)
+        if device_type is None:
+            errors.append(f"设备类型不存在: {record.get('device_type') or record.get('device_type_id')}")
+
+    parameters = record.get("parameters") or {}
+    if not isinstance(parameters, dict):
+        errors.append("parameters 必须为对象")
+        parameters = {}
+    if parameters and device_type is None and not errors:
+        errors.append("设置参数值时必须指定设备类型")
+    if device_type is not None:
+        definitions = device_type["parameters"]
+        if parameters and not definitions:
+            errors.append(f"设备类型 {device_type['code']} 没有定义参数")
+        for key, value in parameters.items():
+            definition = definitions.get(key)
+            param_type = definition.param_type if definition else CUSTOM_PARAMETERS.get(key, (None, None))[1]
+            if param_type is None:
+                errors.append(f"设备类型 {device_type['code']} 未定义参数 {key}")
+            elif value is not None and value != "":
+                parser = {"number": parse_number, "boolean": parse_bool, "date": parse_date}.get(param_type)
+                if parser and parser(value) is None:
+                    errors.append(f"参数 {key} 的值 {value!r} 不是有效的 {param_type}")
+        for key, definition in definitions.items():
+            if definition.required and parameters.get(key) in (None, ""):
+                errors.append(f"缺少必填参数 {key}")
+    if errors:
+        raise ValueError(errors)
+    return values, device_type, parameters
+
+
+# ----------------- import -----------------
+def import_devices(session, stream, fmt="ndjson", on_conflict="error", dry_run=False, chunk_size=IMPORT_CHUNK_SIZE):
+    """Validate and load devices from an NDJSON / CSV stream.
+
+    Rows are validated against the device type parameter definitions; invalid
+    rows are reported (line number, code, messages) and skipped while valid
+    rows are loaded in chunks of ``chunk_size`` with one batched
+    ``INSERT ... ON CONFLICT (code)`` for devices and one parameter upsert per
+    chunk, each chunk committed on its own. Referenced ``application_id`` /
+    ``station_id`` values are checked per chunk and rows pointing at missing
+    ones are reported; a chunk whose write still fails an integrity check is
+    rolled back and all its rows reported. ``on_conflict`` decides what
+    happens to codes that already exist: ``error`` reports them, ``skip``
+    leaves them untouched, ``update`` overwrites the given fields and
+    parameters. ``dry_run`` validates without writing.
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"format 必须为 {', '.join(IMPORT_FORMATS)} 之一")
+    if on_conflict not in CONFLICT_MODES:
+        raise ValueError(f"on_conflict 必须为 {', '.join(CONFLICT_MODES)} 之一")
+
+    catalog = DeviceTypeCatalog(session)
+    insert = dialect_insert(session)
+    summary = {"received": 0, "created": 0, "updated": 0, "skipped": 0, "failed": 0, "dry_run": dry_run, "errors": []}
+    seen_codes = set()
+
+    def report(line_number, code, messages):
+        summary["failed"] += 1
+        if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+            summary["errors"].append({"line": line_number, "code": code, "errors": messages})
+
+    def load(chunk):
+        codes = [values["code"] for _, values, _, _ in chunk]
+        existing = {
+            row.code: row.id for row in session.query(Device.code, Device.id).filter(Device.code.in_(codes))
+        }
+        # Referenced applications / stations are checked with one IN query each
+        application_ids = {values["application_id"] for _, values, _, _ in chunk if values.get("application_id") is not None}
+        station_ids = {values["station_id"] for _, values, _, _ in chunk if values.get("station_id") is not None}
+        known_applications = {
+            row.id for row in session.query(Application.id).filter(Application.id.in_(application_ids))
+        } if application_ids else set()
+        station_applications = {
+            row.id: row.application_id
+            for row in session.query(Station.id, Station.application_id).filter(Station.id.in_(station_ids))
+        } if station_ids else {}
+        rows = []
+        for line_number, values, device_type, parameters in chunk:
+            code = values["code"]
+            errors = []
+            application_id, station_id = values.get("application_id"), values.get("station_id")
+            if application_id is not None and application_id not in known_applications:
+                errors.append(f"应用不存在: {application_id}")
+            if station_id is not None:
+                if station_id not in station_applications:
+                    errors.append(f"工位不存在: {station_id}")
+                elif application_id is not None and station_applications[station_id] != application_id:
+                    errors.append(f"工位 {station_id} 不属于应用 {application_id}")
+            if errors:
+                report(line_number, code, errors)
+                continue
+            if code in existing:
+                if on_conflict == "error":
+                    report(line_number, code, [f"设备编码已存在: {code}"])
+                    continue
+                if on_conflict == "skip":
+                    summary["skipped"] += 1
+                    continue
+            rows.append((line_number, values, device_type, parameters))
+        if not rows:
+            return
+        updated = sum(1 for _, values, _, _ in rows if values["code"] in existing)
+        if dry_run:
+            summary["updated"] += updated
+            summary["created"] += len(rows) - updated
+            return
+
+        try:
+            now = datetime.utcnow()
+            # Without an explicit station_id, new devices and devices whose description or
+            # application changes are (re)assigned from the description / code conventions
+            derive = [
+                values for _, values, _, _ in rows
+                if "station_id" not in values and (
+                    values["code"] not in existing or "description" in values or "application_id" in values
+                )
+            ]
+            current = {}
+            if any(values["code"] in existing for values in derive):
+                current = {
+                    row.code: row for row in session.query(Device.code, Device.application_id, Device.description)
+                    .filter(Device.code.in_([values["code"] for values in derive if values["code"] in existing]))
+                }
+
+            def derivation(values):
+                stored = current.get(values["code"])
+                application_id = values["application_id"] if "application_id" in values else stored and stored.application_id
+                description = values["description"] if "description" in values else stored and stored.description
+                return application_id, description, values["code"]
+
+            derived = derive_station_ids(session, {values["code"]: derivation(values) for values in derive})
+            # Batched inserts need the same keys in every row; updates only touch given fields
+            groups = {}
+            for _, values, device_type, _ in rows:
+                row = dict(values, updated_at=now)
+                if values["code"] in derived:
+                    row["station_id"] = derived[values["code"]]
+                if device_type is not None:
+                    row["device_type_id"] = device_type["id"]
+                if values["code"] not in existing:
+                    row.setdefault("status", "在线")
+                    row.setdefault("health_status", "良好")
+                    row["created_at"] = now
+                groups.setdefault(tuple(sorted(row)), []).append(row)
+            ids = {}
+            for keys, group in groups.items():
+                statement = insert(Device.__table__)
+                statement = statement.on_conflict_do_update(
+                    index_elements=["code"],
+                    set_={key: statement.excluded[key] for key in keys if key not in ("code", "created_at")},
+                ).returning(Device.__table__.c.id, Device.__table__.c.code)
+                ids.update({code: device_id for device_id, code in session.execute(statement, group)})
+
+            items = [
+                (ids[values["code"]], device_type["id"], parameters)
+                for _, values, device_type, parameters in rows
+                if parameters and device_type is not None
+            ]
+            skipped = upsert_device_parameters(session, items)["skipped"] if items else {}
+            session.commit()
+        except IntegrityError as e:
+            # E.g. a referenced row deleted concurrently: only this chunk is rolled back
+            session.rollback()
+            message = f"写入失败: {getattr(e, 'orig', e)}"
+            for line_number, values, _, _ in rows:
+                report(line_number, values["code"], [message])
+            return
+        summary["updated"] += updated
+        summary["created"] += len(rows) - updated
+        # Definitions changed since validation: the device row is written, its parameters are not
+        for line_number, values, _, _ in rows:
+            if ids[values["code"]] in skipped:
+                report(line_number, values["code"], [f"参数未写入: {skipped[ids[values['code']]]}"])
+
+    chunk = []
+    for line_number, record, error in _read_records(stream, fmt):
+        summary["received"] += 1
+        if error:
+            report(line_number, None, [error])
+            continue
+        code = str(record.get("code") or "").strip() or None
+        try:
+            values, device_type, parameters = _validate(record, catalog)
+        except ValueError as e:
+            report(line_number, code, e.args[0])
+            continue
+        if code in seen_codes:
+            report(line_number, code, [f"文件中设备编码重复: {code}"])
+            continue
+        seen_codes.add(code)
+        chunk.append((line_number, values, device_type, parameters))
+        if len(chunk) >= chunk_size:
+            load(chunk)
+            chunk = []
+    if chunk:
+        load(chunk)
+    return summary
+
+
+# ----------------- export -----------------
+EXPORT_COLUMNS = ("id",) + DEVICE_FIELDS + ("device_type", "ip_address", "created_at", "updated_at")
+
+
+def _export_query(filters):
+    device_type_code = (
+        select(DeviceType.code).where(DeviceType.id == Device.device_type_id).scalar_subquery().label("device_type")
+    )
+    columns = [device_type_code if column == "device_type" else getattr(Device, column) for column in EXPORT_COLUMNS]
+    return select(*columns).where(*filters).order_by(Device.id)
+
+
+def _export_parameter_keys(session, filters):
+    type_ids = select(Device.device_type_id).where(*filters).distinct()
+    rows = session.execute(
+        select(DeviceTypeParameter.param_key)
+        .where(DeviceTypeParameter.device_type_id.in_(type_ids))
+        .distinct()
+        .order_by(DeviceTypeParameter.param_key)
+    )
+    return [key for key, in rows]
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_devices(session_factory, fmt="ndjson", filters=()):
+    """Generator of NDJSON / CSV chunks for all devices matching ``filters``.
+
+    Devices are read through a server-side cursor (``stream_results``) in
+    partitions of EXPORT_PARTITION_SIZE; the parameter values of each
+    partition are fetched with one query, so memory stays bounded by one
+    partition regardless of fleet size. The output can be fed back to
+    import_devices.
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"format 必须为 {', '.join(IMPORT_FORMATS)} 之一")
+    session = session_factory()
+    try:
+        parameter_keys = _export_parameter_keys(session, filters) if fmt == "csv" else []
+        buffer = io.StringIO()
+        writer = None
+        if fmt == "csv":
+            writer = csv.writer(buffer)
+            writer.writerow(list(EXPORT_COLUMNS) + [CSV_PARAM_PREFIX + key for key in parameter_keys])
+            yield "\ufeff" + buffer.getvalue()
+
+        result = session.execute(
+            _export_query(filters).execution_options(stream_results=True, yield_per=EXPORT_PARTITION_SIZE)
+        )
+        for partition in result.partitions():
+            device_ids = [row.id for row in partition]
+            parameters = {}
+            for device_id, key, value in session.execute(
+                select(DeviceParameterValue.device_id, DeviceParameterValue.param_key, DeviceParameterValue.param_value)
+                .where(DeviceParameterValue.device_id.in_(device_ids))
+            ):
+                parameters.setdefault(device_id, {})[key] = value
+
+            buffer.seek(0)
+            buffer.truncate()
+            for row in partition:
+                record = {column: _json_value(value) for column, value in zip(EXPORT_COLUMNS, row)}
+                device_parameters = parameters.get(row.id, {})
+                if fmt == "ndjson":
+                    record["parameters"] = device_parameters
+                    buffer.write(json.dumps(record, ensure_ascii=False))
+                    buffer.write("\n")
+                else:
+                    writer.writerow(
+                        [record[column] for column in EXPORT_COLUMNS]
+                        + [device_parameters.get(key) for key in parameter_keys]
+                    )
+            yield buffer.getvalue()
+    finally:
+        session.close()
@@ -0,0 +1,365 @@
+from datetime import date, datetime
+
+from sqlalchemy import bindparam, exists, func, inspect, select, text, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database import Device, DeviceParameterValue, DeviceTypeParameter, Station
+
+# Parameters mirrored into an indexed column on devices
+PROMOTED_PARAMETERS = {"ip_address": "ip_address"}
+TYPED_COLUMNS = {"number": "value_number", "boolean": "value_bool", "date": "value_date"}
+COMPARISON_OPERATORS = {
+    "eq": lambda column, value: column == value,
+    "ne": lambda column, value: column != value,
+    "lt": lambda column, value: column < value,
+    "lte": lambda column, value: column <= value,
+    "gt": lambda column, value: column > value,
+    "gte": lambda column, value: column >= value,
+}
+
+
+def parse_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    lowered = str(value).strip().lower()
+    if lowered in ("true", "1", "yes", "on"):
+        return True
+    if lowered in ("false", "0", "no", "off"):
+        return False
+    return None
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value).strip()[:10])
+    except ValueError:
+        return None
+
+
+def coerce_parameter_value(param_type, value):
+    """Stored representation of a parameter value.
+
+    Returns the columns to assign: the canonical string in ``param_value``
+    (same rules the device handlers always used) plus the typed column for
+    number / boolean / date parameters. Values that do not parse keep their
+    string and leave the typed column empty.
+    """
+    typed = {"value_number": None, "value_bool": None, "value_date": None}
+    if value is None:
+        return {"param_value": None, **typed}
+    if param_type == "boolean":
+        parsed = parse_bool(value)
+        string = ("true" if parsed else "false") if parsed is not None else ("true" if value else "false")
+        typed["value_bool"] = parsed if parsed is not None else bool(value)
+    elif param_type == "number":
+        string = None if value == "" else str(value)
+        typed["value_number"] = parse_number(value) if string is not None else None
+    elif param_type == "date":
+        string = value if isinstance(value, str) else str(value)
+        typed["value_date"] = parse_date(value)
+    else:
+        string = str(value)
+    return {"param_value": string, **typed}
+
+
+def set_parameter_value(device, parameter_value, param_type, value):
+    """Assign ``value`` to a DeviceParameterValue and keep promoted device columns in sync."""
+    for column, stored in coerce_parameter_value(param_type, value).items():
+        setattr(parameter_value, column, stored)
+    column = PROMOTED_PARAMETERS.get(parameter_value.param_key)
+    if column:
+        setattr(device, column, parameter_value.param_value)
+
+
+def parse_parameter_filter(expression):
+    """``key:op:value`` (e.g. ``exposure_time:lt:8``) -> (key, op, value)."""
+    parts = expression.split(":", 2)
+    if len(parts) != 3 or not parts[0] or parts[1] not in COMPARISON_OPERATORS:
+        raise ValueError(
+            f"参数筛选格式应为 key:op:value，op 为 {', '.join(COMPARISON_OPERATORS)} 之一: {expression}"
+        )
+    return parts[0], parts[1], parts[2]
+
+
+def parameter_filter(session, key, op, raw_value):
+    """EXISTS clause matching devices whose parameter ``key`` compares to ``raw_value``.
+
+    The value is compared in the typed column of the parameter's declared type,
+    so the (param_key, value_*) indexes are used; string parameters only
+    support eq / ne on param_value.
+    """
+    param_types = {
+        row[0] for row in session.query(DeviceTypeParameter.param_type).filter(DeviceTypeParameter.param_key == key).distinct()
+    }
+    typed = [param_type for param_type in param_types if param_type in TYPED_COLUMNS]
+    param_type = typed[0] if len(typed) == 1 else None
+    if param_type == "number":
+        value = parse_number(raw_value)
+    elif param_type == "boolean":
+        value = parse_bool(raw_value)
+    elif param_type == "date":
+        value = parse_date(raw_value)
+    else:
+        if op not in ("eq", "ne"):
+            raise ValueError(f"参数 {key} 不是数值/布尔/日期类型，只支持 eq、ne 比较")
+        value = raw_value
+    if value is None:
+        raise ValueError(f"参数 {key} 的比较值无法解析: {raw_value}")
+    column = getattr(DeviceParameterValue, TYPED_COLUMNS[param_type]) if param_type else DeviceParameterValue.param_value
+    return exists().where(
+        DeviceParameterValue.device_id == Device.id,
+        DeviceParameterValue.param_key == key,
+        COMPARISON_OPERATORS[op](column, value),
+    )
+
+
+def ensure_device_schema(bind):
+    """Add the typed / promoted / station columns and the declared indexes of
+    devices and device_parameter_values to existing tables, creating the
+    stations table first.
+
+    Also copies ip_address parameter values into devices.ip_address where the
+    column is still empty, and backfills devices.created_at (the keyset
+    pagination key) from updated_at or the current time before making it NOT
+    NULL. Typed columns of existing rows are filled by
+    migrate_typed_device_parameters.py.
+    """
+    Station.__table__.create(bind, checkfirst=True)
+    inspector = inspect(bind)
+    missing = {
+        table.name: [column for column in table.columns if column.name not in {c["name"] for c in inspector.get_columns(table.name)}]
+        for table in (Device.__table__, DeviceParameterValue.__table__)
+    }
+    created_at_nullable = next(c["nullable"] for c in inspector.get_columns("devices") if c["name"] == "created_at")
+    with bind.begin() as conn:
+        for table_name, columns in missing.items():
+            for column in columns:
+                column_type = column.type.compile(dialect=bind.dialect)
+                references = "".join(
+                    f" REFERENCES {fk.column.table.name}({fk.column.name})" + (f" ON DELETE {fk.ondelete}" if fk.ondelete else "")
+                    for fk in column.foreign_keys
+                )
+                conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}{references}'))
+        devices = Device.__table__
+        conn.execute(
+            update(devices)
+            .where(devices.c.created_at.is_(None))
+            .values(created_at=func.coalesce(devices.c.updated_at, datetime.utcnow()), updated_at=devices.c.updated_at)
+        )
+        # SQLite cannot alter a column constraint; the model default keeps new rows non-null there
+        if created_at_nullable and bind.dialect.name == "postgresql":
+            conn.execute(text("ALTER TABLE devices ALTER COLUMN created_at SET NOT NULL"))
+        for table in (Device.__table__, DeviceParameterValue.__table__):
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        for key, column in PROMOTED_PARAMETERS.items():
+            value = (
+                select(DeviceParameterValue.param_value)
+                .where(DeviceParameterValue.device_id == Device.id, DeviceParameterValue.param_key == key)
+                .scalar_subquery()
+            )
+            has_value = exists().where(
+                DeviceParameterValue.device_id == Device.id,
+                DeviceParameterValue.param_key == key,
+                DeviceParameterValue.param_value.isnot(None),
+            )
+            conn.execute(
+                update(Device.__table__)
+                .where(getattr(Device.__table__.c, column).is_(None), has_value)
+                .values({column: value})
+            )
+
+
+# Display parameters that are not declared by device types; their definition is
+# created on the device type the first time a device sets them
+CUSTOM_PARAMETERS = {
+    "icon_rotation_angle": ("图标旋转角度", "number"),
+    "icon_flip_horizontal": ("图标水平翻转", "boolean"),
+    "icon_flip_vertical": ("图标垂直翻转", "boolean"),
+    "rotation_angle": ("旋转角度", "number"),
+    "flip_horizontal": ("水平翻转", "boolean"),
+    "flip_vertical": ("垂直翻转", "boolean"),
+}
+UPSERT_CHUNK_ROWS = 1000
+
+
+DIALECT_INSERTS = {"postgresql": postgresql_insert, "sqlite": sqlite_insert}
+VALUE_COLUMNS = ("parameter_id", "param_value", "value_number", "value_bool", "value_date", "updated_at")
+
+
+class UnsupportedDialectError(RuntimeError):
+    """The database has no ``INSERT ... ON CONFLICT`` support known to this module."""
+
+
+def dialect_insert(session):
+    """``insert`` construct with ``on_conflict_do_*`` for the session's database."""
+    dialect = session.get_bind().dialect.name
+    if dialect not in DIALECT_INSERTS:
+        raise UnsupportedDialectError(f"数据库 {dialect} 不支持 INSERT ... ON CONFLICT，仅支持 PostgreSQL / SQLite")
+    return DIALECT_INSERTS[dialect]
+
+
+def _write_values(session, rows):
+    """Upsert parameter value rows keyed by (device_id, param_key).
+
+    On PostgreSQL / SQLite this is one ``INSERT ... ON CONFLICT DO UPDATE``
+    executemany (chunked for very large pushes). Other databases read the
+    existing keys once and then run one executemany INSERT and one
+    executemany UPDATE.
+    """
+    table = DeviceParameterValue.__table__
+    insert = DIALECT_INSERTS.get(session.get_bind().dialect.name)
+    if insert is not None:
+        # executemany: SQLAlchemy batches the rows into multi-row VALUES with a cached statement
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=["device_id", "param_key"],
+            set_={column: statement.excluded[column] for column in VALUE_COLUMNS},
+        )
+        for start in range(0, len(rows), UPSERT_CHUNK_ROWS):
+            session.execute(statement, rows[start:start + UPSERT_CHUNK_ROWS])
+        return
+    existing = set()
+    device_ids = sorted({row["device_id"] for row in rows})
+    for start in range(0, len(device_ids), UPSERT_CHUNK_ROWS):
+        existing.update(session.execute(
+            select(table.c.device_id, table.c.param_key).where(table.c.device_id.in_(device_ids[start:start + UPSERT_CHUNK_ROWS]))
+        ).all())
+    new_rows = [row for row in rows if (row["device_id"], row["param_key"]) not in existing]
+    if new_rows:
+        session.execute(table.insert(), new_rows)
+    changed = [
+        {"b_device_id": row["device_id"], "b_param_key": row["param_key"], **{f"b_{column}": row[column] for column in VALUE_COLUMNS}}
+        for row in rows
+        if (row["device_id"], row["param_key"]) in existing
+    ]
+    if changed:
+        session.execute(
+            update(table)
+            .where(table.c.device_id == bindparam("b_device_id"), table.c.param_key == bindparam("b_param_key"))
+            .values({column: bindparam(f"b_{column}") for column in VALUE_COLUMNS}),
+            changed,
+        )
+
+
+def upsert_device_parameters(session, items):
+    """Write parameter values of many devices with set-based statements.
+
+    ``items`` is a list of ``(device_id, device_type_id, parameters)``. The
+    definitions of all involved device types are resolved in one query,
+    missing custom display parameters are created in one insert, and all
+    values are written with ``INSERT ... ON CONFLICT (device_id, param_key)
+    DO UPDATE`` (see ``_write_values``). Keys that are neither declared nor
+    custom are ignored, as before. Promoted columns (devices.ip_address) are
+    updated in the same transaction.
+
+    Devices that have no type, whose type declares no parameters, or with a
+    value that cannot be converted are left untouched and reported in
+    ``skipped`` ({device_id: message}); the others are written. Returns
+    counts of written values and created definitions plus ``skipped``.
+    """
+    skipped = {}
+    for device_id, device_type_id, _ in items:
+        if not device_type_id:
+            skipped[device_id] = f"设备 {device_id} 没有关联设备类型，无法更新参数值"
+    type_ids = {device_type_id for _, device_type_id, _ in items if device_type_id}
+
+    def load_definitions():
+        if not type_ids:
+            return {}
+        rows = session.query(
+            DeviceTypeParameter.id, DeviceTypeParameter.device_type_id,
+            DeviceTypeParameter.param_key, DeviceTypeParameter.param_type,
+        ).filter(DeviceTypeParameter.device_type_id.in_(type_ids))
+        return {(row.device_type_id, row.param_key): row for row in rows}
+
+    definitions = load_definitions()
+    declared_types = {device_type_id for device_type_id, _ in definitions}
+    for device_id, device_type_id, _ in items:
+        if device_id not in skipped and device_type_id not in declared_types:
+            skipped[device_id] = f"设备 {device_id} 的设备类型没有定义参数"
+    items = [item for item in items if item[0] not in skipped]
+
+    missing = {
+        (device_type_id, key)
+        for _, device_type_id, parameters in items
+        for key in parameters
+        if key in CUSTOM_PARAMETERS and (device_type_id, key) not in definitions
+    }
+    if missing:
+        now = datetime.utcnow()
+        table = DeviceTypeParameter.__table__
+        definition_rows = [
+            {
+                "device_type_id": device_type_id,
+                "param_key": key,
+                "param_name": CUSTOM_PARAMETERS[key][0],
+                "param_type": CUSTOM_PARAMETERS[key][1],
+                "required": False,
+                "sort_order": 999,  # 放在最后
+                "created_at": now,
+                "updated_at": now,
+            }
+            for device_type_id, key in sorted(missing)
+        ]
+        insert = DIALECT_INSERTS.get(session.get_bind().dialect.name)
+        if insert is not None:
+            session.execute(insert(table).on_conflict_do_nothing(index_elements=["device_type_id", "param_key"]), definition_rows)
+        else:
+            session.execute(table.insert(), definition_rows)
+        definitions = load_definitions()
+
+    now = datetime.utcnow()
+    rows = []
+    promoted = set()
+    for device_id, device_type_id, parameters in items:
+        device_rows = []
+        for key, value in parameters.items():
+            definition = definitions.get((device_type_id, key))
+            if definition is None:
+                continue
+            try:
+                stored = coerce_parameter_value(definition.param_type, value)
+            except Exception as e:
+                skipped[device_id] = f"参数 {key} 值转换失败: {e}"
+                break
+            device_rows.append({
+                "device_id": device_id,
+                "parameter_id": definition.id,
+                "param_key": key,
+                **stored,
+                "updated_at": now,
+            })
+        else:
+            rows.extend(device_rows)
+            promoted.update((row["param_key"], device_id) for row in device_rows if row["param_key"] in PROMOTED_PARAMETERS)
+
+    if rows:
+        _write_values(session, rows)
+    # Copy promoted parameters to their device column with one statement per key
+    for key, column in PROMOTED_PARAMETERS.items():
+        device_ids = [device_id for promoted_key, device_id in promoted if promoted_key == key]
+        if not device_ids:
+            continue
+        value = (
+            select(DeviceParameterValue.param_value)
+            .where(DeviceParameterValue.device_id == Device.id, DeviceParameterValue.param_key == key)
+            .scalar_subquery()
+        )
+        session.execute(update(Device.__table__).where(Device.__table__.c.id.in_(device_ids)).values({column: value}))
+
+    return {"values_written": len(rows), "definitions_created": len(missing), "skipped": skipped}
@@ -0,0 +1,113 @@
+import threading
+
+from sqlalchemy import case, func, literal, or_, text
+
+from database import Device
+
+# ip_address is the promoted column kept in sync with the ip_address parameter
+SEARCH_COLUMNS = (Device.name, Device.code, Device.serial_number, Device.ip_address)
+
+# GIN trigram indexes serve ILIKE '%x%' / 'x%' as well as similarity ranking. Kept as
+# plain DDL rather than Index objects so create_all never needs the extension.
+TRIGRAM_INDEX_SQL = [
+    "CREATE INDEX IF NOT EXISTS ix_devices_name_trgm ON devices USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_devices_code_trgm ON devices USING gin (code gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_devices_serial_number_trgm ON devices USING gin (serial_number gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_devices_ip_address_trgm ON devices USING gin (ip_address gin_trgm_ops)",
+    # Search used to scan the ip_address parameter values
+    "DROP INDEX IF EXISTS ix_device_parameter_values_search_trgm",
+]
+
+_trigram_lock = threading.Lock()
+_trigram_available = {}
+
+
+def ensure_device_search_indexes(bind):
+    """Create pg_trgm and the trigram indexes on PostgreSQL.
+
+    Returns False when the extension cannot be installed (missing contrib
+    package or privileges); search then works without indexes and ranks by
+    match position instead of similarity.
+    """
+    if bind.dialect.name != "postgresql":
+        return False
+    with bind.connect() as conn:
+        try:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"⚠ pg_trgm 扩展不可用，设备搜索不使用三元组索引: {e}")
+            return False
+        for statement in TRIGRAM_INDEX_SQL:
+            conn.execute(text(statement))
+        conn.commit()
+    return True
+
+
+def trigram_available(session):
+    """Whether pg_trgm is installed in the connected database (cached per URL)."""
+    bind = session.get_bind()
+    if bind.dialect.name != "postgresql":
+        return False
+    key = str(bind.url)
+    with _trigram_lock:
+        if key not in _trigram_available:
+            _trigram_available[key] = bool(session.execute(
+                text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            ).scalar())
+        return _trigram_available[key]
+
+
+def _escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_filter(term):
+    """Filter matching ``term`` in name, code, serial number or IP address."""
+    pattern = f"%{_escape_like(term.strip())}%"
+    return or_(*[column.ilike(pattern, escape="\\") for column in SEARCH_COLUMNS])
+
+
+def _rank(session, term):
+    """Higher is better: exact code/name match, then prefix match, then similarity or position."""
+    lowered = term.lower()
+    escaped = _escape_like(lowered)
+    name, code = func.lower(Device.name), func.lower(Device.code)
+    exact = case((or_(code == lowered, name == lowered), 2.0), else_=0.0)
+    prefix = case((or_(code.like(f"{escaped}%", escape="\\"), name.like(f"{escaped}%", escape="\\")), 1.0), else_=0.0)
+    if trigram_available(session):
+        closeness = func.greatest(*[func.coalesce(func.similarity(column, term), 0.0) for column in SEARCH_COLUMNS])
+    else:
+        # Earlier occurrence ranks higher; the position is 0 when there is no match
+        postgresql = session.get_bind().dialect.name == "postgresql"
+        locate, smallest = (func.strpos, func.least) if postgresql else (func.instr, func.min)
+        position = smallest(*[
+            func.coalesce(func.nullif(locate(func.lower(column), lowered), 0), 1000) for column in (Device.name, Device.code)
+        ])
+        closeness = literal(1.0) / position
+    return (exact + prefix + closeness).label("rank")
+
+
+def search_devices(session, term, limit=20, application_id=None, status=None):
+    """Ranked device search; returns (device, rank) pairs, best match first."""
+    term = term.strip()
+    query = session.query(Device, _rank(session, term)).filter(search_filter(term))
+    if application_id is not None:
+        query = query.filter(Device.application_id == application_id)
+    if status:
+        query = query.filter(Device.status == status)
+    return query.order_by(text("rank DESC"), Device.code.asc()).limit(limit).all()
+
+
+def autocomplete(session, prefix, limit=10, application_id=None):
+    """Devices whose name or code starts with ``prefix`` (shortest codes first)."""
+    escaped = _escape_like(prefix.strip())
+    pattern = f"{escaped}%"
+    query = session.query(Device.id, Device.name, Device.code).filter(
+        or_(Device.code.ilike(pattern, escape="\\"), Device.name.ilike(pattern, escape="\\"))
+    )
+    if application_id is not None:
+        query = query.filter(Device.application_id == application_id)
+    rows = query.order_by(func.length(Device.code), Device.code).limit(limit).all()
+    return [{"id": row.id, "name": row.name, "code": row.code} for row in rows]
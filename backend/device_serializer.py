@@ -0,0 +1,110 @@
+from datetime import datetime
+
+from sqlalchemy.orm import selectinload
+
+from database import Device, DeviceParameterValue, DeviceType
+
+# Fields read straight from device columns
+COLUMN_FIELDS = {
+    column.key: column
+    for column in (
+        Device.id, Device.name, Device.code, Device.device_type_id, Device.application_id, Device.station_id,
+        Device.position_x, Device.position_y, Device.serial_number, Device.ip_address, Device.longitude, Device.latitude,
+        Device.status, Device.health_status, Device.description, Device.last_heartbeat,
+        Device.created_at, Device.updated_at,
+    )
+}
+# Fields taken from parameter values, as in Device.to_dict (ip_address is a promoted column)
+PARAMETER_FIELDS = ("port",)
+# Device type code, resolved from the device_types side dictionary
+TYPE_FIELD = "type"
+LEAN_FIELDS = tuple(COLUMN_FIELDS) + PARAMETER_FIELDS + (TYPE_FIELD,)
+
+
+def parse_fields(raw):
+    """Comma-separated field list -> tuple in request order; all lean fields when empty."""
+    if not raw or not raw.strip():
+        return LEAN_FIELDS
+    fields = tuple(dict.fromkeys(field.strip() for field in raw.split(",") if field.strip()))
+    unknown = [field for field in fields if field not in LEAN_FIELDS]
+    if unknown:
+        raise ValueError(f"不支持的字段: {', '.join(unknown)}，可选字段: {', '.join(LEAN_FIELDS)}")
+    return fields
+
+
+def projected_query(query, fields, keyset=True):
+    """Replace the Device entity of ``query`` with the columns needed for ``fields``.
+
+    id is always selected (parameter lookup and cursors), created_at too when
+    the page is cut by a (created_at, id) cursor, device_type_id when the type
+    code is requested.
+    """
+    keys = ["id"]
+    if keyset:
+        keys.append("created_at")
+    if TYPE_FIELD in fields:
+        keys.append("device_type_id")
+    keys += [field for field in fields if field in COLUMN_FIELDS]
+    columns = [COLUMN_FIELDS[key] for key in dict.fromkeys(keys)]
+    return query.with_entities(*columns)
+
+
+def _port_value(port):
+    try:
+        return int(port)
+    except (ValueError, TypeError):
+        return port
+
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def serialize_rows(session, rows, fields):
+    """Serialize projected rows to (devices, device_types).
+
+    Only plain tuples are touched: one extra query fetches the requested
+    parameter values of the page, another the referenced device types, which
+    are returned once in a dictionary keyed by id instead of per device.
+    """
+    if not rows:
+        return [], {}
+    keys = rows[0]._fields
+    records = [dict(zip(keys, row)) for row in rows]
+
+    parameter_fields = [field for field in fields if field in PARAMETER_FIELDS]
+    parameters = {}
+    if parameter_fields:
+        values = session.query(
+            DeviceParameterValue.device_id, DeviceParameterValue.param_key, DeviceParameterValue.param_value
+        ).filter(
+            DeviceParameterValue.device_id.in_([record["id"] for record in records]),
+            DeviceParameterValue.param_key.in_(parameter_fields),
+        )
+        for device_id, key, value in values:
+            parameters[(device_id, key)] = _port_value(value) if key == "port" and value else value
+
+    device_types = {}
+    if TYPE_FIELD in fields or "device_type_id" in fields:
+        type_ids = {record["device_type_id"] for record in records if record.get("device_type_id") is not None}
+        if type_ids:
+            types = (
+                session.query(DeviceType)
+                .options(selectinload(DeviceType.parameters))
+                .filter(DeviceType.id.in_(type_ids))
+            )
+            device_types = {str(device_type.id): device_type.to_dict() for device_type in types}
+
+    devices = []
+    for record in records:
+        device = {}
+        for field in fields:
+            if field in COLUMN_FIELDS:
+                device[field] = _json_value(record[field])
+            elif field == TYPE_FIELD:
+                device_type = device_types.get(str(record["device_type_id"]))
+                device[field] = device_type["code"] if device_type else None
+            else:
+                device[field] = parameters.get((record["id"], field))
+        devices.append(device)
+    return devices, device_types
@@ -0,0 +1,114 @@
+import threading
+import time
+
+from sqlalchemy import and_
+from sqlalchemy.orm import aliased
+
+from database import Device, DeviceParameterValue, DeviceTopology, DeviceType, Station
+from stations import station_of
+
+
+def build_fms_snapshot(session, application_id):
+    """Station-grouped devices and the connections between them for one application.
+
+    Three column-projected queries: devices with their type and station
+    codes, their parameter values, and the topology rows whose source and
+    target devices both belong to the application (joined in SQL instead of
+    filtering the whole topology table in Python).
+    """
+    rows = (
+        session.query(
+            Device.id, Device.code, Device.name, Device.status, Device.description,
+            Device.position_x, Device.position_y, DeviceType.code.label("type_code"),
+            Station.code.label("station_code"),
+        )
+        .outerjoin(DeviceType, DeviceType.id == Device.device_type_id)
+        .outerjoin(Station, Station.id == Device.station_id)
+        .filter(Device.application_id == application_id)
+        .order_by(Device.id)
+        .all()
+    )
+    details = {row.id: {} for row in rows}
+    values = (
+        session.query(DeviceParameterValue.device_id, DeviceParameterValue.param_key, DeviceParameterValue.param_value)
+        .join(Device, Device.id == DeviceParameterValue.device_id)
+        .filter(Device.application_id == application_id)
+        .order_by(DeviceParameterValue.device_id, DeviceParameterValue.id)
+    )
+    for device_id, key, value in values:
+        # 将 ip_address 映射回 ip（前端使用）
+        details[device_id]["ip" if key == "ip_address" else key] = value
+
+    devices_by_station = {}
+    for row in rows:
+        # Devices not assigned yet (before migrate_device_stations.py) fall back to the legacy parsing
+        station = row.station_code or station_of(row.description, row.code)
+        devices_by_station.setdefault(station, []).append({
+            "id": row.code,
+            "name": row.name,
+            "type": row.type_code or "unknown",
+            "station": station,
+            "status": row.status or "online",
+            "position": {"x": row.position_x or 0, "y": row.position_y or 0},
+            "details": details[row.id],
+        })
+
+    source, target = aliased(Device), aliased(Device)
+    topologies = (
+        session.query(
+            DeviceTopology.source_device_code, DeviceTopology.target_device_code,
+            DeviceTopology.connection_type, DeviceTopology.description,
+        )
+        .join(source, and_(source.code == DeviceTopology.source_device_code, source.application_id == application_id))
+        .join(target, and_(target.code == DeviceTopology.target_device_code, target.application_id == application_id))
+        .order_by(DeviceTopology.id)
+    )
+    connections = [
+        {"source": source_code, "target": target_code, "type": connection_type, "description": description}
+        for source_code, target_code, connection_type, description in topologies
+    ]
+    return {"devices": devices_by_station, "connections": connections}
+
+
+class SnapshotCache:
+    """In-process cache of built snapshots keyed by application id.
+
+    Writes in this process call ``invalidate``; ``ttl`` seconds bound the
+    staleness caused by writes from other processes (scripts, other
+    workers). A build that started before an invalidation is not stored.
+    """
+
+    def __init__(self, builder, ttl):
+        self.builder = builder
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._entries = {}
+        self._generation = 0
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                return entry[1], self._generation
+            return None, self._generation
+
+    def get(self, session, key):
+        value, _ = self._cached(key)
+        if value is not None:
+            return value
+        # One build at a time; concurrent callers wait and reuse its result
+        with self._build_lock:
+            value, generation = self._cached(key)
+            if value is not None:
+                return value
+            value = self.builder(session, key)
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[key] = (time.monotonic(), value)
+            return value
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
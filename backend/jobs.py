@@ -0,0 +1,113 @@
+import uuid
+import threading
+import traceback
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+
+class Job:
+    """A unit of background work with progress that can be polled or pushed."""
+
+    def __init__(self, manager, kind: str):
+        self.manager = manager
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "pending"
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now(timezone.utc)
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ("succeeded", "failed")
+
+    def report(self, **progress):
+        """Merge progress fields and publish the job state."""
+        with self.manager.lock:
+            self.progress.update(progress)
+        self.manager.publish(self)
+
+    def to_dict(self):
+        with self.manager.lock:
+            return {
+                "id": self.id,
+                "kind": self.kind,
+                "status": self.status,
+                "progress": dict(self.progress),
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at.isoformat(),
+                "started_at": self.started_at.isoformat() if self.started_at else None,
+                "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            }
+
+
+class JobManager:
+    """Runs jobs on daemon threads and keeps the most recent ``max_jobs`` for polling.
+
+    ``on_update`` receives the job dict on every state or progress change (used to
+    push progress over SocketIO). At most one job per kind runs at a time;
+    submitting another while one is active returns the active job.
+    """
+
+    def __init__(self, on_update=None, max_jobs: int = 100):
+        self.on_update = on_update
+        self.max_jobs = max_jobs
+        self.lock = threading.RLock()
+        self.jobs = OrderedDict()
+
+    def submit(self, kind: str, target, *args, **kwargs):
+        with self.lock:
+            active = self.active(kind)
+            if active:
+                return active
+            job = Job(self, kind)
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                oldest_id = next(iter(self.jobs))
+                if not self.jobs[oldest_id].finished:
+                    break
+                self.jobs.pop(oldest_id)
+        threading.Thread(target=self._run, args=(job, target, args, kwargs), name=f"job-{kind}", daemon=True).start()
+        return job
+
+    def _run(self, job, target, args, kwargs):
+        with self.lock:
+            job.status = "running"
+            job.started_at = datetime.now(timezone.utc)
+        self.publish(job)
+        try:
+            result = target(job, *args, **kwargs)
+            with self.lock:
+                job.result = result
+                job.status = "succeeded"
+        except Exception as e:
+            print(f"后台任务 {job.kind} 失败: {traceback.format_exc()}")
+            with self.lock:
+                job.error = str(e)
+                job.status = "failed"
+        finally:
+            with self.lock:
+                job.finished_at = datetime.now(timezone.utc)
+            self.publish(job)
+
+    def publish(self, job):
+        if self.on_update:
+            try:
+                self.on_update(job.to_dict())
+            except Exception as e:
+                print(f"推送任务进度失败: {e}")
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def active(self, kind: str):
+        with self.lock:
+            for job in reversed(self.jobs.values()):
+                if job.kind == kind and not job.finished:
+                    return job
+        return None
@@ -0,0 +1,199 @@
+import time
+import threading
+from collections import deque
+
+from sqlalchemy import func, select
+
+from analytics import cycle_time_statistics
+from database import (
+    SessionLocal,
+    Application,
+    Device,
+    LaptopLabelType,
+    ProductionOrder,
+    ProductionProduct,
+)
+
+# Completion stage -> (event key, table whose row the event completes)
+COMPLETION_ROWS = {
+    "product_completed": ("product_id", ProductionProduct),
+    "order_completed": ("order_id", ProductionOrder),
+}
+
+
+class KpiRollup:
+    """Home overview counters maintained incrementally instead of recounted per request.
+
+    The production counters (completed orders/products, cycle-time sum) are seeded
+    once from the database and then adjusted by simulator completion events, so a
+    read is O(1). Bulk changes (order resets, persisted virtual runs) call
+    ``invalidate`` and the next read reseeds. Rarely changing counts (devices,
+    label types) are cached for ``static_ttl`` seconds and dropped by
+    ``invalidate_static`` when those tables are written.
+
+    Completion events that arrive while the counters are not loaded (before
+    and during a seed) are buffered, up to ``max_buffered``. Once the seed
+    queries have run, the buffered events whose product/order was not yet
+    completed in the seed's snapshot are applied, so completions racing the
+    seed, or still unflushed by a batch-mode state writer, are neither lost
+    nor counted twice.
+    """
+
+    def __init__(self, session_factory=SessionLocal, static_ttl: float = 60.0, max_buffered: int = 10000):
+        self.session_factory = session_factory
+        self.static_ttl = static_ttl
+        self.lock = threading.Lock()
+        # Only one seed at a time: it owns the buffered events
+        self.seed_lock = threading.Lock()
+        self.loaded = False
+        # Completion events seen while not loaded; the oldest are long committed and safe to drop
+        self.buffered = deque(maxlen=max(1, max_buffered))
+        self.generation = 0
+        self.completed_orders = 0
+        self.completed_products = 0
+        self.cycle_time_sum = 0.0
+        self.cycle_time_count = 0
+        self.static = None
+        self.static_loaded_at = 0.0
+
+    # ----------------- incremental updates -----------------
+    def apply_event(self, event):
+        """Adjust counters from a simulator event; other stages are ignored."""
+        stage = event.get("stage")
+        if stage not in COMPLETION_ROWS:
+            return
+        with self.lock:
+            if not self.loaded:
+                # Reconciled against the seed snapshot by the next read
+                self.buffered.append(event)
+                return
+        if stage == "product_completed":
+            self.record_product_completed(event.get("cycle_time"))
+        elif stage == "order_completed":
+            self.record_order_completed()
+
+    def record_product_completed(self, cycle_time=None):
+        with self.lock:
+            if not self.loaded:
+                return
+            self.completed_products += 1
+            if cycle_time and cycle_time > 0:
+                self.cycle_time_sum += cycle_time
+                self.cycle_time_count += 1
+
+    def record_order_completed(self):
+        with self.lock:
+            if self.loaded:
+                self.completed_orders += 1
+
+    def invalidate(self):
+        with self.lock:
+            # Events before this point are reflected in the tables the next seed reads
+            self.loaded = False
+            self.generation += 1
+            self.buffered.clear()
+
+    def invalidate_static(self):
+        with self.lock:
+            self.static = None
+
+    # ----------------- reads -----------------
+    def _seed(self, session):
+        with self.lock:
+            generation = self.generation
+        if session.get_bind().dialect.name == "postgresql":
+            # The counts and the checks of buffered events below all read one snapshot
+            session.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        completed_orders = session.query(func.count(ProductionOrder.id)).filter(ProductionOrder.status == "completed").scalar() or 0
+        completed_products = session.query(func.count(ProductionProduct.id)).filter(ProductionProduct.status == "completed").scalar() or 0
+        cycle_time = cycle_time_statistics(session, percentiles=False)["overall"]
+        cycle_time_sum, cycle_time_count = cycle_time["total_seconds"], cycle_time["count"]
+        while True:
+            with self.lock:
+                # An invalidate() that raced with the seed wins; the next read seeds again
+                if generation != self.generation:
+                    return
+                if not self.buffered:
+                    self.completed_orders = completed_orders
+                    self.completed_products = completed_products
+                    self.cycle_time_sum = cycle_time_sum
+                    self.cycle_time_count = cycle_time_count
+                    self.loaded = True
+                    return
+                events = list(self.buffered)
+                self.buffered.clear()
+            for event in self._unseen(session, events):
+                if event["stage"] == "order_completed":
+                    completed_orders += 1
+                    continue
+                completed_products += 1
+                cycle_time = event.get("cycle_time")
+                if cycle_time and cycle_time > 0:
+                    cycle_time_sum += cycle_time
+                    cycle_time_count += 1
+
+    @staticmethod
+    def _unseen(session, events):
+        """Completion events whose product/order was not completed yet in the seed snapshot."""
+        seen = {}
+        for stage, (key, model) in COMPLETION_ROWS.items():
+            ids = {event.get(key) for event in events if event["stage"] == stage} - {None}
+            seen[stage] = set(session.scalars(
+                select(model.id).where(model.id.in_(ids), model.status == "completed")
+            )) if ids else set()
+        return [event for event in events if event.get(COMPLETION_ROWS[event["stage"]][0]) not in seen[event["stage"]]]
+
+    def _load_static(self, session):
+        application = (
+            session.query(Application.id)
+            .filter(
+                (Application.english_name == 'LenovoFMS') |
+                (Application.name == 'LenovoFMS') |
+                (Application.name.like('%LenovoFMS%'))
+            )
+            .order_by(Application.id.asc())
+            .first()
+        )
+        device_count = 0
+        label_type_query = session.query(func.count(LaptopLabelType.id))
+        if application:
+            device_count = session.query(func.count(Device.id)).filter(Device.application_id == application.id).scalar()
+            label_type_query = label_type_query.filter(
+                (LaptopLabelType.application_id == application.id) |
+                (LaptopLabelType.application_id.is_(None))
+            )
+        static = {
+            "application_id": application.id if application else None,
+            "device_count": device_count or 0,
+            "label_type_count": label_type_query.scalar() or 0,
+        }
+        with self.lock:
+            self.static = static
+            self.static_loaded_at = time.monotonic()
+
+    def snapshot(self):
+        with self.lock:
+            needs_seed = not self.loaded
+            needs_static = self.static is None or time.monotonic() - self.static_loaded_at > self.static_ttl
+        if needs_seed or needs_static:
+            session = self.session_factory()
+            try:
+                if needs_seed:
+                    with self.seed_lock:
+                        with self.lock:
+                            needs_seed = not self.loaded
+                        if needs_seed:
+                            self._seed(session)
+                if needs_static:
+                    self._load_static(session)
+            finally:
+                session.close()
+        with self.lock:
+            return {
+                "completed_orders": self.completed_orders,
+                "completed_products": self.completed_products,
+                "avg_cycle_time": round(self.cycle_time_sum / self.cycle_time_count, 1) if self.cycle_time_count else None,
+                "cycle_time_sum": self.cycle_time_sum,
+                "cycle_time_count": self.cycle_time_count,
+                **(self.static or {}),
+            }
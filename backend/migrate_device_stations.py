@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""创建工位表并为已有设备回填 devices.station_id
+
+工位按设备描述（工位:xxx / 工位：xxx）或设备编码（type-station-number，如 camera-read-1）识别，
+每个应用内按工位名称创建一条工位记录。只处理尚未关联工位的设备，可重复执行。
+
+用法：
+    python migrate_device_stations.py
+"""
+from sqlalchemy import update
+
+from database import SessionLocal, Device
+from device_parameters import ensure_device_schema
+from stations import resolve_station_ids, station_of
+
+BATCH_SIZE = 5000
+
+
+def migrate_device_stations():
+    """执行迁移"""
+    db = SessionLocal()
+    try:
+        print("=" * 60)
+        print("开始回填设备工位")
+        print("=" * 60)
+
+        # 创建 stations 表、devices.station_id 列及索引
+        ensure_device_schema(db.get_bind())
+        print("✓ 已确认 stations 表、devices.station_id 列及索引")
+
+        devices = (
+            db.query(Device.id, Device.application_id, Device.description, Device.code)
+            .filter(Device.station_id.is_(None), Device.application_id.isnot(None))
+            .order_by(Device.id)
+            .all()
+        )
+        assignments = {}
+        for device_id, application_id, description, code in devices:
+            station = station_of(description, code)
+            if station != "unknown":
+                assignments[device_id] = (application_id, station)
+        station_ids = resolve_station_ids(db, assignments.values())
+        print(f"✓ 识别到 {len(station_ids)} 个工位")
+
+        rows = [{"id": device_id, "station_id": station_ids[pair]} for device_id, pair in assignments.items()]
+        for start in range(0, len(rows), BATCH_SIZE):
+            db.execute(update(Device), rows[start:start + BATCH_SIZE])
+
+        db.commit()
+        print(f"\n✓ 回填完成: {len(rows)} 台设备已关联工位，{len(devices) - len(rows)} 台设备未能识别工位")
+        print("=" * 60)
+
+    except Exception as e:
+        db.rollback()
+        print(f"\n发生错误: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    migrate_device_stations()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""为设备参数值补充类型化列（value_number / value_bool / value_date）及 devices.ip_address
+
+新写入的参数值由设备接口同步写入类型化列；本脚本用于回填已有数据，可重复执行。
+
+用法：
+    python migrate_typed_device_parameters.py
+"""
+from sqlalchemy import update
+
+from database import SessionLocal, DeviceParameterValue, DeviceTypeParameter
+from device_parameters import TYPED_COLUMNS, coerce_parameter_value, ensure_device_schema
+
+BATCH_SIZE = 5000
+
+
+def migrate_typed_device_parameters():
+    """执行迁移"""
+    db = SessionLocal()
+    try:
+        print("=" * 60)
+        print("开始回填设备参数类型化列")
+        print("=" * 60)
+
+        # 新增列与索引，并同步 devices.ip_address
+        ensure_device_schema(db.get_bind())
+        print("✓ 已确认类型化列、索引及 devices.ip_address")
+
+        rows = (
+            db.query(DeviceParameterValue.id, DeviceParameterValue.param_value, DeviceTypeParameter.param_type)
+            .join(DeviceTypeParameter, DeviceTypeParameter.id == DeviceParameterValue.parameter_id)
+            .filter(
+                DeviceTypeParameter.param_type.in_(tuple(TYPED_COLUMNS)),
+                DeviceParameterValue.param_value.isnot(None),
+            )
+            .order_by(DeviceParameterValue.id)
+        )
+
+        batch = []
+        updated_count = 0
+        unparsed_count = 0
+        for value_id, param_value, param_type in rows.yield_per(BATCH_SIZE):
+            typed = coerce_parameter_value(param_type, param_value)
+            typed.pop("param_value")
+            if typed[TYPED_COLUMNS[param_type]] is None:
+                unparsed_count += 1
+            batch.append({"id": value_id, **typed})
+            if len(batch) >= BATCH_SIZE:
+                db.execute(update(DeviceParameterValue), batch)
+                updated_count += len(batch)
+                batch = []
+        if batch:
+            db.execute(update(DeviceParameterValue), batch)
+            updated_count += len(batch)
+
+        db.commit()
+        print(f"\n✓ 回填完成: 更新 {updated_count} 条参数值，其中 {unparsed_count} 条无法按声明类型解析（保留字符串值）")
+        print("=" * 60)
+
+    except Exception as e:
+        db.rollback()
+        print(f"\n发生错误: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    migrate_typed_device_parameters()
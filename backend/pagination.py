@@ -0,0 +1,72 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import func, text, tuple_
+
+COUNT_MODES = ("exact", "estimated", "none")
+
+
+def encode_cursor(created_at, row_id):
+    """Opaque cursor for the (created_at, id) position of the last row of a page."""
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+
+
+def keyset_order(created_at_column, id_column):
+    """Newest first. created_at is NOT NULL, so a (created_at, id) index is
+    walked backwards for this order without a sort."""
+    return created_at_column.desc(), id_column.desc()
+
+
+def keyset_after(created_at_column, id_column, cursor):
+    """Rows that come after ``cursor`` in ``keyset_order``, as a single row
+    comparison the planner turns into an index range bound."""
+    created_at, row_id = decode_cursor(cursor)
+    return tuple_(created_at_column, id_column) < (created_at, row_id)
+
+
+def keyset_page(query, created_at_column, id_column, page_size, cursor=None):
+    """Fetch one page with ``LIMIT page_size + 1`` and return (rows, next_cursor).
+
+    ``next_cursor`` is None on the last page.
+    """
+    if cursor:
+        query = query.filter(keyset_after(created_at_column, id_column, cursor))
+    rows = query.order_by(*keyset_order(created_at_column, id_column)).limit(page_size + 1).all()
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, created_at_column.key), getattr(last, id_column.key))
+
+
+def count_rows(session, query, id_column, filtered, mode="exact"):
+    """Total for a listing according to ``mode``.
+
+    ``exact`` runs COUNT over the filtered ids only. ``estimated`` reads
+    ``pg_class.reltuples`` for an unfiltered listing on PostgreSQL, which costs
+    nothing regardless of table size; filtered listings, other databases and
+    tables that have never been analyzed fall back to an exact count. ``none``
+    skips counting. Returns (total, is_estimate).
+    """
+    if mode == "none":
+        return None, False
+    if mode == "estimated" and not filtered and session.get_bind().dialect.name == "postgresql":
+        estimate = session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+            {"table": id_column.table.name},
+        ).scalar()
+        # reltuples is -1 (or 0 on old servers) until the first VACUUM/ANALYZE
+        if estimate is not None and estimate > 0:
+            return estimate, True
+    return query.order_by(None).with_entities(func.count(id_column)).scalar(), False
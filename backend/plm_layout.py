@@ -0,0 +1,153 @@
+import json
+from datetime import datetime
+
+from sqlalchemy import and_, delete, func, inspect, select, text, update
+
+from database import TK_Positions
+from device_parameters import dialect_insert
+
+# Client field -> tk_positions column
+NODE_FIELDS = {
+    "id": "item_id", "baseLabel": "base_label", "label": "label", "x": "x", "y": "y",
+    "color": "color", "type": "item_type_code", "fixed": "fixed",
+}
+LINE_FIELDS = {"id": "item_id", "startX": "start_x", "startY": "start_y", "endX": "end_x", "endY": "end_y"}
+# The metadata row stores the counters and the layout version
+METADATA_TYPE, METADATA_ID = "metadata", "counters"
+
+
+class LayoutVersionConflict(Exception):
+    """The layout was saved by someone else since ``base_version`` was loaded."""
+
+    def __init__(self, current_version):
+        super().__init__(f"布局版本已变更，当前版本为 {current_version}")
+        self.current_version = current_version
+
+
+def ensure_layout_schema(bind):
+    """Create tk_positions, add the version column and the unique (item_type, item_id) index.
+
+    Duplicate items left by older code are collapsed to their newest row
+    before the unique index is built.
+    """
+    table = TK_Positions.__table__
+    table.create(bind, checkfirst=True)
+    columns = {column["name"] for column in inspect(bind).get_columns(table.name)}
+    indexes = {index["name"] for index in inspect(bind).get_indexes(table.name)}
+    with bind.begin() as conn:
+        if "version" not in columns:
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN version INTEGER DEFAULT 0"))
+        if "uq_tk_positions_item" not in indexes:
+            conn.execute(text(
+                f"DELETE FROM {table.name} WHERE id NOT IN "
+                f"(SELECT MAX(id) FROM {table.name} GROUP BY item_type, item_id)"
+            ))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def _metadata_filter(table):
+    return and_(table.c.item_type == METADATA_TYPE, table.c.item_id == METADATA_ID)
+
+
+def layout_version(session):
+    table = TK_Positions.__table__
+    return session.execute(select(table.c.version).where(_metadata_filter(table))).scalar() or 0
+
+
+def _rows(items, fields, item_type, errors, now):
+    rows = {}
+    for index, item in enumerate(items or []):
+        if not isinstance(item, dict) or not item.get("id"):
+            errors.append(f"{item_type}[{index}] 缺少 id")
+            continue
+        row = {column: item.get(key) for key, column in fields.items()}
+        row["item_id"] = str(row["item_id"])
+        if item_type == "node":
+            row["fixed"] = bool(row["fixed"])
+        rows[row["item_id"]] = dict(row, item_type=item_type, created_at=now, updated_at=now)
+    return list(rows.values())
+
+
+def save_layout(session, payload):
+    """Apply a PLM layout save and return the new version.
+
+    With ``base_version`` the payload is a diff: ``nodes`` / ``lines`` hold
+    added or changed items, ``removed_nodes`` / ``removed_lines`` the ids to
+    delete. The version on the metadata row is bumped with a conditional
+    UPDATE, so a save based on an outdated version raises
+    LayoutVersionConflict and writes nothing. Without ``base_version`` (old
+    clients) the payload is the full layout: items missing from it are
+    deleted and the version is bumped unconditionally.
+
+    Items are written with one ``INSERT ... ON CONFLICT (item_type, item_id)
+    DO UPDATE`` per item type and removed with one DELETE per type. The
+    caller commits.
+    """
+    table = TK_Positions.__table__
+    now = datetime.utcnow()
+    errors = []
+    nodes = _rows(payload.get("nodes"), NODE_FIELDS, "node", errors, now)
+    lines = _rows(payload.get("lines"), LINE_FIELDS, "line", errors, now)
+    if errors:
+        raise ValueError("；".join(errors))
+    diff = payload.get("base_version") is not None
+    if diff:
+        try:
+            base_version = int(payload["base_version"])
+        except (TypeError, ValueError):
+            raise ValueError("base_version 必须为整数")
+
+    metadata = {"updated_at": now}
+    if "deviceCounters" in payload:
+        metadata["device_counters"] = json.dumps(payload["deviceCounters"]) if payload["deviceCounters"] else None
+    if "nodeIdCounter" in payload:
+        metadata["node_id_counter"] = payload["nodeIdCounter"] or 0
+    if "connectionLineIdCounter" in payload:
+        metadata["connection_line_id_counter"] = payload["connectionLineIdCounter"] or 0
+
+    # Bump the version first: concurrent saves serialize on the metadata row
+    current = func.coalesce(table.c.version, 0)
+    statement = update(table).where(_metadata_filter(table))
+    if diff:
+        statement = statement.where(current == base_version)
+    version = session.execute(statement.values(version=current + 1, **metadata).returning(table.c.version)).scalar()
+    if version is None:
+        exists = session.execute(select(table.c.id).where(_metadata_filter(table))).first()
+        if exists or (diff and base_version != 0):
+            raise LayoutVersionConflict(layout_version(session))
+        insert = dialect_insert(session)
+        version = session.execute(
+            insert(table)
+            .values(item_type=METADATA_TYPE, item_id=METADATA_ID, version=1, created_at=now, **metadata)
+            .on_conflict_do_nothing(index_elements=["item_type", "item_id"])
+            .returning(table.c.version)
+        ).scalar()
+        if version is None:
+            raise LayoutVersionConflict(layout_version(session))
+
+    removed = 0
+    for item_type, rows, removed_ids in (
+        ("node", nodes, payload.get("removed_nodes") or []),
+        ("line", lines, payload.get("removed_lines") or []),
+    ):
+        if diff:
+            if removed_ids:
+                removed += session.execute(
+                    delete(table).where(table.c.item_type == item_type, table.c.item_id.in_([str(i) for i in removed_ids]))
+                ).rowcount
+        else:
+            removed += session.execute(
+                delete(table).where(table.c.item_type == item_type, table.c.item_id.notin_([row["item_id"] for row in rows]))
+            ).rowcount
+        if rows:
+            insert = dialect_insert(session)
+            statement = insert(table)
+            columns = [column for column in rows[0] if column not in ("item_type", "item_id", "created_at")]
+            statement = statement.on_conflict_do_update(
+                index_elements=["item_type", "item_id"],
+                set_={column: statement.excluded[column] for column in columns},
+            )
+            session.execute(statement, rows)
+
+    return {"version": version, "saved_nodes": len(nodes), "saved_lines": len(lines), "removed": removed}
@@ -2,12 +2,18 @@ import time
 import uuid
 import threading
 from dataclasses import dataclass
-from collections import deque
-from datetime import datetime, timezone
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
+from itertools import groupby, islice
+from operator import itemgetter
 
 import simpy
+from simpy.core import EmptySchedule, Environment, Infinity
+from simpy.events import Initialize
 from simpy.rt import RealtimeEnvironment
+from sqlalchemy import text, update
 
+from config import simulation_config
 from database import (
     SessionLocal,
     ProductionOrder,
@@ -33,6 +39,460 @@ class StationTimes:
     qc_time: float = 0.8
 
 
+# Physical station each StationTimes step runs at. A product occupies exactly one
+# station at a time, so the line pipelines: the scanner works on product N+1
+# while product N is being labeled.
+STATION_OF_STEP = {
+    "belt_to_scanner": "scanner",
+    "scan_time": "scanner",
+    "belt_to_stop": "labeling",
+    "jack_up": "labeling",
+    "mbi_query": "labeling",
+    "feeder_time": "labeling",
+    "robot_pick": "labeling",
+    "robot_to_loc_cam": "labeling",
+    "locating_time": "labeling",
+    "robot_to_device": "labeling",
+    "labeling_time": "labeling",
+    "jack_down": "labeling",
+    "belt_to_inspection": "qc",
+    "qc_time": "qc",
+}
+STATIONS = ("scanner", "labeling", "qc")
+
+
+class MonitoredStation(simpy.Resource):
+    """simpy.Resource that integrates busy servers and queue length over time."""
+
+    def __init__(self, env, name: str, capacity: int = 1):
+        super().__init__(env, capacity=max(1, capacity))
+        self.name = name
+        self.busy_time = 0.0
+        self.queue_time = 0.0
+        self.max_queue = 0
+        self.served = 0
+        self._started = env.now
+        self._last = env.now
+
+    def _accumulate(self):
+        now = self._env.now
+        self.busy_time += self.count * (now - self._last)
+        self.queue_time += len(self.queue) * (now - self._last)
+        self._last = now
+
+    def request(self):
+        self._accumulate()
+        request = super().request()
+        self.max_queue = max(self.max_queue, len(self.queue))
+        return request
+
+    def release(self, request):
+        self._accumulate()
+        self.served += 1
+        return super().release(request)
+
+    def stats(self):
+        # Read-only: may be called from another thread while the environment runs
+        now = self._env.now
+        elapsed = now - self._started
+        busy = self.busy_time + self.count * (now - self._last)
+        queued = self.queue_time + len(self.queue) * (now - self._last)
+        return {
+            "capacity": self.capacity,
+            "in_service": self.count,
+            "queue_length": len(self.queue),
+            "max_queue": self.max_queue,
+            "avg_queue": round(queued / elapsed, 3) if elapsed > 0 else 0.0,
+            "utilization": round(busy / (self.capacity * elapsed), 3) if elapsed > 0 else 0.0,
+            "served": self.served,
+        }
+
+
+class LineModel:
+    """The stations of one production line inside a SimPy environment, plus throughput bookkeeping."""
+
+    def __init__(self, env, station_capacity=None):
+        capacity = station_capacity or {}
+        self.env = env
+        self.stations = {name: MonitoredStation(env, name, capacity.get(name, 1)) for name in STATIONS}
+        self.products_completed = 0
+        self.flow_time = 0.0
+        self.first_completion = None
+        self.last_completion = None
+
+    def walk(self, route, on_enter, on_step):
+        """Move a product through the stations of ``route`` with blocking transfer.
+
+        The next station is acquired before the current one is released, so a
+        product waits where it is when the station ahead is busy. ``on_enter`` is
+        called once the first station is acquired and ``on_step`` must return a
+        generator performing one (duration, stage, message) step.
+        """
+        held = pending = None
+        try:
+            for station, steps in groupby(route, key=itemgetter(0)):
+                pending = self.stations[station].request()
+                yield pending
+                if held is None:
+                    on_enter()
+                else:
+                    held.resource.release(held)
+                held, pending = pending, None
+                for _, duration, stage, message in steps:
+                    yield from on_step(duration, stage, message)
+        finally:
+            if pending is not None:
+                if pending.triggered:
+                    pending.resource.release(pending)
+                else:
+                    pending.cancel()
+            if held is not None:
+                held.resource.release(held)
+
+    def record_completion(self, flow_time: float):
+        self.products_completed += 1
+        self.flow_time += flow_time
+        if self.first_completion is None:
+            self.first_completion = self.env.now
+        self.last_completion = self.env.now
+
+    def stats(self):
+        completed = self.products_completed
+        elapsed = self.env.now
+        return {
+            "elapsed": round(elapsed, 3),
+            "products_completed": completed,
+            "takt_time": round((self.last_completion - self.first_completion) / (completed - 1), 2) if completed > 1 else None,
+            "avg_flow_time": round(self.flow_time / completed, 2) if completed else None,
+            "throughput_per_hour": round(completed * 3600 / elapsed, 2) if elapsed > 0 else None,
+            "stations": {name: station.stats() for name, station in self.stations.items()},
+        }
+
+
+class SimulationControl:
+    """Thread-safe stop/pause switches shared by the simulator thread and API handlers."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.stop_requested = False
+        self.paused = False
+
+    def reset(self):
+        with self.condition:
+            self.stop_requested = False
+            self.paused = False
+
+    def request_stop(self):
+        with self.condition:
+            self.stop_requested = True
+            self.condition.notify_all()
+
+    def pause(self):
+        with self.condition:
+            self.paused = True
+            self.condition.notify_all()
+
+    def resume(self):
+        with self.condition:
+            self.paused = False
+            self.condition.notify_all()
+
+    def wait(self, timeout: float):
+        """Sleep up to ``timeout`` seconds; returns early when a stop is requested."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.stop_requested, timeout)
+
+    def wait_while_paused(self):
+        with self.condition:
+            self.condition.wait_for(lambda: not self.paused or self.stop_requested)
+
+
+class ControlledRealtimeEnvironment(RealtimeEnvironment):
+    """RealtimeEnvironment that can be stopped, paused and resumed from other threads.
+
+    Instead of sleeping blindly until the next event, ``step`` waits on the shared
+    ``SimulationControl`` condition. A stop wakes it at once and interrupts every
+    registered process; a pause freezes the clock and shifts ``real_start`` by the
+    paused duration on resume.
+    """
+
+    def __init__(self, control: SimulationControl, factor: float = 1.0, strict: bool = True):
+        super().__init__(factor=factor, strict=strict)
+        self.control = control
+        self.stoppable = []
+        self.interrupted = set()
+
+    def stoppable_process(self, generator):
+        process = self.process(generator)
+        self.stoppable.append(process)
+        return process
+
+    def _interrupt_stoppable(self):
+        for process in self.stoppable:
+            # Processes that have not started yet are interrupted on a later step
+            if process.is_alive and process not in self.interrupted and not isinstance(process.target, Initialize):
+                process.interrupt("stop")
+                self.interrupted.add(process)
+
+    def step(self):
+        evt_time = self.peek()
+        if evt_time is Infinity:
+            raise EmptySchedule
+
+        control = self.control
+        with control.condition:
+            while not control.stop_requested:
+                if control.paused:
+                    paused_at = time.monotonic()
+                    control.condition.wait_for(lambda: not control.paused or control.stop_requested)
+                    self.real_start += time.monotonic() - paused_at
+                    continue
+                real_time = self.real_start + (evt_time - self.env_start) * self.factor
+                if self.strict and time.monotonic() - real_time > self.factor:
+                    delta = time.monotonic() - real_time
+                    raise RuntimeError(f"Simulation too slow for real time ({delta:.3f}s).")
+                delta = real_time - time.monotonic()
+                if delta <= 0:
+                    break
+                control.condition.wait(delta)
+
+        if control.stop_requested:
+            self._interrupt_stoppable()
+        Environment.step(self)
+
+
+class ProductionStateWriter:
+    """Writes product/order state transitions to the database.
+
+    In ``immediate`` mode every transition is committed right away. In ``batch``
+    mode transitions are merged in memory per row and flushed as bulk
+    ``UPDATE ... FROM (VALUES ...)`` statements once ``batch_size`` rows are
+    pending or ``flush_interval`` seconds have passed since the last flush.
+    While transitions are pending a daemon timer enforces the interval even
+    when no further records arrive (idle or paused line); it exits once the
+    buffer is empty.
+    """
+
+    PRODUCT_COLUMNS = {
+        "status": "varchar",
+        "produced_at": "timestamp",
+        "produced_end": "timestamp",
+        "updated_at": "timestamp",
+    }
+    ORDER_COLUMNS = {
+        "status": "varchar",
+        "updated_at": "timestamp",
+    }
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        mode: str = "immediate",
+        batch_size: int = 200,
+        flush_interval: float = 2.0,
+    ):
+        self.session_factory = session_factory
+        self.mode = mode
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending_products = {}
+        self.pending_orders = {}
+        self.last_flush_at = time.monotonic()
+        self.commit_count = 0
+        self.rows_written = 0
+        self.last_flush_ms = None
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.timer = None
+
+    # ----------------- recording -----------------
+    def record_product(self, product_id, **fields):
+        with self.lock:
+            self.pending_products.setdefault(product_id, {}).update(fields)
+            self._ensure_timer()
+        self._maybe_flush()
+
+    def record_order(self, order_id, **fields):
+        with self.lock:
+            self.pending_orders.setdefault(order_id, {}).update(fields)
+            self._ensure_timer()
+        self._maybe_flush()
+
+    def _ensure_timer(self):
+        # Called with self.lock held; virtual runs use an infinite interval and flush explicitly
+        if self.mode == "batch" and self.timer is None and self.flush_interval != float("inf"):
+            self.timer = threading.Thread(target=self._flush_on_interval, name="state-writer-flush", daemon=True)
+            self.timer.start()
+
+    def _flush_on_interval(self):
+        while True:
+            time.sleep(max(0.05, self.last_flush_at + self.flush_interval - time.monotonic()))
+            with self.lock:
+                if not self.pending_products and not self.pending_orders:
+                    self.timer = None
+                    return
+            if time.monotonic() - self.last_flush_at >= self.flush_interval:
+                try:
+                    self.flush()
+                except Exception as exc:
+                    # The transitions were put back; retried on the next interval
+                    print(f"状态刷新失败: {exc}")
+
+    def pending_count(self):
+        with self.lock:
+            return len(self.pending_products) + len(self.pending_orders)
+
+    def _maybe_flush(self):
+        if (
+            self.mode != "batch"
+            or self.pending_count() >= self.batch_size
+            or time.monotonic() - self.last_flush_at >= self.flush_interval
+        ):
+            self.flush()
+
+    # ----------------- flushing -----------------
+    def flush(self):
+        """Write all pending transitions in one transaction. Returns the number of rows written."""
+        with self.flush_lock:
+            with self.lock:
+                products, self.pending_products = self.pending_products, {}
+                orders, self.pending_orders = self.pending_orders, {}
+            self.last_flush_at = time.monotonic()
+            if not products and not orders:
+                return 0
+
+            started = time.perf_counter()
+            session = self.session_factory()
+            try:
+                self._bulk_update(session, ProductionProduct, self.PRODUCT_COLUMNS, products)
+                self._bulk_update(session, ProductionOrder, self.ORDER_COLUMNS, orders)
+                session.commit()
+            except Exception:
+                session.rollback()
+                # Put the transitions back (newer values win) so the next flush retries them
+                with self.lock:
+                    for pending, failed in ((self.pending_products, products), (self.pending_orders, orders)):
+                        for row_id, fields in failed.items():
+                            pending[row_id] = {**fields, **pending.get(row_id, {})}
+                raise
+            finally:
+                session.close()
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.commit_count += 1
+            self.rows_written += len(products) + len(orders)
+            self.last_flush_ms = round(elapsed_ms, 2)
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+            return len(products) + len(orders)
+
+    def _bulk_update(self, session, model, columns, rows):
+        if not rows:
+            return
+        if session.bind.dialect.name != "postgresql":
+            session.execute(update(model), [{"id": row_id, **fields} for row_id, fields in rows.items()])
+            return
+
+        items = list(rows.items())
+        for start in range(0, len(items), self.batch_size):
+            chunk = items[start:start + self.batch_size]
+            params = {}
+            values_sql = []
+            for idx, (row_id, fields) in enumerate(chunk):
+                params[f"id_{idx}"] = row_id
+                placeholders = [f"CAST(:id_{idx} AS integer)"]
+                for column, sql_type in columns.items():
+                    params[f"{column}_{idx}"] = fields.get(column)
+                    placeholders.append(f"CAST(:{column}_{idx} AS {sql_type})")
+                values_sql.append(f"({', '.join(placeholders)})")
+            # Columns missing from a transition are NULL in VALUES and keep their current value
+            set_sql = ", ".join(f"{column} = COALESCE(v.{column}, t.{column})" for column in columns)
+            session.execute(
+                text(
+                    f"UPDATE {model.__tablename__} AS t SET {set_sql} "
+                    f"FROM (VALUES {', '.join(values_sql)}) AS v(id, {', '.join(columns)}) "
+                    f"WHERE t.id = v.id"
+                ),
+                params,
+            )
+
+    def get_stats(self):
+        return {
+            "mode": self.mode,
+            "commits": self.commit_count,
+            "rows_written": self.rows_written,
+            "pending": self.pending_count(),
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.commit_count, 2) if self.commit_count else None,
+        }
+
+
+class VirtualBacklog:
+    """Order source for virtual runs, shared by every line in the environment.
+
+    ``next_order()`` hands out orders with scheduled products in ``_run_loop``
+    order; with ``repeat`` it cycles over them again, otherwise it returns None
+    once every order has been handed out.
+    """
+
+    def __init__(self, orders, products_by_order, repeat: bool = False):
+        self.items = [(order, products_by_order[order.id]) for order in orders if products_by_order.get(order.id)]
+        self.repeat = repeat
+        self.position = 0
+
+    def next_order(self):
+        if not self.items:
+            return None
+        if self.position >= len(self.items):
+            if not self.repeat:
+                return None
+            self.position = 0
+        item = self.items[self.position]
+        self.position += 1
+        return item
+
+
+def load_virtual_backlog(session_factory, order_ids=None, scheduled_date=None, horizon=None, repeat=False, persist=False):
+    """Validate virtual-run options and load the selected orders and their scheduled products."""
+    if repeat and not horizon:
+        raise ValueError("repeat 模式必须指定仿真时长")
+    if repeat and persist:
+        raise ValueError("repeat 模式只能用于试算，不能写入数据库")
+
+    session = session_factory()
+    try:
+        order_query = session.query(ProductionOrder.id, ProductionOrder.order_code)
+        if order_ids:
+            order_query = order_query.filter(ProductionOrder.id.in_(order_ids))
+        else:
+            order_query = order_query.filter(ProductionOrder.status == "scheduled")
+        if scheduled_date:
+            order_query = order_query.filter(ProductionOrder.scheduled_date == scheduled_date)
+        orders = order_query.order_by(
+            ProductionOrder.scheduled_date.is_(None),
+            ProductionOrder.scheduled_date.asc(),
+            ProductionOrder.id.asc(),
+        ).all()
+
+        products_by_order = defaultdict(list)
+        if orders:
+            product_rows = (
+                session.query(ProductionProduct.id, ProductionProduct.serial_number, ProductionProduct.order_id)
+                .filter(ProductionProduct.order_id.in_([order.id for order in orders]))
+                .filter(ProductionProduct.status == "scheduled")
+                .order_by(ProductionProduct.id.asc())
+                .all()
+            )
+            for row in product_rows:
+                products_by_order[row.order_id].append(row)
+    finally:
+        session.close()
+    return VirtualBacklog(orders, products_by_order, repeat)
+
+
 class ProductionSimulator:
     """Simulates orders by updating database records and emitting log events using SimPy RealtimeEnvironment."""
 
@@ -44,14 +504,32 @@ class ProductionSimulator:
         labels_per_product: int = 1,
         max_events: int = 400,
         realtime_factor: float = 1.0,
+        write_mode: str = "immediate",
+        flush_batch_size: int = 200,
+        flush_interval: float = 2.0,
+        station_capacity: dict = None,
+        line_id: str = None,
     ):
+        self.line_id = line_id
         self.session_factory = session_factory
         self.station_times = station_times
+        self.station_capacity = station_capacity or {}
         self.poll_interval = poll_interval
         self.labels_per_product = max(1, labels_per_product)
         self.realtime_factor = realtime_factor
+        self.writer = ProductionStateWriter(
+            session_factory,
+            mode=write_mode,
+            batch_size=flush_batch_size,
+            flush_interval=flush_interval,
+        )
         self.events = deque(maxlen=max_events)
+        self.line = None  # LineModel of the order currently (or last) on the line
+        self.started_at = None
+        self.orders_completed = 0
+        self.products_completed = 0
         self.running = False
+        self.control = SimulationControl()
         self.thread = None
         self.websocket_callback = None  # Callback function to push events via WebSocket
 
@@ -59,33 +537,58 @@ class ProductionSimulator:
     def start(self):
         if self.running:
             return
+        self.control.reset()
+        self.started_at = time.monotonic()
+        self.orders_completed = 0
+        self.products_completed = 0
         self.running = True
         self.thread = threading.Thread(target=self._run_loop, daemon=True)
         self.thread.start()
 
     def stop(self):
         self.running = False
+        self.control.request_stop()
         if self.thread and self.thread.is_alive():
             self.thread.join(timeout=2)
+        # Guarantee that buffered state transitions reach the database
+        try:
+            self.writer.flush()
+        except Exception as exc:
+            self._log_event("error", f"状态刷新失败: {exc}")
+
+    @property
+    def paused(self):
+        return self.control.paused
+
+    def pause(self):
+        if not self.running or self.control.paused:
+            return
+        self.control.pause()
+        # A paused line records nothing, so write out what is buffered now
+        try:
+            self.writer.flush()
+        except Exception as exc:
+            self._log_event("error", f"状态刷新失败: {exc}")
+        self._log_event("simulation_paused", "模拟已暂停")
+
+    def resume(self):
+        if not self.running or not self.control.paused:
+            return
+        self.control.resume()
+        self._log_event("simulation_resumed", "模拟已恢复")
 
     # ----------------- main loop -----------------
     def _run_loop(self):
         while self.running:
+            # Hold between orders while paused; the environment freezes its own clock mid-order
+            self.control.wait_while_paused()
+            if not self.running:
+                break
             session = self.session_factory()
             try:
-                order = (
-                    session.query(ProductionOrder)
-                    .filter(ProductionOrder.status == "scheduled")
-                    .order_by(
-                        ProductionOrder.scheduled_date.is_(None),
-                        ProductionOrder.scheduled_date.asc(),
-                        ProductionOrder.id.asc(),
-                    )
-                    .first()
-                )
-
+                order = self._claim_next_order(session)
                 if not order:
-                    time.sleep(self.poll_interval)
+                    self.control.wait(self.poll_interval)
                     continue
 
                 self._log_event(
@@ -94,9 +597,6 @@ class ProductionSimulator:
                     order_id=order.id,
                     order_code=order.order_code,
                 )
-
-                order.status = "in_progress"
-                session.commit()
                 self._log_event(
                     "order_in_progress",
                     "订单开始执行",
@@ -113,47 +613,20 @@ class ProductionSimulator:
                     .all()
                 )
 
-                for product in products:
-                    # Check if simulation should stop before processing each product
-                    if not self.running:
-                        break
-                    if product.status != "scheduled":
-                        continue
-                    # Create a new RealtimeEnvironment for each product
-                    env = RealtimeEnvironment(factor=self.realtime_factor, strict=True)
-                    # Start the simulation process
-                    process = env.process(self._simulate_product(env, session, order, product))
-                    # Calculate a reasonable timeout (sum of all steps + buffer)
-                    total_time = (
-                        self.station_times.belt_to_scanner
-                        + self.station_times.scan_time
-                        + self.station_times.belt_to_stop
-                        + self.station_times.jack_up
-                        + self.station_times.mbi_query
-                        + self.labels_per_product * (
-                            self.station_times.feeder_time
-                            + self.station_times.robot_pick
-                            + self.station_times.robot_to_loc_cam
-                            + self.station_times.locating_time
-                            + self.station_times.robot_to_device
-                            + self.station_times.labeling_time
-                        )
-                        + self.station_times.jack_down
-                        + self.station_times.belt_to_inspection
-                        + self.station_times.qc_time
-                        + 5.0  # buffer
-                    )
-                    # Run the environment until process completes or simulation stops
-                    # Since _simulate_product checks self.running at each step and returns early if stopped,
-                    # the process will end when self.running becomes False, and env.run() will return immediately
-                    try:
-                        env.run(until=total_time)
-                    except simpy.events.EmptySchedule:
-                        # Process completed or stopped
-                        pass
-                    # If stopped, break out of product loop
-                    if not self.running:
-                        break
+                # One environment per order: all its products flow through the stations concurrently
+                env = ControlledRealtimeEnvironment(self.control, factor=self.realtime_factor, strict=True)
+                self.line = LineModel(env, self.station_capacity)
+                processes = [
+                    env.stoppable_process(self._simulate_product(env, self.line, order, product))
+                    for product in products
+                    if product.status == "scheduled"
+                ]
+                # stop() interrupts every product process, so the run ends immediately
+                if processes:
+                    env.run(until=env.all_of(processes))
+
+                # Order boundary: make every buffered transition visible before reading it back
+                self.writer.flush()
 
                 # Only mark order as completed if simulation is still running AND all products are completed
                 if self.running:
@@ -169,9 +642,9 @@ class ProductionSimulator:
                     
                     # Only mark order as completed if all products are completed
                     if remaining_products == 0:
-                        order.status = "completed"
-                        order.updated_at = datetime.now(timezone.utc)
-                        session.commit()
+                        self.writer.record_order(order.id, status="completed", updated_at=datetime.now(timezone.utc))
+                        self.writer.flush()
+                        self.orders_completed += 1
                         self._log_event(
                             "order_completed",
                             "订单全部产品完成",
@@ -188,115 +661,277 @@ class ProductionSimulator:
             except Exception as exc:
                 session.rollback()
                 self._log_event("error", f"模拟异常: {exc}")
-                time.sleep(self.poll_interval)
+                self.control.wait(self.poll_interval)
             finally:
                 session.close()
 
-    # ----------------- simulation helpers -----------------
-    def _simulate_product(self, env: RealtimeEnvironment, session, order, product):
-        """SimPy process to simulate a single product through the production line."""
-        # Check if simulation should stop
-        if not self.running:
-            return
-        
-        # Update product status to in_progress and record start time
-        product.status = "in_progress"
-        product.produced_at = datetime.now(timezone.utc)
-        product.updated_at = datetime.now(timezone.utc)
-        session.commit()
-        self._log_event(
-            "product_start",
-            f"产品 {product.serial_number} 开始上线",
-            order_id=order.id,
-            order_code=order.order_code,
-            product_id=product.id,
-            product_sn=product.serial_number,
+    def _claim_next_order(self, session):
+        """Atomically claim the next scheduled order and mark it in_progress.
+
+        ``FOR UPDATE SKIP LOCKED`` lets several lines poll the same backlog without
+        ever picking the same order; the claim is committed right away so the row
+        lock is held only for this statement pair. The status-guarded UPDATE keeps
+        the claim exclusive on backends without row locks as well.
+        """
+        while True:
+            order = (
+                session.query(ProductionOrder)
+                .filter(ProductionOrder.status == "scheduled")
+                .order_by(
+                    ProductionOrder.scheduled_date.is_(None),
+                    ProductionOrder.scheduled_date.asc(),
+                    ProductionOrder.id.asc(),
+                )
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if not order:
+                session.rollback()
+                return None
+            claimed = session.execute(
+                update(ProductionOrder)
+                .where(ProductionOrder.id == order.id, ProductionOrder.status == "scheduled")
+                .values(status="in_progress", updated_at=datetime.now(timezone.utc))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            session.commit()
+            if claimed:
+                return order
+            # Another line won the race; try the next order
+
+    # ----------------- virtual time -----------------
+    def run_virtual(
+        self,
+        order_ids=None,
+        scheduled_date=None,
+        horizon: float = None,
+        repeat: bool = False,
+        persist: bool = False,
+        max_events: int = 200,
+        start_time: datetime = None,
+    ):
+        """Run orders through the line on a plain ``simpy.Environment`` (virtual time).
+
+        All selected orders share one environment and the line is a single-capacity
+        resource, so timings match the realtime loop, but time jumps from event to
+        event and a week of production finishes in seconds. Timestamps come from the
+        virtual clock starting at ``start_time``. ``horizon`` caps the run in virtual
+        seconds and ``repeat`` re-feeds the selected orders until the horizon is hit.
+        Without ``persist`` the run is a dry run that only returns the report.
+        """
+        backlog = load_virtual_backlog(self.session_factory, order_ids, scheduled_date, horizon, repeat, persist)
+        env = simpy.Environment()
+        writer = self._virtual_writer() if persist else None
+        run = self._virtual_run(env, start_time or datetime.now(timezone.utc), max_events, writer)
+
+        wall_started = time.perf_counter()
+        feeder = env.process(self._virtual_feeder(run, backlog))
+        env.run(until=env.any_of([feeder, env.timeout(horizon)]) if horizon else feeder)
+        if writer:
+            writer.flush()
+        return self._virtual_report(run, time.perf_counter() - wall_started, persist)
+
+    def _virtual_writer(self):
+        return ProductionStateWriter(
+            self.session_factory,
+            mode="batch",
+            batch_size=self.writer.batch_size,
+            flush_interval=float("inf"),
         )
 
-        # Belt to scanner
-        if not self.running:
-            return
-        yield from self._step(env, self.station_times.belt_to_scanner, "belt", "设备移动到扫码位", order, product)
-        
-        # Scan
-        if not self.running:
-            return
-        yield from self._step(env, self.station_times.scan_time, "scanner", "扫码相机读码", order, product)
-        
-        # Belt to stop position
-        if not self.running:
-            return
-        yield from self._step(env, self.station_times.belt_to_stop, "belt", "移动到挡停位置", order, product)
-        
-        # Jack up and light on
-        if not self.running:
-            return
-        yield from self._step(env, self.station_times.jack_up, "lifters", "顶升气缸抬起，光源点亮", order, product)
-        
-        # Query MBI server
-        if not self.running:
-            return
-        yield from self._step(env, self.station_times.mbi_query, "mbi", "MBI Server 返回产品参数", order, product)
+    def _virtual_run(self, env, start_time, max_events, writer):
+        """State of one line inside a (possibly shared) virtual environment."""
+        return {
+            "env": env,
+            "line": LineModel(env, self.station_capacity),
+            "start_time": start_time,
+            "route": self._product_route(),
+            # Events are kept as raw tuples and only formatted for the retained tail
+            "events": deque(maxlen=max(0, max_events)),
+            "writer": writer,
+            "orders_completed": 0,
+        }
 
-        # Label cycles
-        for cycle in range(self.labels_per_product):
-            if not self.running:
-                return
-            cycle_label = f"{cycle + 1}/{self.labels_per_product}"
-            yield from self._step(env, self.station_times.feeder_time, "feeder", f"进料器供料 {cycle_label}", order, product)
-            if not self.running:
-                return
-            yield from self._step(env, self.station_times.robot_pick, "robot", f"机械臂取标 {cycle_label}", order, product)
-            if not self.running:
-                return
-            yield from self._step(env, self.station_times.robot_to_loc_cam, "robot", "机械臂移动至定位相机", order, product)
-            if not self.running:
-                return
-            yield from self._step(env, self.station_times.locating_time, "camera", "定位相机校准", order, product)
-            if not self.running:
-                return
-            yield from self._step(env, self.station_times.robot_to_device, "robot", "机械臂移动至设备", order, product)
-            if not self.running:
-                return
-            yield from self._step(env, self.station_times.labeling_time, "labeling", "执行贴码", order, product)
+    def _virtual_report(self, run, wall_seconds, persist):
+        virtual_seconds = run["env"].now
+        line_stats = run["line"].stats()
+        products_completed = line_stats["products_completed"]
+        return {
+            "mode": "virtual",
+            "line_id": self.line_id,
+            "start_time": run["start_time"].isoformat(),
+            "end_time": self._virtual_now(run).isoformat(),
+            "virtual_seconds": round(virtual_seconds, 3),
+            "wall_seconds": round(wall_seconds, 3),
+            "speedup": round(virtual_seconds / wall_seconds, 1) if wall_seconds > 0 else None,
+            "orders_completed": run["orders_completed"],
+            "products_completed": products_completed,
+            "throughput_per_hour": round(products_completed * 3600 / virtual_seconds, 2) if virtual_seconds else None,
+            "takt_time": line_stats["takt_time"],
+            "avg_cycle_time": line_stats["avg_flow_time"],
+            "line": line_stats,
+            "persisted": persist,
+            "writer": run["writer"].get_stats() if run["writer"] else None,
+            "events": [
+                self._build_event(stage, message, at=at, **context)
+                for at, stage, message, context in reversed(run["events"])
+            ],
+        }
 
-        # Jack down and light off
-        if not self.running:
-            return
-        yield from self._step(env, self.station_times.jack_down, "lifters", "顶升气缸复位，光源熄灭", order, product)
-        
-        # Belt to inspection
-        if not self.running:
-            return
-        yield from self._step(env, self.station_times.belt_to_inspection, "belt", "设备前往质检位", order, product)
-        
-        # QC camera
-        if not self.running:
-            return
-        yield from self._step(env, self.station_times.qc_time, "qc", "质检相机拍照", order, product)
+    def _virtual_now(self, run):
+        return run["start_time"] + timedelta(seconds=run["env"].now)
 
-        # Update product status to completed only if still running
-        if self.running:
-            product.status = "completed"
-            product.produced_end = datetime.now(timezone.utc)
-            product.updated_at = datetime.now(timezone.utc)
-            session.commit()
+    def _virtual_event(self, run, stage, message, **context):
+        if run["events"].maxlen:
+            run["events"].append((self._virtual_now(run), stage, message, context))
+
+    def _virtual_feeder(self, run, backlog):
+        """Feeds orders from ``backlog`` into the environment in ``_run_loop`` order.
+
+        The next order is released as soon as every product of the current one has
+        entered the line, so consecutive orders overlap in the pipeline. Several
+        lines may pull from the same backlog, each taking the next unclaimed order.
+        """
+        env = run["env"]
+        writer = run["writer"]
+        watchers = []
+        while True:
+            item = backlog.next_order()
+            if item is None:
+                break
+            order, products = item
+            context = {"order_id": order.id, "order_code": order.order_code}
+            self._virtual_event(run, "order_pick", f"选中订单 {order.order_code or order.id}", **context)
+            if writer:
+                writer.record_order(order.id, status="in_progress")
+            self._virtual_event(run, "order_in_progress", "订单开始执行", **context)
 
+            entered = [env.event() for _ in products]
+            processes = [
+                env.process(self._virtual_product(run, order, product, entered_event))
+                for product, entered_event in zip(products, entered)
+            ]
+            watcher = env.process(self._virtual_order_watch(run, order, processes))
+            if not backlog.repeat:
+                watchers.append(watcher)
+            yield env.all_of(entered)
+        yield env.all_of(watchers)
+
+    def _virtual_order_watch(self, run, order, processes):
+        yield run["env"].all_of(processes)
+        if run["writer"]:
+            run["writer"].record_order(order.id, status="completed", updated_at=self._virtual_now(run))
+        run["orders_completed"] += 1
+        self._virtual_event(run, "order_completed", "订单全部产品完成", order_id=order.id, order_code=order.order_code)
+
+    def _virtual_product(self, run, order, product, entered):
+        """SimPy process walking one product through the line stations in virtual time."""
+        env = run["env"]
+        writer = run["writer"]
+        context = {
+            "order_id": order.id,
+            "order_code": order.order_code,
+            "product_id": product.id,
+            "product_sn": product.serial_number,
+        }
+        started = None
+
+        def on_enter():
+            nonlocal started
+            started = self._virtual_now(run)
+            if writer:
+                writer.record_product(product.id, status="in_progress", produced_at=started, updated_at=started)
+            self._virtual_event(run, "product_start", f"产品 {product.serial_number} 开始上线", **context)
+            entered.succeed()
+
+        def on_step(duration, stage, message):
+            self._virtual_event(run, stage, message, **context)
+            yield env.timeout(duration)
+
+        yield from run["line"].walk(run["route"], on_enter, on_step)
+
+        finished = self._virtual_now(run)
+        if writer:
+            writer.record_product(product.id, status="completed", produced_end=finished, updated_at=finished)
+        run["line"].record_completion((finished - started).total_seconds())
+        self._virtual_event(run, "product_completed", f"产品 {product.serial_number} 完成", **context)
+
+    # ----------------- simulation helpers -----------------
+    def _simulate_product(self, env: ControlledRealtimeEnvironment, line: LineModel, order, product):
+        """SimPy process to simulate a single product through the production line; ends on stop interrupt."""
+        started = entered_at = None
+
+        def on_enter():
+            nonlocal started, entered_at
+            # Update product status to in_progress and record start time
+            entered_at = env.now
+            started = datetime.now(timezone.utc)
+            self.writer.record_product(product.id, status="in_progress", produced_at=started, updated_at=started)
             self._log_event(
-                "product_completed",
-                f"产品 {product.serial_number} 完成",
+                "product_start",
+                f"产品 {product.serial_number} 开始上线",
                 order_id=order.id,
                 order_code=order.order_code,
                 product_id=product.id,
                 product_sn=product.serial_number,
             )
 
-    def _step(self, env: RealtimeEnvironment, duration: float, stage: str, message: str, order, product):
-        """SimPy process step that logs and waits for the specified duration."""
-        # Check if simulation should stop before logging
-        if not self.running:
+        def on_step(duration, stage, message):
+            return self._step(env, duration, stage, message, order, product)
+
+        try:
+            yield from line.walk(self._product_route(), on_enter, on_step)
+        except simpy.Interrupt:
             return
-        
+
+        now = datetime.now(timezone.utc)
+        self.writer.record_product(product.id, status="completed", produced_end=now, updated_at=now)
+        line.record_completion(env.now - entered_at)
+        self.products_completed += 1
+
+        self._log_event(
+            "product_completed",
+            f"产品 {product.serial_number} 完成",
+            order_id=order.id,
+            order_code=order.order_code,
+            product_id=product.id,
+            product_sn=product.serial_number,
+            cycle_time=round((now - started).total_seconds(), 3),
+        )
+
+    def _product_route(self):
+        """Ordered (station, duration, stage, message) steps a product passes through on the line."""
+        st = self.station_times
+
+        def step(field, stage, message):
+            return (STATION_OF_STEP[field], getattr(st, field), stage, message)
+
+        route = [
+            step("belt_to_scanner", "belt", "设备移动到扫码位"),
+            step("scan_time", "scanner", "扫码相机读码"),
+            step("belt_to_stop", "belt", "移动到挡停位置"),
+            step("jack_up", "lifters", "顶升气缸抬起，光源点亮"),
+            step("mbi_query", "mbi", "MBI Server 返回产品参数"),
+        ]
+        for cycle in range(self.labels_per_product):
+            cycle_label = f"{cycle + 1}/{self.labels_per_product}"
+            route += [
+                step("feeder_time", "feeder", f"进料器供料 {cycle_label}"),
+                step("robot_pick", "robot", f"机械臂取标 {cycle_label}"),
+                step("robot_to_loc_cam", "robot", "机械臂移动至定位相机"),
+                step("locating_time", "camera", "定位相机校准"),
+                step("robot_to_device", "robot", "机械臂移动至设备"),
+                step("labeling_time", "labeling", "执行贴码"),
+            ]
+        route += [
+            step("jack_down", "lifters", "顶升气缸复位，光源熄灭"),
+            step("belt_to_inspection", "belt", "设备前往质检位"),
+            step("qc_time", "qc", "质检相机拍照"),
+        ]
+        return route
+
+    def _step(self, env: ControlledRealtimeEnvironment, duration: float, stage: str, message: str, order, product):
+        """SimPy process step that logs and waits for the specified duration; a stop interrupts the timeout."""
         self._log_event(
             stage,
             message,
@@ -305,15 +940,7 @@ class ProductionSimulator:
             product_id=product.id if product else None,
             product_sn=product.serial_number if product else None,
         )
-        
-        # Wait in small increments to check running status frequently
-        elapsed = 0.0
-        check_interval = 0.1  # Check every 0.1 seconds
-        while elapsed < duration and self.running:
-            remaining = duration - elapsed
-            wait_time = min(check_interval, remaining)
-            yield env.timeout(wait_time)
-            elapsed += wait_time
+        yield env.timeout(duration)
 
     # ----------------- event utils -----------------
     def set_websocket_callback(self, callback):
@@ -338,6 +965,8 @@ class ProductionSimulator:
             "camera": ("INFO", "Camera"),
             "labeling": ("INFO", "Labeling"),
             "qc": ("INFO", "QCCamera"),
+            "simulation_paused": ("INFO", "Simulator"),
+            "simulation_resumed": ("INFO", "Simulator"),
             "error": ("ERROR", "System"),
         }
         
@@ -349,14 +978,19 @@ class ProductionSimulator:
             log_parts.append(f"订单:{context['order_code']}")
         if context.get("product_sn"):
             log_parts.append(f"产品:{context['product_sn']}")
+        if context.get("line_id"):
+            log_parts.append(f"产线:{context['line_id']}")
         
         formatted_message = " | ".join(log_parts)
         
         return level, source, formatted_message
 
-    def _log_event(self, stage, message, **context):
+    def _build_event(self, stage, message, at=None, **context):
+        """Build an event dict; ``at`` overrides the wall-clock timestamp (used in virtual time)."""
+        if self.line_id is not None:
+            context.setdefault("line_id", self.line_id)
         # Get current time in the log file format: YYYY-MM-DD HH:MM:SS,mmm
-        now = datetime.now(timezone.utc)
+        now = at or datetime.now(timezone.utc)
         timestamp_str = now.strftime("%Y-%m-%d %H:%M:%S") + f",{now.microsecond // 1000:03d}"
         
         # Format log message
@@ -367,9 +1001,6 @@ class ProductionSimulator:
         thread_id = "6 "  # Fixed thread ID as in log file
         log_line = f"{timestamp_str}[{thread_id}] | [{level:5}] [{source}] | {formatted_message}"
         
-        # Print to console (matching log file format)
-        print(log_line)
-        
         # Create event object for WebSocket
         event = {
             "id": str(uuid.uuid4()),
@@ -381,6 +1012,14 @@ class ProductionSimulator:
             "source": source,
         }
         event.update(context)
+        return event
+
+    def _log_event(self, stage, message, **context):
+        event = self._build_event(stage, message, **context)
+
+        # Print to console (matching log file format)
+        print(event["log_line"])
+
         self.events.appendleft(event)
         
         # Push event via WebSocket immediately if callback is set
@@ -393,19 +1032,230 @@ class ProductionSimulator:
                 print(f"WebSocket push failed: {e}")
 
     def get_events(self, limit: int = 100):
-        if not self.events:
-            return []
-        limit = max(1, min(limit, len(self.events)))
-        return list(self.events)[:limit]
+        # Copy only the requested head of the deque, not the whole buffer
+        return list(islice(self.events, max(1, limit)))
 
     def clear_events(self):
         """Clear all events from the queue."""
         self.events.clear()
 
+    def get_status(self):
+        return {
+            "running": self.running,
+            "paused": self.paused,
+            "events": len(self.events),
+            "writer": self.writer.get_stats(),
+            "line": self.line.stats() if self.line else None,
+            "throughput": self.get_throughput(),
+            "worker": {"mode": "thread"},
+        }
+
+    def get_throughput(self):
+        """Cumulative output of this line since the last start()."""
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0.0
+        return {
+            "line_id": self.line_id,
+            "elapsed": round(elapsed, 1),
+            "orders_completed": self.orders_completed,
+            "products_completed": self.products_completed,
+            "products_per_hour": round(self.products_completed * 3600 / elapsed, 2) if elapsed > 0 else None,
+        }
+
+
+class ProductionLineCoordinator:
+    """Runs several independent production lines against the same order backlog.
+
+    Each line is a ``ProductionSimulator`` with its own station times, station
+    capacities and simulation thread; lines claim orders with ``SKIP LOCKED`` so
+    no order is worked twice. The coordinator exposes the simulator API, merges
+    the line event streams (every event carries ``line_id``) and aggregates
+    throughput. Virtual runs put all lines into one environment that shares a
+    single backlog, so the plant-level capacity of N lines can be planned.
+    """
+
+    def __init__(self, line_configs, max_events: int = 400, **simulator_kwargs):
+        if not line_configs:
+            raise ValueError("至少需要配置一条产线")
+        self.lines = {}
+        for index, line_config in enumerate(line_configs):
+            line_id = str(line_config.get("id") or f"line-{index + 1}")
+            if line_id in self.lines:
+                raise ValueError(f"产线编号重复: {line_id}")
+            line = ProductionSimulator(
+                max_events=max_events,
+                **_line_kwargs(simulator_kwargs, dict(line_config, id=line_id)),
+            )
+            line.set_websocket_callback(self._forward_event)
+            self.lines[line_id] = line
+        self.events = deque(maxlen=max_events)
+        self.events_lock = threading.Lock()
+        self.websocket_callback = None
+
+    def _forward_event(self, event):
+        with self.events_lock:
+            self.events.appendleft(event)
+        if self.websocket_callback:
+            try:
+                self.websocket_callback(event)
+            except Exception as e:
+                print(f"WebSocket push failed: {e}")
+
+    # ----------------- lifecycle -----------------
+    @property
+    def running(self):
+        return any(line.running for line in self.lines.values())
+
+    @property
+    def paused(self):
+        running = [line for line in self.lines.values() if line.running]
+        return bool(running) and all(line.paused for line in running)
+
+    def start(self):
+        for line in self.lines.values():
+            line.start()
+
+    def stop(self):
+        # Signal every line first so they wind down in parallel, then join them one by one
+        for line in self.lines.values():
+            line.control.request_stop()
+        for line in self.lines.values():
+            line.stop()
+
+    def pause(self):
+        for line in self.lines.values():
+            line.pause()
+
+    def resume(self):
+        for line in self.lines.values():
+            line.resume()
+
+    # ----------------- events & status -----------------
+    def set_websocket_callback(self, callback):
+        self.websocket_callback = callback
+
+    def get_events(self, limit: int = 100):
+        with self.events_lock:
+            return list(islice(self.events, max(1, limit)))
+
+    def clear_events(self):
+        with self.events_lock:
+            self.events.clear()
+        for line in self.lines.values():
+            line.clear_events()
+
+    def get_status(self):
+        lines = {}
+        for line_id, line in self.lines.items():
+            status = line.get_status()
+            status.pop("worker", None)
+            lines[line_id] = status
+        throughput = [status["throughput"] for status in lines.values()]
+        return {
+            "running": self.running,
+            "paused": self.paused,
+            "events": len(self.events),
+            "lines": lines,
+            "throughput": {
+                "lines": len(lines),
+                "orders_completed": sum(item["orders_completed"] for item in throughput),
+                "products_completed": sum(item["products_completed"] for item in throughput),
+                "products_per_hour": round(sum(item["products_per_hour"] or 0 for item in throughput), 2),
+            },
+            "worker": {"mode": "thread"},
+        }
+
+    # ----------------- virtual time -----------------
+    def run_virtual(
+        self,
+        order_ids=None,
+        scheduled_date=None,
+        horizon: float = None,
+        repeat: bool = False,
+        persist: bool = False,
+        max_events: int = 200,
+        start_time: datetime = None,
+    ):
+        """Run every line in one virtual environment, all pulling from the same backlog."""
+        first_line = next(iter(self.lines.values()))
+        backlog = load_virtual_backlog(first_line.session_factory, order_ids, scheduled_date, horizon, repeat, persist)
+        env = simpy.Environment()
+        writer = first_line._virtual_writer() if persist else None
+        start_time = start_time or datetime.now(timezone.utc)
+        runs = {
+            line_id: line._virtual_run(env, start_time, max_events, writer)
+            for line_id, line in self.lines.items()
+        }
+
+        wall_started = time.perf_counter()
+        feeders = env.all_of([
+            env.process(self.lines[line_id]._virtual_feeder(run, backlog))
+            for line_id, run in runs.items()
+        ])
+        env.run(until=env.any_of([feeders, env.timeout(horizon)]) if horizon else feeders)
+        if writer:
+            writer.flush()
+        wall_seconds = time.perf_counter() - wall_started
+
+        reports = {
+            line_id: self.lines[line_id]._virtual_report(run, wall_seconds, persist)
+            for line_id, run in runs.items()
+        }
+        events = sorted(
+            (event for report in reports.values() for event in report.pop("events")),
+            key=itemgetter("timestamp"),
+            reverse=True,
+        )[:max(0, max_events)]
+        virtual_seconds = env.now
+        products_completed = sum(report["products_completed"] for report in reports.values())
+        return {
+            "mode": "virtual",
+            "start_time": start_time.isoformat(),
+            "end_time": (start_time + timedelta(seconds=virtual_seconds)).isoformat(),
+            "virtual_seconds": round(virtual_seconds, 3),
+            "wall_seconds": round(wall_seconds, 3),
+            "speedup": round(virtual_seconds / wall_seconds, 1) if wall_seconds > 0 else None,
+            "orders_completed": sum(report["orders_completed"] for report in reports.values()),
+            "products_completed": products_completed,
+            "throughput_per_hour": round(products_completed * 3600 / virtual_seconds, 2) if virtual_seconds else None,
+            "lines": reports,
+            "persisted": persist,
+            "writer": writer.get_stats() if writer else None,
+            "events": events,
+        }
+
+
+def _line_kwargs(simulator_kwargs, line_config):
+    """Simulator kwargs for one entry of ``SIM_LINES``."""
+    kwargs = dict(simulator_kwargs, line_id=line_config.get("id"))
+    if line_config.get("station_times"):
+        kwargs["station_times"] = StationTimes(**line_config["station_times"])
+    if line_config.get("station_capacity"):
+        kwargs["station_capacity"] = line_config["station_capacity"]
+    return kwargs
+
+
+def build_simulator(simulator_kwargs, line_configs=None):
+    """A single ProductionSimulator, or a coordinator when more than one line is configured."""
+    if line_configs and len(line_configs) > 1:
+        return ProductionLineCoordinator(line_configs, **simulator_kwargs)
+    if line_configs:
+        return ProductionSimulator(**_line_kwargs(simulator_kwargs, line_configs[0]))
+    return ProductionSimulator(**simulator_kwargs)
+
 
 def create_simulator():
-    simulator = ProductionSimulator()
+    simulator_kwargs = dict(
+        write_mode=simulation_config.write_mode,
+        flush_batch_size=simulation_config.flush_batch_size,
+        flush_interval=simulation_config.flush_interval,
+        station_capacity=simulation_config.station_capacity,
+    )
+    if simulation_config.worker_mode == "process":
+        # Host the simulator in its own process so it never competes with request handlers for the GIL
+        from simulation_worker import SimulatorProcessProxy
+
+        return SimulatorProcessProxy(simulator_kwargs, line_configs=simulation_config.lines)
+    simulator = build_simulator(simulator_kwargs, simulation_config.lines)
     # Don't auto-start, let API control it
     # simulator.start()
     return simulator
-
@@ -0,0 +1,162 @@
+import time
+import threading
+from collections import OrderedDict
+from itertools import count
+
+# Intermediate device moves: only the latest one per product matters to a dashboard
+LOW_PRIORITY_STAGES = frozenset({"belt", "lifters", "mbi", "feeder", "robot", "camera"})
+# Order state changes and completions: the kpi_update delta of a frame is summed from them
+CRITICAL_STAGES = frozenset({"order_pick", "order_in_progress", "order_completed", "product_completed"})
+
+
+class SimulationEventEmitter:
+    """Pushes simulator events to SocketIO from its own thread in batched frames.
+
+    ``push`` never blocks the simulator: events land in a bounded buffer that a
+    background thread drains every ``interval`` seconds into one frame handed to
+    ``emit_frame``. When the buffer passes the high-water mark (clients or the
+    transport falling behind), low-priority stages are coalesced to the latest
+    event per product; when it is full they are dropped first, then the oldest
+    ordinary events. Critical stages (completions, order state) are never evicted
+    to make room: a new ordinary event is dropped instead, and a new critical
+    event waits up to ``critical_wait`` seconds for the next drain. Only if the
+    buffer is still full of critical events is the oldest one evicted, counted
+    in ``evicted_critical``.
+    """
+
+    def __init__(
+        self,
+        emit_frame,
+        interval: float = 0.2,
+        max_queue: int = 2000,
+        high_water: float = 0.5,
+        low_priority_stages=LOW_PRIORITY_STAGES,
+        critical_stages=CRITICAL_STAGES,
+        critical_wait: float = 1.0,
+    ):
+        self.emit_frame = emit_frame
+        self.interval = interval
+        self.max_queue = max(1, max_queue)
+        self.high_water = max(1, int(self.max_queue * high_water))
+        self.low_priority_stages = frozenset(low_priority_stages)
+        self.critical_stages = frozenset(critical_stages)
+        self.critical_wait = critical_wait
+        self.condition = threading.Condition()
+        # key -> (event, enqueued_at); low-priority events under pressure share a per-product key
+        self.pending = OrderedDict()
+        self.keys = count()
+        self.stopped = False
+        self.stats = {
+            "enqueued": 0,
+            "emitted": 0,
+            "frames": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "evicted_critical": 0,
+            "emit_errors": 0,
+            "last_frame_size": 0,
+            "max_frame_size": 0,
+            "last_emit_ms": 0.0,
+            "max_latency_ms": 0.0,
+            "total_latency_ms": 0.0,
+        }
+        self.thread = threading.Thread(target=self._run, name="simulation-emitter", daemon=True)
+        self.thread.start()
+
+    def _is_low_priority(self, event):
+        return event.get("stage") in self.low_priority_stages
+
+    def _is_critical(self, event):
+        return event.get("stage") in self.critical_stages
+
+    def push(self, event):
+        """Queue an event for the next frame; safe to call from any thread."""
+        now = time.monotonic()
+        low_priority = self._is_low_priority(event)
+        with self.condition:
+            self.stats["enqueued"] += 1
+            key = next(self.keys)
+            if low_priority and len(self.pending) >= self.high_water:
+                key = ("coalesce", event.get("line_id"), event.get("product_id") or event.get("order_id"))
+                if key in self.pending:
+                    # Keep the newest state of this product; it moves to the back of the frame
+                    del self.pending[key]
+                    self.stats["coalesced"] += 1
+            if len(self.pending) >= self.max_queue:
+                if low_priority:
+                    self.stats["dropped"] += 1
+                    return
+                if not self._evict():
+                    if not self._is_critical(event):
+                        self.stats["dropped"] += 1
+                        return
+                    # Full of critical events: give the emitter thread a moment to drain before losing one
+                    self.condition.wait_for(lambda: len(self.pending) < self.max_queue, self.critical_wait)
+                    if len(self.pending) >= self.max_queue:
+                        self.pending.popitem(last=False)
+                        self.stats["dropped"] += 1
+                        self.stats["evicted_critical"] += 1
+            self.pending[key] = (event, now)
+            self.condition.notify()
+
+    def _evict(self):
+        """Drop the first low-priority event, else the oldest non-critical one; False if all are critical."""
+        victim = next((key for key, (event, _) in self.pending.items() if self._is_low_priority(event)), None)
+        if victim is None:
+            victim = next((key for key, (event, _) in self.pending.items() if not self._is_critical(event)), None)
+        if victim is None:
+            return False
+        del self.pending[victim]
+        self.stats["dropped"] += 1
+        return True
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.stopped)
+                if self.stopped and not self.pending:
+                    return
+            # Let the frame fill up for one interval before draining it
+            time.sleep(self.interval)
+            with self.condition:
+                batch, self.pending = self.pending, OrderedDict()
+                # Wake critical pushes waiting for room
+                self.condition.notify_all()
+            self._emit(list(batch.values()))
+
+    def _emit(self, batch):
+        started = time.monotonic()
+        try:
+            self.emit_frame([event for event, _ in batch])
+        except Exception as e:
+            print(f"Error sending WebSocket frame: {e}")
+            with self.condition:
+                self.stats["emit_errors"] += 1
+            return
+        finished = time.monotonic()
+        latencies = [(finished - enqueued_at) * 1000 for _, enqueued_at in batch]
+        with self.condition:
+            stats = self.stats
+            stats["frames"] += 1
+            stats["emitted"] += len(batch)
+            stats["last_frame_size"] = len(batch)
+            stats["max_frame_size"] = max(stats["max_frame_size"], len(batch))
+            stats["last_emit_ms"] = round((finished - started) * 1000, 2)
+            stats["max_latency_ms"] = round(max(stats["max_latency_ms"], max(latencies)), 2)
+            stats["total_latency_ms"] += sum(latencies)
+
+    def close(self, timeout: float = 2.0):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.thread.join(timeout=timeout)
+
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats)
+            stats["queued"] = len(self.pending)
+        total_latency = stats.pop("total_latency_ms")
+        stats["avg_latency_ms"] = round(total_latency / stats["emitted"], 2) if stats["emitted"] else None
+        stats["interval_ms"] = round(self.interval * 1000)
+        stats["max_queue"] = self.max_queue
+        return stats
@@ -0,0 +1,364 @@
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, insert, select
+
+from database import SessionLocal, SimulationEvent
+
+
+class EventRing:
+    """Fixed-size ring of the most recent events addressed by their sequence number.
+
+    Sequence numbers are contiguous, so the slot of ``seq`` is ``seq % size`` and
+    both point lookups and range scans start without searching.
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self.slots = [None] * self.size
+        self.first_seq = None
+        self.last_seq = None
+
+    def append(self, event):
+        seq = event["seq"]
+        self.slots[seq % self.size] = event
+        self.last_seq = seq
+        if self.first_seq is None:
+            self.first_seq = seq
+        elif seq - self.first_seq >= self.size:
+            self.first_seq = seq - self.size + 1
+
+    def get(self, seq):
+        if self.first_seq is None or not self.first_seq <= seq <= self.last_seq:
+            return None
+        event = self.slots[seq % self.size]
+        return event if event is not None and event["seq"] == seq else None
+
+
+class SimulationEventStore:
+    """Append-only, queryable log of simulator events.
+
+    Every event gets a monotonically increasing ``seq`` and is written to the
+    ``simulation_events`` table in batches by a background thread, so the log
+    survives restarts and a whole shift can be paged through. Recent events are
+    also kept in an ``EventRing``; cursor reads that fall inside the ring are
+    answered from memory without touching the database. With ``retention_days``
+    set, the same thread deletes persisted events older than that every
+    ``prune_interval`` seconds, oldest first in batches of ``prune_batch_size``.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        ring_size: int = 5000,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+        max_pending: int = 20000,
+        retention_days: float = 0,
+        prune_interval: float = 3600.0,
+        prune_batch_size: int = 5000,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_pending = max(self.batch_size, max_pending)
+        self.retention_days = retention_days
+        self.prune_interval = prune_interval
+        self.prune_batch_size = max(1, prune_batch_size)
+        self.next_prune = time.monotonic()
+        self.ring = EventRing(ring_size)
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.pending = []
+        self.stats = {
+            "appended": 0,
+            "persisted": 0,
+            "flushes": 0,
+            "dropped": 0,
+            "errors": 0,
+            "last_error": None,
+            "last_flush_ms": 0.0,
+            "pruned": 0,
+            "last_prune_at": None,
+        }
+        self.next_seq = self._load_next_seq()
+        self.thread = threading.Thread(target=self._run, name="simulation-event-store", daemon=True)
+        self.thread.start()
+
+    def _load_next_seq(self):
+        """Continue after the highest persisted seq, creating the table on first use."""
+        session = self.session_factory()
+        try:
+            SimulationEvent.__table__.create(session.get_bind(), checkfirst=True)
+            return (session.query(func.max(SimulationEvent.id)).scalar() or 0) + 1
+        except Exception as e:
+            print(f"读取模拟事件序号失败，使用时间戳序号: {e}")
+            # Stay above anything written before so ids never collide once the database is back
+            return int(time.time() * 1000) * 1000
+        finally:
+            session.close()
+
+    # ----------------- write path -----------------
+    def append(self, event, publish=None):
+        """Assign the next ``seq`` to ``event`` (in place) and queue it for persistence.
+
+        ``publish`` (e.g. the emitter's ``push``) is called while the seq lock
+        is held, so events from concurrent lines reach subscribers in seq order.
+        """
+        with self.condition:
+            event["seq"] = self.next_seq
+            self.next_seq += 1
+            self.ring.append(event)
+            self.pending.append(event)
+            self.stats["appended"] += 1
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify()
+            if publish is not None:
+                publish(event)
+        return event
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.pending) >= self.batch_size, self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                # Already counted in stats; retried on the next round
+                pass
+            if self.retention_days and time.monotonic() >= self.next_prune:
+                self.next_prune = time.monotonic() + self.prune_interval
+                try:
+                    self.prune()
+                except Exception as e:
+                    print(f"清理过期模拟事件失败: {e}")
+
+    def flush(self):
+        with self.flush_lock:
+            with self.condition:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return 0
+            started = time.perf_counter()
+            session = self.session_factory()
+            try:
+                session.execute(insert(SimulationEvent), [self._row(event) for event in batch])
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                with self.condition:
+                    # Keep the unwritten batch ahead of newer events, bounded while the database is down
+                    self.pending = batch + self.pending
+                    overflow = len(self.pending) - self.max_pending
+                    if overflow > 0:
+                        del self.pending[:overflow]
+                        self.stats["dropped"] += overflow
+                    self.stats["errors"] += 1
+                    self.stats["last_error"] = str(e)
+                raise
+            finally:
+                session.close()
+            with self.condition:
+                self.stats["persisted"] += len(batch)
+                self.stats["flushes"] += 1
+                self.stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            return len(batch)
+
+    def prune(self):
+        """Delete persisted events older than ``retention_days``; returns how many were removed.
+
+        Each batch is its own short transaction picked through the created_at
+        index, so appends and flushes are never held up for long.
+        """
+        if not self.retention_days:
+            return 0
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+        expired = (
+            select(SimulationEvent.id)
+            .where(SimulationEvent.created_at < cutoff)
+            .order_by(SimulationEvent.created_at)
+            .limit(self.prune_batch_size)
+        )
+        removed = 0
+        session = self.session_factory()
+        try:
+            while True:
+                deleted = session.execute(delete(SimulationEvent).where(SimulationEvent.id.in_(expired))).rowcount
+                session.commit()
+                removed += deleted
+                if deleted < self.prune_batch_size:
+                    break
+        except Exception as e:
+            session.rollback()
+            with self.condition:
+                self.stats["errors"] += 1
+                self.stats["last_error"] = str(e)
+            raise
+        finally:
+            session.close()
+            with self.condition:
+                self.stats["pruned"] += removed
+        with self.condition:
+            self.stats["last_prune_at"] = datetime.now(timezone.utc).isoformat()
+        return removed
+
+    @staticmethod
+    def _row(event):
+        return {
+            "id": event["seq"],
+            "event_uid": event.get("id"),
+            "created_at": datetime.fromisoformat(event["timestamp"]),
+            "stage": event.get("stage"),
+            "level": event.get("level"),
+            "source": event.get("source"),
+            "line_id": event.get("line_id"),
+            "order_id": event.get("order_id"),
+            "product_id": event.get("product_id"),
+            "message": event.get("message"),
+            "payload": event,
+        }
+
+    # ----------------- read path -----------------
+    def query(self, since_id=None, before_id=None, until=None, order_id=None, stage=None, limit: int = 100):
+        """Cursor-paginated read.
+
+        With ``since_id`` events newer than the cursor are returned oldest first
+        (follow a live log); otherwise the newest events (older than ``before_id``
+        when given) are returned newest first. ``next_cursor`` is the seq to pass
+        as ``since_id`` / ``before_id`` for the next page.
+        """
+        limit = max(1, min(int(limit), 1000))
+        filters = {"until": until, "order_id": order_id, "stage": stage}
+        with self.condition:
+            if since_id is not None:
+                events = self._ring_forward(since_id, limit, filters)
+            else:
+                events = self._ring_backward(before_id, limit, filters)
+        if events is not None:
+            source = "memory"
+        else:
+            source = "database"
+            events = self._query_database(since_id, before_id, filters, limit + 1)
+        has_more = len(events) > limit
+        events = events[:limit]
+        if events:
+            next_cursor = events[-1]["seq"]
+        else:
+            next_cursor = since_id if since_id is not None else before_id
+        return {"events": events, "next_cursor": next_cursor, "has_more": has_more, "source": source}
+
+    def replay(self, last_seq, max_events: int = 500):
+        """Events a client that last saw ``last_seq`` has missed, oldest first.
+
+        At most the newest ``max_events`` are returned, from the ring when it
+        still holds them and from ``simulation_events`` otherwise (e.g. after a
+        restart, when the ring starts empty). Missing events that cannot be
+        returned this way (older than that window, or the database is
+        unavailable) are reported as the ``gap`` seq range. Returns None when
+        ``last_seq`` is ahead of this store (it comes from another log), so the
+        caller can fall back to a fresh snapshot.
+        """
+        with self.condition:
+            latest = self.next_seq - 1
+            if last_seq > latest:
+                return None
+            if last_seq == latest:
+                return {"events": [], "gap": None, "last_seq": latest}
+            first = max(last_seq + 1, latest - max(1, max_events) + 1)
+            in_ring = self.ring.first_seq is not None and self.ring.first_seq <= first
+            if in_ring:
+                events = [event for event in map(self.ring.get, range(first, latest + 1)) if event is not None]
+        if not in_ring:
+            try:
+                filters = {"until": None, "order_id": None, "stage": None}
+                events = [
+                    event for event in self._query_database(first - 1, None, filters, latest - first + 1)
+                    if event["seq"] <= latest
+                ]
+            except Exception as e:
+                print(f"读取模拟事件失败: {e}")
+                events, first = [], latest + 1
+        gap = {"from_seq": last_seq + 1, "to_seq": first - 1} if first > last_seq + 1 else None
+        return {"events": events, "gap": gap, "last_seq": latest}
+
+    @staticmethod
+    def _matches(event, filters):
+        if filters["stage"] and event.get("stage") != filters["stage"]:
+            return False
+        if filters["order_id"] is not None and event.get("order_id") != filters["order_id"]:
+            return False
+        if filters["until"] and datetime.fromisoformat(event["timestamp"]) > filters["until"]:
+            return False
+        return True
+
+    def _ring_forward(self, since_id, limit, filters):
+        ring = self.ring
+        if since_id >= self.next_seq - 1:
+            return []
+        if ring.first_seq is None or since_id < ring.first_seq - 1:
+            return None
+        events = []
+        # Collect one extra match so the caller can tell whether another page exists
+        for seq in range(since_id + 1, ring.last_seq + 1):
+            event = ring.get(seq)
+            if event is not None and self._matches(event, filters):
+                events.append(event)
+                if len(events) > limit:
+                    break
+        return events
+
+    def _ring_backward(self, before_id, limit, filters):
+        ring = self.ring
+        if ring.first_seq is None:
+            return None
+        start = ring.last_seq if before_id is None else min(before_id - 1, ring.last_seq)
+        if start < ring.first_seq:
+            return None
+        events = []
+        for seq in range(start, ring.first_seq - 1, -1):
+            event = ring.get(seq)
+            if event is not None and self._matches(event, filters):
+                events.append(event)
+                if len(events) > limit:
+                    return events
+        # The ring ran out before the page filled up: older events live only in the database
+        return None
+
+    def _query_database(self, since_id, before_id, filters, limit):
+        # Make sure the database also holds everything the ring has seen
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"刷新模拟事件失败: {e}")
+        session = self.session_factory()
+        try:
+            query = session.query(SimulationEvent.payload, SimulationEvent.id)
+            if filters["stage"]:
+                query = query.filter(SimulationEvent.stage == filters["stage"])
+            if filters["order_id"] is not None:
+                query = query.filter(SimulationEvent.order_id == filters["order_id"])
+            if filters["until"]:
+                query = query.filter(SimulationEvent.created_at <= filters["until"])
+            if since_id is not None:
+                query = query.filter(SimulationEvent.id > since_id).order_by(SimulationEvent.id.asc())
+            else:
+                if before_id is not None:
+                    query = query.filter(SimulationEvent.id < before_id)
+                query = query.order_by(SimulationEvent.id.desc())
+            return [dict(payload, seq=seq) for payload, seq in query.limit(limit).all()]
+        finally:
+            session.close()
+
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats)
+            stats["pending"] = len(self.pending)
+            stats["next_seq"] = self.next_seq
+            stats["retention_days"] = self.retention_days
+            stats["ring"] = {
+                "size": self.ring.size,
+                "first_seq": self.ring.first_seq,
+                "last_seq": self.ring.last_seq,
+            }
+        return stats
@@ -0,0 +1,275 @@
+import time
+import queue
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+from itertools import count, islice
+
+# Simulator methods that may be invoked over the command pipe
+WORKER_COMMANDS = {
+    "start",
+    "stop",
+    "pause",
+    "resume",
+    "clear_events",
+    "get_events",
+    "get_status",
+    "run_virtual",
+}
+
+
+# Long-running commands served on their own thread so short commands keep being answered
+BACKGROUND_COMMANDS = {"run_virtual"}
+
+
+def _worker_main(command_conn, event_queue, simulator_kwargs, line_configs=None):
+    """Entry point of the simulator process: serve commands until shutdown."""
+    from simulation import build_simulator
+
+    simulator = build_simulator(simulator_kwargs, line_configs)
+    send_lock = threading.Lock()
+    dropped = {"events": 0}
+    background = {}
+
+    def forward_event(event):
+        # Never let a slow web process stall the simulation: drop when the channel is full
+        try:
+            event_queue.put_nowait(event)
+        except queue.Full:
+            dropped["events"] += 1
+
+    def reply(request_id, status, result):
+        # Replies echo the request id so the proxy can route them to the waiting caller
+        with send_lock:
+            command_conn.send((request_id, status, result))
+
+    def execute(request_id, command, args, kwargs):
+        try:
+            result = getattr(simulator, command)(*args, **kwargs)
+            if command == "get_status":
+                result = dict(result, events_dropped=dropped["events"])
+            reply(request_id, "ok", result)
+        except Exception as exc:
+            reply(request_id, "error", f"{exc}\n{traceback.format_exc()}")
+        finally:
+            background.pop(command, None)
+
+    simulator.set_websocket_callback(forward_event)
+
+    while True:
+        try:
+            request_id, command, args, kwargs = command_conn.recv()
+        except (EOFError, OSError):
+            break
+        if command == "shutdown":
+            simulator.stop()
+            reply(request_id, "ok", None)
+            break
+        if command not in WORKER_COMMANDS:
+            reply(request_id, "error", f"unknown command: {command}")
+            continue
+        if command in BACKGROUND_COMMANDS:
+            if command in background:
+                reply(request_id, "error", f"模拟器忙：{command} 正在执行")
+                continue
+            background[command] = threading.Thread(
+                target=execute, args=(request_id, command, args, kwargs), name=f"simulator-{command}", daemon=True
+            )
+            background[command].start()
+            continue
+        execute(request_id, command, args, kwargs)
+
+
+class SimulatorProcessProxy:
+    """Runs the simulator (one line or a multi-line coordinator) in a dedicated process and proxies its API.
+
+    Commands travel over a pipe, each tagged with a request id; a reader
+    thread routes every reply to the caller waiting for that id, so short
+    commands (status, stop, pause) are answered while a virtual run is still
+    in flight. A command that times out raises TimeoutError and its late
+    reply is dropped. Events come back over a queue drained by a listener
+    thread that keeps a local event buffer and feeds ``websocket_callback``;
+    events the worker had to drop because that queue was full are counted in
+    ``get_status()["worker"]["events_dropped"]``. If the worker dies the web
+    process keeps serving and the next ``start()`` spawns a fresh worker.
+    """
+
+    def __init__(self, simulator_kwargs=None, line_configs=None, max_events: int = 400, event_queue_size: int = 10000, command_timeout: float = 10.0):
+        self.simulator_kwargs = simulator_kwargs or {}
+        self.line_configs = line_configs
+        self.events = deque(maxlen=max_events)
+        self.event_queue_size = event_queue_size
+        self.command_timeout = command_timeout
+        self.websocket_callback = None
+        self.context = multiprocessing.get_context("spawn")
+        # Guards spawning the worker and writing to the pipe; never held while waiting for a reply
+        self.lock = threading.Lock()
+        self.process = None
+        self.command_conn = None
+        self.event_queue = None
+        self.listener = None
+        self.reader = None
+        self.request_ids = count(1)
+        # request id -> [threading.Event, reply, pipe the request was sent on]
+        self.pending = {}
+
+    # ----------------- worker management -----------------
+    def _alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def _ensure_worker(self):
+        if self._alive():
+            return
+        parent_conn, child_conn = self.context.Pipe()
+        self.event_queue = self.context.Queue(maxsize=self.event_queue_size)
+        self.process = self.context.Process(
+            target=_worker_main,
+            args=(child_conn, self.event_queue, self.simulator_kwargs, self.line_configs),
+            name="production-simulator",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.command_conn = parent_conn
+        self.listener = threading.Thread(target=self._drain_events, args=(self.event_queue, self.process), daemon=True)
+        self.listener.start()
+        self.reader = threading.Thread(target=self._read_replies, args=(parent_conn,), daemon=True)
+        self.reader.start()
+
+    def _read_replies(self, conn):
+        while True:
+            try:
+                request_id, status, result = conn.recv()
+            except (EOFError, OSError) as exc:
+                # Worker gone: fail every caller still waiting on this pipe
+                with self.lock:
+                    waiting = [self.pending.pop(request_id) for request_id, slot in list(self.pending.items()) if slot[2] is conn]
+                for slot in waiting:
+                    slot[1] = ("exited", str(exc) or "连接已关闭")
+                    slot[0].set()
+                return
+            with self.lock:
+                slot = self.pending.pop(request_id, None)
+            # No slot: the caller already timed out
+            if slot is not None:
+                slot[1] = (status, result)
+                slot[0].set()
+
+    def _drain_events(self, event_queue, process):
+        while True:
+            try:
+                event = event_queue.get(timeout=1.0)
+            except queue.Empty:
+                if not process.is_alive():
+                    return
+                continue
+            except (EOFError, OSError):
+                return
+            self.events.appendleft(event)
+            if self.websocket_callback:
+                try:
+                    self.websocket_callback(event)
+                except Exception as e:
+                    print(f"WebSocket push failed: {e}")
+
+    def _call(self, command, *args, timeout=None, spawn=True, **kwargs):
+        slot = [threading.Event(), None, None]
+        with self.lock:
+            if spawn:
+                self._ensure_worker()
+            elif not self._alive():
+                raise RuntimeError("模拟器进程未运行")
+            slot[2] = self.command_conn
+            request_id = next(self.request_ids)
+            self.pending[request_id] = slot
+            process = self.process
+            try:
+                self.command_conn.send((request_id, command, args, kwargs))
+            except (EOFError, OSError) as exc:
+                self.pending.pop(request_id, None)
+                raise RuntimeError(f"模拟器进程已退出: {exc}")
+        wait = self.command_timeout if timeout is None else timeout
+        deadline = time.monotonic() + wait if wait else None
+        while not slot[0].wait(1.0 if deadline is None else min(1.0, max(0.0, deadline - time.monotonic()))):
+            if deadline is not None and time.monotonic() >= deadline:
+                with self.lock:
+                    self.pending.pop(request_id, None)
+                raise TimeoutError(f"模拟器进程响应超时: {command}")
+            if not process.is_alive():
+                with self.lock:
+                    self.pending.pop(request_id, None)
+                raise RuntimeError("模拟器进程已退出")
+        status, result = slot[1]
+        if status == "exited":
+            raise RuntimeError(f"模拟器进程已退出: {result}")
+        if status == "error":
+            raise RuntimeError(result)
+        return result
+
+    def shutdown(self):
+        if self._alive():
+            try:
+                self._call("shutdown", spawn=False)
+            except Exception:
+                pass
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+
+    # ----------------- simulator API -----------------
+    @property
+    def running(self):
+        return self.get_status().get("running", False)
+
+    @property
+    def paused(self):
+        return self.get_status().get("paused", False)
+
+    def set_websocket_callback(self, callback):
+        self.websocket_callback = callback
+
+    def start(self):
+        return self._call("start")
+
+    def stop(self):
+        if self._alive():
+            return self._call("stop", spawn=False)
+
+    def pause(self):
+        if self._alive():
+            return self._call("pause", spawn=False)
+
+    def resume(self):
+        if self._alive():
+            return self._call("resume", spawn=False)
+
+    def clear_events(self):
+        self.events.clear()
+        if self._alive():
+            self._call("clear_events", spawn=False)
+
+    def get_events(self, limit: int = 100):
+        return list(islice(self.events, max(1, limit)))
+
+    def run_virtual(self, **kwargs):
+        # A virtual run can take a while; wait for it without the command timeout (other commands interleave)
+        return self._call("run_virtual", timeout=0, **kwargs)
+
+    def get_status(self):
+        worker = {
+            "mode": "process",
+            "alive": self._alive(),
+            "pid": self.process.pid if self.process else None,
+            "exitcode": self.process.exitcode if self.process else None,
+        }
+        if not worker["alive"]:
+            return {"running": False, "paused": False, "events": len(self.events), "worker": worker}
+        try:
+            status = self._call("get_status", spawn=False)
+        except Exception as exc:
+            return {"running": False, "paused": False, "events": len(self.events), "worker": {**worker, "error": str(exc)}}
+        worker["events_dropped"] = status.pop("events_dropped", 0)
+        status["events"] = len(self.events)
+        status["worker"] = worker
+        return status
@@ -0,0 +1,84 @@
+from datetime import datetime
+
+from sqlalchemy import func
+
+from database import Device, Station
+from device_parameters import dialect_insert
+
+# Station codes recognised in device codes (type-station-number, e.g. camera-read-1)
+STATION_CODES = ("read", "label", "pick", "qc", "network")
+STATION_PREFIXES = ("工位:", "工位：")
+
+
+def station_of(description, code):
+    """Station named by a device's legacy conventions.
+
+    ``工位:<name>`` in the description, else the second part of the code when
+    it is a known station code; ``unknown`` otherwise. Used to (re)assign
+    devices whose description or code is written without an explicit
+    station_id.
+    """
+    if description:
+        for prefix in STATION_PREFIXES:
+            if description.startswith(prefix):
+                return description.replace(prefix, "").strip()
+    if code:
+        parts = code.split("-")
+        if len(parts) >= 2 and parts[1] in STATION_CODES:
+            return parts[1]
+    return "unknown"
+
+
+def resolve_station_ids(session, pairs):
+    """Station ids for ``(application_id, code)`` pairs, creating missing stations.
+
+    Missing stations are inserted with one ``ON CONFLICT DO NOTHING`` statement
+    (safe against concurrent writers) and all ids are read back in one query.
+    """
+    pairs = {(application_id, code) for application_id, code in pairs if code}
+    if not pairs:
+        return {}
+    now = datetime.utcnow()
+    insert = dialect_insert(session)
+    session.execute(
+        insert(Station.__table__).on_conflict_do_nothing(index_elements=["application_id", "code"]),
+        [
+            {"application_id": application_id, "code": code, "name": code, "sort_order": 0, "created_at": now, "updated_at": now}
+            for application_id, code in sorted(pairs, key=lambda pair: (pair[0] or 0, pair[1]))
+        ],
+    )
+    codes = {code for _, code in pairs}
+    rows = session.query(Station.id, Station.application_id, Station.code).filter(Station.code.in_(codes))
+    return {(row.application_id, row.code): row.id for row in rows if (row.application_id, row.code) in pairs}
+
+
+def derive_station_ids(session, devices):
+    """Station ids derived from description/code for ``{key: (application_id, description, code)}``.
+
+    Keys whose conventions name no station (or that have no application) map
+    to None, matching the ``unknown`` group of the legacy parsing.
+    """
+    names = {}
+    for key, (application_id, description, code) in devices.items():
+        name = station_of(description, code)
+        if name != "unknown" and application_id is not None:
+            names[key] = (application_id, name)
+    station_ids = resolve_station_ids(session, names.values())
+    return {key: station_ids.get(names[key]) if key in names else None for key in devices}
+
+
+def default_station_id(session, application_id, description, code):
+    """Station id derived from description/code for a device without an explicit station."""
+    return derive_station_ids(session, {None: (application_id, description, code)})[None]
+
+
+def station_device_counts(session, station_ids):
+    """Number of devices per station id, from the station_id index."""
+    if not station_ids:
+        return {}
+    rows = (
+        session.query(Device.station_id, func.count(Device.id))
+        .filter(Device.station_id.in_(station_ids))
+        .group_by(Device.station_id)
+    )
+    return dict(rows.all())
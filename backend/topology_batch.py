@@ -0,0 +1,179 @@
+from datetime import datetime
+
+from sqlalchemy import bindparam, delete, or_, tuple_, update
+
+from database import Device, DeviceTopology
+from device_parameters import dialect_insert
+
+TOPOLOGY_FIELDS = ("connection_type", "description")
+MAX_BATCH_CHANGES = 5000
+
+
+def _pair(item):
+    return (str(item.get("source_device_code") or "").strip(), str(item.get("target_device_code") or "").strip())
+
+
+def _parse_diff(diff):
+    """Normalize ``{"add": [...], "update": [...], "remove": [...]}``; raise ValueError(errors)."""
+    errors = []
+    if not isinstance(diff, dict):
+        raise ValueError(["请求体必须为包含 add / update / remove 的对象"])
+    lists = {}
+    for key in ("add", "update", "remove"):
+        value = diff.get(key) or []
+        if not isinstance(value, list):
+            errors.append(f"{key} 必须为数组")
+            value = []
+        lists[key] = value
+    if sum(len(value) for value in lists.values()) > MAX_BATCH_CHANGES:
+        errors.append(f"单次最多提交 {MAX_BATCH_CHANGES} 项变更")
+    if errors:
+        raise ValueError(errors)
+
+    adds = []
+    for index, item in enumerate(lists["add"]):
+        source, target = _pair(item) if isinstance(item, dict) else ("", "")
+        if not source or not target:
+            errors.append(f"add[{index}]: 源设备编码和目标设备编码为必填项")
+        elif source == target:
+            errors.append(f"add[{index}]: 源设备和目标设备不能相同")
+        else:
+            adds.append({
+                "source_device_code": source,
+                "target_device_code": target,
+                "connection_type": item.get("connection_type") or "network",
+                "description": item.get("description") or "",
+            })
+
+    def reference(item, key, index):
+        """Connection addressed by ``id`` or by its (source, target) pair."""
+        if isinstance(item, int) and not isinstance(item, bool):
+            return item
+        if isinstance(item, dict):
+            if item.get("id") is not None:
+                try:
+                    return int(item["id"])
+                except (TypeError, ValueError):
+                    pass
+            else:
+                source, target = _pair(item)
+                if source and target:
+                    return (source, target)
+        errors.append(f"{key}[{index}]: 需要连接 id 或 source_device_code / target_device_code")
+        return None
+
+    updates = []
+    for index, item in enumerate(lists["update"]):
+        ref = reference(item, "update", index)
+        if ref is not None:
+            updates.append((ref, {field: item[field] for field in TOPOLOGY_FIELDS if field in item}))
+    removes = [ref for ref in (reference(item, "remove", index) for index, item in enumerate(lists["remove"])) if ref is not None]
+    if errors:
+        raise ValueError(errors)
+    return adds, updates, removes
+
+
+def apply_topology_diff(session, application_id, diff):
+    """Validate and apply a batch of topology changes for one application.
+
+    Existing connections addressed by update / remove are loaded with one
+    query, every device code involved is checked against the application with
+    one ``IN`` query, then removals run as one DELETE, additions as one
+    ``INSERT ... ON CONFLICT (source_device_code, target_device_code) DO
+    UPDATE`` (adding an existing connection updates it) and updates as one
+    executemany UPDATE. Nothing is written when any change is invalid: a
+    ValueError carrying the list of messages is raised instead. The caller
+    commits.
+
+    Returns the removed ids and the added / updated connections.
+    """
+    adds, updates, removes = _parse_diff(diff)
+
+    ids = {ref for ref, _ in updates if isinstance(ref, int)} | {ref for ref in removes if isinstance(ref, int)}
+    pairs = {ref for ref, _ in updates if isinstance(ref, tuple)} | {ref for ref in removes if isinstance(ref, tuple)}
+    existing = {}
+    if ids or pairs:
+        conditions = []
+        if ids:
+            conditions.append(DeviceTopology.id.in_(ids))
+        if pairs:
+            conditions.append(tuple_(DeviceTopology.source_device_code, DeviceTopology.target_device_code).in_(pairs))
+        for topology in session.query(DeviceTopology).filter(or_(*conditions)):
+            existing[topology.id] = topology
+            existing[(topology.source_device_code, topology.target_device_code)] = topology
+
+    errors = []
+
+    def resolve(ref, key):
+        topology = existing.get(ref)
+        if topology is None:
+            errors.append(f"{key}: 拓扑连接不存在: {ref if isinstance(ref, int) else ' -> '.join(ref)}")
+        return topology
+
+    updated = []
+    for ref, fields in updates:
+        topology = resolve(ref, "update")
+        if topology is not None:
+            updated.append((topology, fields))
+    removed = [topology for topology in (resolve(ref, "remove") for ref in removes) if topology is not None]
+
+    codes = {code for item in adds for code in _pair(item)}
+    for topology in [topology for topology, _ in updated] + removed:
+        codes.update((topology.source_device_code, topology.target_device_code))
+    known = {
+        row.code for row in session.query(Device.code).filter(Device.application_id == application_id, Device.code.in_(codes))
+    } if codes else set()
+    for code in sorted(codes - known):
+        errors.append(f"设备 '{code}' 不存在或不属于该应用")
+
+    added_pairs = [_pair(item) for item in adds]
+    if len(set(added_pairs)) != len(added_pairs):
+        errors.append("add 中存在重复的连接")
+    removed_ids = {topology.id for topology in removed}
+    if set(added_pairs) & {(t.source_device_code, t.target_device_code) for t in removed}:
+        errors.append("同一连接不能同时出现在 add 和 remove 中")
+    if {topology.id for topology, _ in updated} & removed_ids:
+        errors.append("同一连接不能同时出现在 update 和 remove 中")
+    if errors:
+        raise ValueError(errors)
+
+    now = datetime.utcnow()
+    table = DeviceTopology.__table__
+    if removed_ids:
+        session.execute(delete(table).where(table.c.id.in_(removed_ids)))
+
+    added = []
+    if adds:
+        insert = dialect_insert(session)
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=["source_device_code", "target_device_code"],
+            set_={
+                "connection_type": statement.excluded.connection_type,
+                "description": statement.excluded.description,
+                "updated_at": statement.excluded.updated_at,
+            },
+        ).returning(table.c.id, table.c.source_device_code, table.c.target_device_code, table.c.connection_type, table.c.description)
+        rows = session.execute(statement, [dict(item, created_at=now, updated_at=now) for item in adds])
+        added = [dict(row._mapping) for row in rows]
+
+    changed = []
+    if updated:
+        rows = []
+        for topology, fields in updated:
+            values = {field: fields.get(field, getattr(topology, field)) for field in TOPOLOGY_FIELDS}
+            rows.append({"b_id": topology.id, "b_connection_type": values["connection_type"], "b_description": values["description"]})
+            changed.append({
+                "id": topology.id,
+                "source_device_code": topology.source_device_code,
+                "target_device_code": topology.target_device_code,
+                **values,
+            })
+        session.execute(
+            update(table)
+            .where(table.c.id == bindparam("b_id"))
+            .values(connection_type=bindparam("b_connection_type"), description=bindparam("b_description"), updated_at=now),
+            rows,
+        )
+
+    return {"removed_ids": sorted(removed_ids), "added": added, "updated": changed}
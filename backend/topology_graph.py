@@ -0,0 +1,219 @@
+import threading
+import time
+from collections import deque
+
+from database import Device, DeviceTopology, DeviceType
+
+
+class TopologyGraph:
+    """In-memory adjacency index over device_topologies.
+
+    Edges point from a device to its uplink (``source -> target``, e.g.
+    camera -> switch -> core switch), so "upstream" follows outgoing edges and
+    "downstream" follows incoming ones. Node attributes (id, name, type,
+    application) come from the devices table.
+
+    The index is built on first use (or by ``load`` at startup). Topology
+    writes in this process update it in place via ``add_edge`` /
+    ``update_edge`` / ``remove_edge``; device writes call ``mark_stale`` so
+    the next query rebuilds it. ``max_age`` seconds bound the staleness
+    caused by writes from other processes.
+    """
+
+    def __init__(self, session_factory, max_age):
+        self.session_factory = session_factory
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        self._edges = {}
+        self._uplinks = {}
+        self._downlinks = {}
+        self._nodes = {}
+        # Bumped by every write so a rebuild racing with a write is not trusted
+        self._version = 0
+
+    # ----------------- building -----------------
+    def load(self):
+        """Rebuild the index with two column-projected queries."""
+        with self._lock:
+            version = self._version
+        session = self.session_factory()
+        try:
+            nodes = {
+                row.code: {"id": row.id, "code": row.code, "name": row.name, "type": row.type_code, "application_id": row.application_id}
+                for row in session.query(
+                    Device.id, Device.code, Device.name, Device.application_id, DeviceType.code.label("type_code")
+                ).outerjoin(DeviceType, DeviceType.id == Device.device_type_id)
+            }
+            edges = session.query(
+                DeviceTopology.id, DeviceTopology.source_device_code,
+                DeviceTopology.target_device_code, DeviceTopology.connection_type,
+            ).all()
+        finally:
+            session.close()
+        with self._lock:
+            self._nodes = nodes
+            self._edges = {}
+            self._uplinks = {}
+            self._downlinks = {}
+            for edge_id, source, target, connection_type in edges:
+                self._link(edge_id, source, target, connection_type)
+            self._loaded_at = time.monotonic() if version == self._version else None
+
+    def mark_stale(self):
+        with self._lock:
+            self._version += 1
+            self._loaded_at = None
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.max_age:
+                return
+        self.load()
+
+    # ----------------- incremental updates -----------------
+    def _link(self, edge_id, source, target, connection_type):
+        self._edges[edge_id] = (source, target, connection_type)
+        self._uplinks.setdefault(source, {})[target] = connection_type
+        self._downlinks.setdefault(target, {})[source] = connection_type
+
+    def add_edge(self, edge_id, source, target, connection_type=None):
+        with self._lock:
+            self._version += 1
+            if self._loaded_at is not None:
+                self._link(edge_id, source, target, connection_type)
+
+    def update_edge(self, edge_id, connection_type):
+        with self._lock:
+            self._version += 1
+            if edge_id in self._edges:
+                source, target, _ = self._edges[edge_id]
+                self._link(edge_id, source, target, connection_type)
+
+    def remove_edge(self, edge_id):
+        with self._lock:
+            self._version += 1
+            edge = self._edges.pop(edge_id, None)
+            if edge is None:
+                return
+            source, target, _ = edge
+            self._uplinks.get(source, {}).pop(target, None)
+            self._downlinks.get(target, {}).pop(source, None)
+
+    # ----------------- queries -----------------
+    def node(self, code):
+        """Device attributes for ``code``; codes only referenced by edges have no id / name."""
+        return self._nodes.get(code) or {"id": None, "code": code, "name": None, "type": None, "application_id": None}
+
+    def has_node(self, code):
+        self._ensure_loaded()
+        with self._lock:
+            return code in self._nodes or code in self._uplinks or code in self._downlinks
+
+    def upstream_path(self, code, to=None):
+        """Shortest uplink path from ``code`` to ``to``, or to the nearest root
+        (a device without uplinks, e.g. the core switch) when ``to`` is None.
+
+        Returns the list of codes including both ends, or None when unreachable.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            previous = {code: None}
+            queue = deque([code])
+            while queue:
+                current = queue.popleft()
+                uplinks = self._uplinks.get(current) or {}
+                if current == to or (to is None and not uplinks):
+                    path = []
+                    while current is not None:
+                        path.append(current)
+                        current = previous[current]
+                    return path[::-1]
+                for target in uplinks:
+                    if target not in previous:
+                        previous[target] = current
+                        queue.append(target)
+            return None
+
+    def downstream(self, code):
+        """Devices whose uplinks lead to ``code``: {code: hops}, breadth-first."""
+        self._ensure_loaded()
+        with self._lock:
+            return self._downstream(code)
+
+    def _downstream(self, code):
+        depth = {code: 0}
+        queue = deque([code])
+        while queue:
+            current = queue.popleft()
+            for source in self._downlinks.get(current) or {}:
+                if source not in depth:
+                    depth[source] = depth[current] + 1
+                    queue.append(source)
+        del depth[code]
+        return depth
+
+    def blast_radius(self, code):
+        """(downstream, isolated) for a failure of ``code``.
+
+        ``isolated`` are the downstream devices that lose every path to a
+        root once ``code`` is removed; devices with a redundant uplink that
+        bypasses it stay connected.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            downstream = self._downstream(code)
+            if not downstream:
+                return downstream, set()
+            # Roots reachable from the downstream set without passing through ``code``
+            reachable_roots = set()
+            seen = set(downstream)
+            queue = deque(downstream)
+            while queue:
+                current = queue.popleft()
+                uplinks = self._uplinks.get(current) or {}
+                if not uplinks and current not in downstream:
+                    reachable_roots.add(current)
+                for target in uplinks:
+                    if target != code and target not in seen:
+                        seen.add(target)
+                        queue.append(target)
+            # Walk back down from those roots, avoiding ``code``
+            alive = set(reachable_roots)
+            queue = deque(reachable_roots)
+            while queue:
+                current = queue.popleft()
+                for source in self._downlinks.get(current) or {}:
+                    if source != code and source not in alive:
+                        alive.add(source)
+                        queue.append(source)
+            return downstream, {device for device in downstream if device not in alive}
+
+    def components(self, application_id):
+        """Connected components (ignoring direction) of one application's devices.
+
+        Only edges whose both ends belong to the application are followed.
+        Returns lists of codes, largest component first.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            members = {code for code, node in self._nodes.items() if node["application_id"] == application_id}
+            seen = set()
+            components = []
+            for start in sorted(members):
+                if start in seen:
+                    continue
+                seen.add(start)
+                component = [start]
+                queue = deque([start])
+                while queue:
+                    current = queue.popleft()
+                    neighbours = list(self._uplinks.get(current) or {}) + list(self._downlinks.get(current) or {})
+                    for neighbour in neighbours:
+                        if neighbour in members and neighbour not in seen:
+                            seen.add(neighbour)
+                            component.append(neighbour)
+                            queue.append(neighbour)
+                components.append(sorted(component))
+            components.sort(key=lambda component: (-len(component), component[0]))
+            return components